@@ -13,28 +13,102 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from itertools import chain
 from swift.account.utils import FakeAccountBroker, get_response_headers
+from swift.common.request_helpers import get_param
 from swift.common.swob import HTTPOk, HTTPNoContent
-from swift.common.utils import json
+from swift.common.utils import json, config_true_value
 from xml.sax import saxutils
 
+from gluster.swift.common import Glusterfs
+from gluster.swift.common.utils import iter_listing_chunks, iter_json_listing
+
+
+def _iter_account_listing(account, account_list, response_content_type):
+    """
+    Yield the body of an account listing piece by piece, the same as
+    account_listing_response() builds it.
+    """
+    if response_content_type == 'application/json':
+        return iter_json_listing(
+            {'subdir': name} if is_subdir else
+            {'name': name, 'count': object_count, 'bytes': bytes_used}
+            for (name, object_count, bytes_used, is_subdir) in account_list)
+    elif response_content_type.endswith('/xml'):
+        return _iter_account_listing_xml(account, account_list)
+    return (r[0] + '\n' for r in account_list)
+
+
+def _iter_account_listing_xml(account, account_list):
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield '<account name=%s>' % saxutils.quoteattr(account)
+    for (name, object_count, bytes_used, is_subdir) in account_list:
+        if is_subdir:
+            yield '\n<subdir name=%s />' % saxutils.quoteattr(name)
+        else:
+            yield '\n<container><name>%s</name><count>%s</count>' \
+                  '<bytes>%s</bytes></container>' % \
+                  (saxutils.escape(name), object_count, bytes_used)
+    yield '\n</account>'
+
+
+def streaming_account_listing_response(account, req, response_content_type,
+                                       broker, limit='', marker='',
+                                       end_marker='', prefix='',
+                                       delimiter='', reverse=False):
+    """
+    Same as account_listing_response(), but the body is sent as the
+    containers are listed instead of being built in memory first.
+    """
+    resp_headers = get_response_headers(broker)
+
+    account_list = broker.iter_containers(limit, marker, end_marker,
+                                          prefix, delimiter,
+                                          response_content_type, reverse)
+    if response_content_type != 'application/json' and \
+            not response_content_type.endswith('/xml'):
+        try:
+            first = next(account_list)
+        except StopIteration:
+            resp = HTTPNoContent(request=req, headers=resp_headers)
+            resp.content_type = response_content_type
+            resp.charset = 'utf-8'
+            return resp
+        account_list = chain([first], account_list)
+    ret = HTTPOk(app_iter=iter_listing_chunks(_iter_account_listing(
+        account, account_list, response_content_type)),
+        request=req, headers=resp_headers)
+    ret.content_type = response_content_type
+    ret.charset = 'utf-8'
+    return ret
+
 
 def account_listing_response(account, req, response_content_type, broker=None,
                              limit='', marker='', end_marker='', prefix='',
-                             delimiter=''):
+                             delimiter='', reverse=None):
     """
     This is an exact copy of swift.account.utis.account_listing_response()
     except for one difference i.e this method passes response_content_type
     to broker.list_containers_iter() method.
+
+    The account server of this Swift release does not pass reverse, so it
+    is taken from the request when not given.
     """
+    if reverse is None:
+        reverse = config_true_value(get_param(req, 'reverse'))
     if broker is None:
         broker = FakeAccountBroker()
+    elif Glusterfs._streaming_listings and \
+            not isinstance(broker, FakeAccountBroker):
+        return streaming_account_listing_response(
+            account, req, response_content_type, broker, limit, marker,
+            end_marker, prefix, delimiter, reverse)
 
     resp_headers = get_response_headers(broker)
 
     account_list = broker.list_containers_iter(limit, marker, end_marker,
                                                prefix, delimiter,
-                                               response_content_type)
+                                               response_content_type, reverse)
     if response_content_type == 'application/json':
         data = []
         for (name, object_count, bytes_used, is_subdir) in account_list:
@@ -15,21 +15,34 @@
 
 import os
 import stat
+import time
 import errno
+import fcntl
+import logging
+from hashlib import md5
+from itertools import imap
+
+from eventlet import spawn_n
 
 from gluster.swift.common.fs_utils import dir_empty, mkdirs, do_chown, \
     do_exists, do_touch, do_stat
 from gluster.swift.common.utils import validate_account, validate_container, \
-    get_container_details, get_account_details, create_container_metadata, \
+    get_account_details, restore_metadata, \
     create_account_metadata, DEFAULT_GID, get_container_metadata, \
     get_account_metadata, DEFAULT_UID, validate_object, \
     create_object_metadata, read_metadata, write_metadata, X_CONTENT_TYPE, \
     X_CONTENT_LENGTH, X_TIMESTAMP, X_PUT_TIMESTAMP, X_ETAG, X_OBJECTS_COUNT, \
-    X_BYTES_USED, X_CONTAINER_COUNT, DIR_TYPE, rmobjdir, dir_is_object, \
-    list_objects_gsexpiring_container, normalize_timestamp
-from gluster.swift.common import Glusterfs
+    X_BYTES_USED, X_CONTAINER_COUNT, X_STATS_PENDING, X_STATS_REFRESHED, \
+    DIR_TYPE, rmobjdir, \
+    dir_is_object, normalize_timestamp, \
+    iter_container_objects, imap_ordered, get_container_usage, \
+    get_object_metadata, X_ETAG_PENDING, read_sys_metadata, StoredMetadata
+from gluster.swift.common import Glusterfs, listing_cache, etag_queue
 from gluster.swift.common.exceptions import FileOrDirNotFoundError, \
     GlusterFileSystemIOError
+from gluster.swift.common.container_index import ContainerIndex
+from gluster.swift.common.existence_filter import create_filter, \
+    drop_filter
 from gluster.swift.obj.expirer import delete_tracker_object
 from swift.common.constraints import MAX_META_COUNT, MAX_META_OVERALL_SIZE
 from swift.common.swob import HTTPBadRequest
@@ -41,6 +54,15 @@ DATADIR = 'containers'
 # Create a dummy db_file in Glusterfs.RUN_DIR
 _db_file = ""
 
+# Container and account directories whose stats are being refreshed in the
+# background by this process (stats_refresh_ttl)
+_stats_refreshing = set()
+# Directory of RUN_DIR holding the lock files that keep the processes of a
+# node from refreshing the stats of the same directory at the same time
+STATS_LOCK_DIR = 'stats_refresh'
+# Container indexes being rebuilt in the background by this process
+_index_rebuilding = set()
+
 
 def _read_metadata(dd):
     """ Filter read metadata so that it always returns a tuple that includes
@@ -53,12 +75,201 @@ def _read_metadata(dd):
         metadata are used for much, so this should not hurt anything.
     """
     metadata_i = read_metadata(dd)
-    metadata = {}
+    metadata = StoredMetadata()
     timestamp = 0
     for key, value in metadata_i.iteritems():
         if not isinstance(value, tuple):
             value = (value, timestamp)
         metadata[key] = value
+    # Written back over what was read
+    metadata.serialized = getattr(metadata_i, 'serialized', None)
+    return metadata
+
+
+def _read_object_metadata(obj_path, delimiter):
+    """
+    Read the metadata of an object to be listed, creating it if it is
+    missing or invalid. Returns None if the object no longer exists.
+    """
+    try:
+        # The listing fields alone, when the object has a copy of them
+        metadata = read_sys_metadata(obj_path) or read_metadata(obj_path)
+    except GlusterFileSystemIOError as err:
+        if err.errno in (errno.ENOENT, errno.ESTALE):
+            return None
+        raise
+    if not metadata or not validate_object(metadata):
+        if delimiter == '/' and obj_path[-1] == delimiter:
+            clean_obj_path = obj_path[:-1]
+        else:
+            clean_obj_path = obj_path
+        try:
+            stats = do_stat(clean_obj_path)
+            if stats and stat.S_ISREG(stats.st_mode):
+                # Never read the file here to compute its ETag: report the
+                # last known one, if any, and leave it to the ETag queue.
+                new_metadata = get_object_metadata(clean_obj_path, stats,
+                                                   etag=False)
+                metadata = dict(metadata or {})
+                metadata.update(new_metadata)
+                metadata.setdefault(X_ETAG, '')
+                metadata[X_ETAG_PENDING] = clean_obj_path
+            else:
+                metadata = create_object_metadata(clean_obj_path, stats)
+        except OSError as e:
+            # FIXME - total hack to get upstream swift ported unit
+            # test cases working for now.
+            if e.errno not in (errno.ENOENT, errno.ESTALE):
+                raise
+    return metadata
+
+
+def _read_object_stats(obj_path, delimiter):
+    """
+    Same as _read_object_metadata(), but the listing fields of a file are
+    filled from its stat alone, without reading its xattrs: its mtime as
+    timestamp, its size, and an empty content type and ETag. Directories
+    still have their metadata read, to tell directory objects apart.
+    """
+    if delimiter == '/' and obj_path[-1] == delimiter:
+        clean_obj_path = obj_path[:-1]
+    else:
+        clean_obj_path = obj_path
+    stats = do_stat(clean_obj_path)
+    if not stats or not stat.S_ISREG(stats.st_mode):
+        return _read_object_metadata(obj_path, delimiter)
+    return {X_TIMESTAMP: normalize_timestamp(stats.st_mtime),
+            X_CONTENT_LENGTH: stats.st_size,
+            X_CONTENT_TYPE: '',
+            X_ETAG: ''}
+
+
+def _stats_refreshed_recently(metadata):
+    """
+    Return True if the stats of a container or account were refreshed less
+    than stats_refresh_ttl seconds ago, according to its metadata.
+    """
+    try:
+        refreshed = float(metadata[X_STATS_REFRESHED][0])
+    except (KeyError, IndexError, TypeError, ValueError):
+        return False
+    return time.time() - refreshed < Glusterfs._stats_refresh_ttl
+
+
+def _lock_stats_refresh(path):
+    """
+    Lock the refresh of the stats of the directory at path, or the rebuild
+    of the container index at path, against the other processes of the
+    node.
+
+    :returns: the fd of the lock file, to close once done, or None if
+              another process holds the lock
+    """
+    lock_dir = os.path.join(Glusterfs.RUN_DIR, STATS_LOCK_DIR)
+    lock_file = os.path.join(lock_dir, md5(path).hexdigest() + '.lock')
+    try:
+        fd = os.open(lock_file, os.O_CREAT | os.O_RDWR)
+    except OSError as err:
+        if err.errno != errno.ENOENT:
+            raise
+        mkdirs(lock_dir)
+        fd = os.open(lock_file, os.O_CREAT | os.O_RDWR)
+    try:
+        fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError as err:
+        os.close(fd)
+        if err.errno in (errno.EACCES, errno.EAGAIN):
+            return None
+        raise
+    return fd
+
+
+def _refresh_stats(path, metadata, refresh, threadpool):
+    """
+    Run refresh() in a real thread in the background, unless the stats of the
+    container or account at path were refreshed less than stats_refresh_ttl
+    seconds ago according to metadata, or are already being refreshed by
+    this or another process of the node. refresh() is to read the metadata
+    again, check it with _stats_refreshed_recently() in case another process
+    just refreshed the stats, and record the time of the refresh.
+    """
+    if path in _stats_refreshing or _stats_refreshed_recently(metadata):
+        return
+    lock_fd = _lock_stats_refresh(path)
+    if lock_fd is None:
+        return
+    _stats_refreshing.add(path)
+
+    def _run():
+        try:
+            threadpool.force_run_in_thread(refresh)
+        except Exception:
+            logging.exception("Failed to refresh stats of %s", path)
+        finally:
+            _stats_refreshing.discard(path)
+            # Releases the lock
+            os.close(lock_fd)
+
+    spawn_n(_run)
+
+
+def _rebuild_index(index, threadpool):
+    """
+    Rebuild a container index that is not ready in a real thread in the
+    background, unless this or another process of the node already is.
+    Listings and stats walk the container meanwhile, as without an index.
+    """
+    path = index.db_file
+    if path in _index_rebuilding:
+        return
+    lock_fd = _lock_stats_refresh(path)
+    if lock_fd is None:
+        return
+    _index_rebuilding.add(path)
+
+    def _run():
+        try:
+            threadpool.force_run_in_thread(index.rebuild)
+        except Exception:
+            logging.exception("Failed to rebuild container index %s", path)
+        finally:
+            _index_rebuilding.discard(path)
+            # Releases the lock
+            os.close(lock_fd)
+
+    spawn_n(_run)
+
+
+def _init_container_metadata(cont_path, metadata):
+    """
+    Write the metadata of a container directory whose metadata is missing or
+    invalid, without walking it. Its object count and bytes used are marked
+    pending, keeping the values found in metadata if any, and are to be
+    computed in the background.
+    """
+    new_metadata = get_container_metadata(cont_path, count=False)
+    if X_STATS_PENDING in new_metadata:
+        for key in (X_OBJECTS_COUNT, X_BYTES_USED):
+            if key in metadata:
+                new_metadata[key] = metadata[key]
+    return restore_metadata(cont_path, new_metadata, metadata)
+
+
+def _read_container_metadata(cont_path):
+    """
+    Read the metadata of a container to be listed, initializing it if it is
+    missing or invalid. Returns None if the container no longer exists.
+    """
+    try:
+        metadata = _read_metadata(cont_path)
+        if not metadata or not validate_container(metadata):
+            metadata = _init_container_metadata(cont_path, metadata)
+    except (OSError, GlusterFileSystemIOError) as err:
+        # FIXME - total hack to get upstream swift ported unit
+        # test cases working for now.
+        if err.errno not in (errno.ENOENT, errno.ESTALE):
+            raise
+        return None
     return metadata
 
 
@@ -80,12 +291,17 @@ def filter_prefix(objects, prefix):
                 break
 
 
-def filter_delimiter(objects, delimiter, prefix, marker, path=None):
+def filter_delimiter(objects, delimiter, prefix, marker, path=None,
+                     reverse=False):
     """
     Accept a sorted list of strings, returning strings that:
       1. begin with "prefix" (empty string matches all)
       2. does not match the "path" argument
       3. does not contain the delimiter in the given prefix length
+
+    With reverse, the list is sorted in reverse order, and marker is the
+    end_marker of the listing, the one bound a rolled up name can be equal
+    to.
     """
     assert delimiter
     assert prefix is not None
@@ -97,17 +313,17 @@ def filter_delimiter(objects, delimiter, prefix, marker, path=None):
             if object_name == path:
                 continue
             if skip_name:
-                if object_name < skip_name:
+                if _skipped(object_name, skip_name, reverse):
                     continue
                 else:
                     skip_name = None
             end = object_name.find(delimiter, len(prefix))
             if end >= 0 and (len(object_name) > (end + 1)):
-                skip_name = object_name[:end] + chr(ord(delimiter) + 1)
+                skip_name = _skip_name(object_name, end, delimiter, reverse)
                 continue
         else:
             if skip_name:
-                if object_name < skip_name:
+                if _skipped(object_name, skip_name, reverse):
                     continue
                 else:
                     skip_name = None
@@ -116,11 +332,24 @@ def filter_delimiter(objects, delimiter, prefix, marker, path=None):
                 dir_name = object_name[:end + 1]
                 if dir_name != marker:
                     yield dir_name
-                skip_name = object_name[:end] + chr(ord(delimiter) + 1)
+                skip_name = _skip_name(object_name, end, delimiter, reverse)
                 continue
         yield object_name
 
 
+def _skip_name(object_name, end, delimiter, reverse):
+    if reverse:
+        # Names under the rolled up one all start with it
+        return object_name[:end + 1]
+    return object_name[:end] + chr(ord(delimiter) + 1)
+
+
+def _skipped(object_name, skip_name, reverse):
+    if reverse:
+        return object_name.startswith(skip_name)
+    return object_name < skip_name
+
+
 def filter_marker(objects, marker):
     """
     Accept sorted list of strings, return all strings whose value is strictly
@@ -141,6 +370,24 @@ def filter_prefix_as_marker(objects, prefix):
             yield object_name
 
 
+def filter_reverse(objects, marker, end_marker, prefix):
+    """
+    Accept a list of strings, sorted in reverse order, and return all the
+    strings starting with prefix that are strictly less than marker and
+    strictly greater than end_marker, the bounds of a reverse listing.
+    """
+    for object_name in objects:
+        if marker and object_name >= marker:
+            continue
+        if end_marker and object_name <= end_marker:
+            break
+        if prefix and not object_name.startswith(prefix):
+            if object_name > prefix:
+                continue
+            break
+        yield object_name
+
+
 def filter_end_marker(objects, end_marker):
     """
     Accept a list of strings, sorted, and return all the strings that are
@@ -177,7 +424,10 @@ class DiskCommon(object):
         assert logger is not None
         self.logger = logger
         self.account = account
+        self.drive = drive
         self.datadir = os.path.join(root, drive)
+        # Number of directories read in parallel by full scans
+        self.walk_workers = Glusterfs.get_walk_workers(drive)
         self._dir_exists = False
 
         # nthread=0 is intentional. This ensures that no green pool is
@@ -186,6 +436,48 @@ class DiskCommon(object):
         # which has a threadpool of 20 threads (default)
         self.threadpool = ThreadPool(nthreads=0)
 
+    def _refresh_stats(self, update):
+        """
+        Call update(refreshed=True) in the background to bring the stats
+        stored in the metadata up to date, if they were last refreshed more
+        than stats_refresh_ttl seconds ago and no refresh is in progress. The
+        stats stored so far are served meanwhile.
+        """
+        def _refresh():
+            # The stats may have been refreshed by another process since
+            # the metadata was read by this request.
+            if self._dir_exists_read_metadata() and \
+                    not _stats_refreshed_recently(self.metadata):
+                update(refreshed=True)
+
+        _refresh_stats(self.datadir, self.metadata, _refresh,
+                       self.threadpool)
+
+    def _write_stats(self, stats, refreshed=False):
+        """
+        Store stats, a dict of metadata items, in the metadata of the
+        directory as it is now rather than as it was read in self.metadata:
+        it may have been changed since, by a POST while the directory was
+        walked for example. With refreshed, the time of the refresh is
+        stored as well.
+        """
+        try:
+            metadata = _read_metadata(self.datadir)
+        except GlusterFileSystemIOError as err:
+            if err.errno in (errno.ENOENT, errno.ESTALE):
+                return
+            raise
+        if not metadata:
+            # Removed meanwhile
+            return
+        metadata.update(stats)
+        metadata.pop(X_STATS_PENDING, None)
+        if refreshed:
+            metadata[X_STATS_REFRESHED] = \
+                (normalize_timestamp(time.time()), 0)
+        write_metadata(self.datadir, metadata)
+        self.metadata = metadata
+
     def _dir_exists_read_metadata(self):
         self._dir_exists = os.path.isdir(self.datadir)
         if self._dir_exists:
@@ -350,6 +642,10 @@ class DiskDir(DiskCommon):
         self.gid = int(gid)
 
         self.container = container
+        if Glusterfs._container_index and self.account != 'gsexpiring':
+            self._index = ContainerIndex(self.datadir, self.container)
+        else:
+            self._index = None
         self.datadir = os.path.join(self.datadir, self.container)
 
         if self.account == 'gsexpiring':
@@ -375,13 +671,13 @@ class DiskDir(DiskCommon):
         if not self._dir_exists_read_metadata():
             return
 
-        if not self.metadata:
-            create_container_metadata(self.datadir)
+        # Never walk the container while serving a request, its objects are
+        # counted in the background instead.
+        if not self.metadata or not validate_container(self.metadata):
+            _init_container_metadata(self.datadir, self.metadata)
             self.metadata = _read_metadata(self.datadir)
-        else:
-            if not validate_container(self.metadata):
-                create_container_metadata(self.datadir)
-                self.metadata = _read_metadata(self.datadir)
+        if X_STATS_PENDING in self.metadata:
+            self._refresh_stats(self._update_object_count)
 
     def update_status_changed_at(self, timestamp):
         return
@@ -399,9 +695,30 @@ class DiskDir(DiskCommon):
     def list_objects_iter(self, limit, marker, end_marker,
                           prefix, delimiter, path=None,
                           storage_policy_index=0,
-                          out_content_type=None):
+                          out_content_type=None, stat_only=False,
+                          reverse=False):
         """
         Returns tuple of name, created_at, size, content_type, etag.
+
+        With stat_only, the xattrs of files are not read: see
+        _read_object_stats().
+
+        With reverse, objects are listed in reverse order, less than marker
+        and greater than end_marker, same as Swift.
+        """
+        return list(self.iter_objects(limit, marker, end_marker, prefix,
+                                      delimiter, path, storage_policy_index,
+                                      out_content_type, stat_only, reverse))
+
+    def iter_objects(self, limit, marker, end_marker,
+                     prefix, delimiter, path=None,
+                     storage_policy_index=0,
+                     out_content_type=None, stat_only=False,
+                     reverse=False):
+        """
+        Same as list_objects_iter(), but yields the listing entries one at a
+        time, reading the metadata of the objects only as they are consumed.
+        Used to stream listing responses.
         """
         assert limit >= 0
         assert not delimiter or (len(delimiter) == 1 and ord(delimiter) <= 254)
@@ -415,25 +732,28 @@ class DiskDir(DiskCommon):
         elif delimiter and not prefix:
             prefix = ''
 
-        container_list = []
-
-        if self.account == 'gsexpiring':
-            objects = list_objects_gsexpiring_container(self.datadir)
+        if self._index is not None and \
+                self._get_index_stats() is not None:
+            # Names come out of the index sorted and already bounded by
+            # marker, end_marker and prefix.
+            objects = self._index.iter_names(marker, end_marker, prefix,
+                                             reverse)
+        elif self.account == 'gsexpiring':
+            # Tracker containers can hold millions of zero-byte files during
+            # expiry backlogs: walk them lazily too, stopping at limit,
+            # without reading the xattrs of their directories.
+            objects = iter_container_objects(self.datadir, marker,
+                                             end_marker, prefix, delimiter,
+                                             path, reverse, files_only=True)
+        elif Glusterfs._listing_cache:
+            objects = listing_cache.iter_container_objects(
+                self.datadir, marker, end_marker, prefix, reverse)
         else:
-            objects = self._update_object_count()
-        if objects:
-            objects.sort()
-        else:
-            # No objects in container , return empty list
-            return container_list
-
-        if end_marker:
-            objects = filter_end_marker(objects, end_marker)
-
-        if marker and marker >= prefix:
-            objects = filter_marker(objects, marker)
-        elif prefix:
-            objects = filter_prefix_as_marker(objects, prefix)
+            # Walk the container lazily, in sorted order, reading only the
+            # directories under the prefix needed to fill the listing.
+            objects = iter_container_objects(self.datadir, marker,
+                                             end_marker, prefix, delimiter,
+                                             path, reverse)
 
         if prefix is None:
             # No prefix, we don't need to apply the other arguments, we just
@@ -449,8 +769,9 @@ class DiskDir(DiskCommon):
                 else:
                     objects = filter_prefix(objects, prefix)
             else:
-                objects = filter_delimiter(objects, delimiter, prefix, marker,
-                                           path)
+                objects = filter_delimiter(
+                    objects, delimiter, prefix,
+                    end_marker if reverse else marker, path, reverse)
 
         if out_content_type == 'text/plain' or \
                 self.account == 'gsexpiring':
@@ -467,40 +788,27 @@ class DiskDir(DiskCommon):
             # When out_content_type is 'application/json', the caller
             # expects each record entry to have the following ordered
             # fields: (name, timestamp, size, content_type, etag)
+            count = 0
             for obj in objects:
-                container_list.append((obj, '0', 0, 'text/plain', ''))
-                if len(container_list) >= limit:
-                        break
-            return container_list
+                yield (obj, '0', 0, 'text/plain', '')
+                count += 1
+                if count >= limit:
+                    break
+            return
 
         count = 0
-        for obj in objects:
-            obj_path = os.path.join(self.datadir, obj)
-            try:
-                metadata = read_metadata(obj_path)
-            except GlusterFileSystemIOError as err:
-                if err.errno in (errno.ENOENT, errno.ESTALE):
-                    # obj might have been deleted by another process
-                    # since the objects list was originally built
-                    continue
-                else:
-                    raise err
-            if not metadata or not validate_object(metadata):
-                if delimiter == '/' and obj_path[-1] == delimiter:
-                    clean_obj_path = obj_path[:-1]
-                else:
-                    clean_obj_path = obj_path
-                try:
-                    metadata = create_object_metadata(clean_obj_path)
-                except OSError as e:
-                    # FIXME - total hack to get upstream swift ported unit
-                    # test cases working for now.
-                    if e.errno not in (errno.ENOENT, errno.ESTALE):
-                        raise
+        for obj, metadata in self._iter_objects_metadata(objects, delimiter,
+                                                         stat_only):
+            if metadata is None:
+                # obj might have been deleted by another process since the
+                # objects list was originally built
+                continue
             if not Glusterfs._implicit_dir_objects and metadata \
                     and metadata[X_CONTENT_TYPE] == DIR_TYPE \
                     and not dir_is_object(metadata):
                 continue
+            if X_ETAG_PENDING in metadata:
+                etag_queue.queue_etag(metadata[X_ETAG_PENDING], self.logger)
             list_item = []
             list_item.append(obj)
             if metadata:
@@ -508,25 +816,64 @@ class DiskDir(DiskCommon):
                 list_item.append(int(metadata[X_CONTENT_LENGTH]))
                 list_item.append(metadata[X_CONTENT_TYPE])
                 list_item.append(metadata[X_ETAG])
-            container_list.append(list_item)
+            yield list_item
             count += 1
             if count >= limit:
                 break
 
-        return container_list
+    def _iter_objects_metadata(self, objects, delimiter, stat_only=False):
+        """
+        Yield (name, metadata) tuples for the objects, in order. Metadata is
+        read for up to Glusterfs._listing_metadata_concurrency objects at a
+        time in real threads, as every read is a round trip to the GlusterFS
+        servers.
+        """
+        read = _read_object_stats if stat_only \
+            else _read_object_metadata
+
+        def _read(obj):
+            return obj, read(os.path.join(self.datadir, obj), delimiter)
+
+        def _read_in_thread(obj):
+            return self.threadpool.force_run_in_thread(_read, obj)
 
-    def _update_object_count(self):
-        objects, object_count, bytes_used = get_container_details(self.datadir)
+        if Glusterfs._listing_metadata_concurrency > 1:
+            return imap_ordered(_read_in_thread, objects,
+                                Glusterfs._listing_metadata_concurrency)
+        return imap(_read, objects)
 
+    def _get_index_stats(self):
+        """
+        Return the stats of the index of the container, or None if it is not
+        ready, the first time since it was enabled or since it was dropped
+        after a failed update. It is rebuilt in the background then.
+        """
+        stats = self._index.get_stats()
+        if stats is None:
+            _rebuild_index(self._index, self.threadpool)
+        return stats
+
+    def _update_object_count(self, refreshed=False):
+        """
+        Walk the container to update its stats, and with refreshed, record
+        the time of the refresh as well.
+        """
+        if Glusterfs._listing_cache:
+            object_count, bytes_used = get_container_usage(
+                self.datadir, listing_cache.get_container_details)
+        else:
+            object_count, bytes_used = get_container_usage(
+                self.datadir, workers=self.walk_workers)
+        self._set_object_count(object_count, bytes_used, refreshed)
+
+    def _set_object_count(self, object_count, bytes_used, refreshed=False):
         if X_OBJECTS_COUNT not in self.metadata \
                 or int(self.metadata[X_OBJECTS_COUNT][0]) != object_count \
                 or X_BYTES_USED not in self.metadata \
-                or int(self.metadata[X_BYTES_USED][0]) != bytes_used:
-            self.metadata[X_OBJECTS_COUNT] = (object_count, 0)
-            self.metadata[X_BYTES_USED] = (bytes_used, 0)
-            write_metadata(self.datadir, self.metadata)
-
-        return objects
+                or int(self.metadata[X_BYTES_USED][0]) != bytes_used \
+                or X_STATS_PENDING in self.metadata or refreshed:
+            self._write_stats({X_OBJECTS_COUNT: (object_count, 0),
+                               X_BYTES_USED: (bytes_used, 0)}, refreshed)
 
     def get_info_is_deleted(self):
         if not self._dir_exists:
@@ -542,9 +889,21 @@ class DiskDir(DiskCommon):
                       reported_put_timestamp, reported_delete_timestamp,
                       reported_object_count, and reported_bytes_used.
         """
-        if self._dir_exists and Glusterfs._container_update_object_count and \
-                self.account != 'gsexpiring':
-            self._update_object_count()
+        index_stats = None
+        if self._dir_exists and self._index is not None:
+            index_stats = self._get_index_stats()
+        if not self._dir_exists or self.account == 'gsexpiring':
+            pass
+        elif index_stats is not None:
+            # The index keeps count of objects and bytes used as they are
+            # created and deleted, no need to walk the container.
+            self._set_object_count(index_stats['object_count'],
+                                   index_stats['bytes_used'])
+        elif Glusterfs._container_update_object_count:
+            if Glusterfs._stats_refresh_ttl:
+                self._refresh_stats(self._update_object_count)
+            else:
+                self._update_object_count()
 
         data = {'account': self.account, 'container': self.container,
                 'object_count': self.metadata.get(
@@ -577,15 +936,35 @@ class DiskDir(DiskCommon):
         Create and write metatdata to directory/container.
         :param metadata: Metadata to write.
         """
-        if not self._dir_exists:
+        created = not self._dir_exists
+        if created:
             mkdirs(self.datadir)
             # If we create it, ensure we own it.
             do_chown(self.datadir, self.uid, self.gid)
-        metadata = get_container_metadata(self.datadir)
+            if self._index is not None:
+                # A new container is empty, so its index is complete.
+                self._index.create(ready=True)
+            if self.account != 'gsexpiring':
+                # And so is its existence filter
+                create_filter(os.path.join(self.root, self.drive),
+                              self.container)
+        metadata = get_container_metadata(self.datadir, count=False)
+        if created:
+            # A new container is empty, so its counts are known.
+            metadata.pop(X_STATS_PENDING, None)
+        elif X_STATS_PENDING in metadata:
+            # The directory may have been filled over FUSE, count its
+            # objects in the background and keep the counts known so far
+            # meanwhile.
+            for key in (X_OBJECTS_COUNT, X_BYTES_USED):
+                if key in self.metadata:
+                    metadata[key] = self.metadata[key]
         metadata[X_TIMESTAMP] = (timestamp, 0)
         write_metadata(self.datadir, metadata)
         self.metadata = metadata
         self._dir_exists = True
+        if X_STATS_PENDING in metadata:
+            self._refresh_stats(self._update_object_count)
 
     def update_put_timestamp(self, timestamp):
         """
@@ -624,8 +1003,14 @@ class DiskDir(DiskCommon):
         # Let's check and see if it has directories that
         # where created by the code, but not by the
         # caller as objects
-        rmobjdir(self.datadir)
+        rmobjdir(self.datadir, workers=self.walk_workers)
         self._dir_exists = False
+        if not do_exists(self.datadir):
+            if self._index is not None:
+                self._index.drop()
+            if Glusterfs._existence_filter:
+                drop_filter(os.path.join(self.root, self.drive),
+                            self.container)
 
     def set_x_container_sync_points(self, sync_point1, sync_point2):
         self.metadata['x_container_sync_point1'] = sync_point1
@@ -767,37 +1152,59 @@ class DiskAccount(DiskCommon):
         # occurs from within the account directory implicitly.
         return
 
-    def _update_container_count(self):
+    def _update_container_count(self, refreshed=False):
+        """
+        Count the containers of the account, and with refreshed, record the
+        time of the refresh as well.
+        """
         containers, container_count = get_account_details(self.datadir)
 
-        if X_CONTAINER_COUNT not in self.metadata \
+        if refreshed or X_CONTAINER_COUNT not in self.metadata \
                 or int(self.metadata[X_CONTAINER_COUNT][0]) != container_count:
-            self.metadata[X_CONTAINER_COUNT] = (container_count, 0)
-            write_metadata(self.datadir, self.metadata)
+            self._write_stats({X_CONTAINER_COUNT: (container_count, 0)},
+                              refreshed)
 
         return containers
 
     def list_containers_iter(self, limit, marker, end_marker,
-                             prefix, delimiter, response_content_type=None):
+                             prefix, delimiter, response_content_type=None,
+                             reverse=False):
         """
         Return tuple of name, object_count, bytes_used, 0(is_subdir).
         Used by account server.
+
+        With reverse, containers are listed in reverse order, less than
+        marker and greater than end_marker, same as Swift.
+        """
+        return list(self.iter_containers(limit, marker, end_marker, prefix,
+                                         delimiter, response_content_type,
+                                         reverse))
+
+    def iter_containers(self, limit, marker, end_marker,
+                        prefix, delimiter, response_content_type=None,
+                        reverse=False):
+        """
+        Same as list_containers_iter(), but yields the listing entries one at
+        a time, reading the metadata of the containers only as they are
+        consumed. Used to stream listing responses.
         """
         if delimiter and not prefix:
             prefix = ''
 
-        account_list = []
         containers = self._update_container_count()
         if containers:
-            containers.sort()
+            containers.sort(reverse=reverse)
         else:
             # No containers in account, return empty list
-            return account_list
+            return
 
-        if containers and end_marker:
+        if reverse:
+            containers = filter_reverse(containers, marker, end_marker,
+                                        prefix)
+        elif containers and end_marker:
             containers = filter_end_marker(containers, end_marker)
 
-        if containers:
+        if containers and not reverse:
             if marker and marker >= prefix:
                 containers = filter_marker(containers, marker)
             elif prefix:
@@ -817,8 +1224,9 @@ class DiskAccount(DiskCommon):
                 else:
                     containers = filter_prefix(containers, prefix)
             else:
-                containers = filter_delimiter(containers, delimiter, prefix,
-                                              marker)
+                containers = filter_delimiter(
+                    containers, delimiter, prefix,
+                    end_marker if reverse else marker, reverse=reverse)
 
         if response_content_type == 'text/plain' or \
                 self.account == 'gsexpiring':
@@ -834,40 +1242,62 @@ class DiskAccount(DiskCommon):
             # 'application/json', the caller expects each record entry to have
             # the following ordered fields:
             # (name, object_count, bytes_used, is_subdir)
+            count = 0
             for container in containers:
                 # When response_content_type == 'text/plain', Swift will only
                 # consume the name of the container (first element of tuple).
                 # Refer: swift.account.utils.account_listing_response()
-                account_list.append((container, 0, 0, 0))
-                if len(account_list) >= limit:
+                yield (container, 0, 0, 0)
+                count += 1
+                if count >= limit:
                     break
-            return account_list
+            return
 
         count = 0
-        for cont in containers:
+        for cont, metadata in self._iter_containers_metadata(containers):
             list_item = []
-            metadata = None
             list_item.append(cont)
-            cont_path = os.path.join(self.datadir, cont)
-            metadata = _read_metadata(cont_path)
-            if not metadata or not validate_container(metadata):
-                try:
-                    metadata = create_container_metadata(cont_path)
-                except OSError as e:
-                    # FIXME - total hack to get upstream swift ported unit
-                    # test cases working for now.
-                    if e.errno not in (errno.ENOENT, errno.ESTALE):
-                        raise
             if metadata:
+                if X_STATS_PENDING in metadata:
+                    self._refresh_container_stats(cont, metadata)
                 list_item.append(metadata[X_OBJECTS_COUNT][0])
                 list_item.append(metadata[X_BYTES_USED][0])
                 list_item.append(0)
-            account_list.append(list_item)
+            yield list_item
             count += 1
             if count >= limit:
                 break
 
-        return account_list
+    def _refresh_container_stats(self, container, metadata):
+        """
+        Count the objects of a container of the account in the background.
+        """
+        def _refresh():
+            broker = DiskDir(self.root, self.drive, self.account, container,
+                             self.logger)
+            if not _stats_refreshed_recently(broker.metadata):
+                broker._update_object_count(refreshed=True)
+
+        _refresh_stats(os.path.join(self.datadir, container), metadata,
+                       _refresh, self.threadpool)
+
+    def _iter_containers_metadata(self, containers):
+        """
+        Yield (name, metadata) tuples for the containers, in order, reading
+        the metadata of up to Glusterfs._listing_metadata_concurrency
+        containers at a time in real threads.
+        """
+        def _read(cont):
+            return cont, _read_container_metadata(
+                os.path.join(self.datadir, cont))
+
+        def _read_in_thread(cont):
+            return self.threadpool.force_run_in_thread(_read, cont)
+
+        if Glusterfs._listing_metadata_concurrency > 1:
+            return imap_ordered(_read_in_thread, containers,
+                                Glusterfs._listing_metadata_concurrency)
+        return imap(_read, containers)
 
     def get_info(self):
         """
@@ -878,7 +1308,10 @@ class DiskAccount(DiskCommon):
         """
         if Glusterfs._account_update_container_count and \
                 self.account != 'gsexpiring':
-            self._update_container_count()
+            if Glusterfs._stats_refresh_ttl:
+                self._refresh_stats(self._update_container_count)
+            else:
+                self._update_container_count()
 
         data = {'account': self.account, 'created_at': '1',
                 'put_timestamp': '1', 'delete_timestamp': '1',
@@ -38,6 +38,24 @@ _implicit_dir_objects = False
 _container_update_object_count = False
 _account_update_container_count = False
 _read_pickled_metadata = True
+_metadata_format = 'json'
+_metadata_compression_threshold = 0
+_system_metadata_xattr = False
+_container_index = False
+_listing_metadata_concurrency = 16
+_listing_cache = False
+_stats_refresh_ttl = 0
+_walk_workers = 1
+_walk_workers_per_volume = {}
+_etag_queue_size = 1024
+_etag_queue_workers = 2
+_listing_dir_cache_size = 100000
+_streaming_listings = False
+_streaming_listing_limit = 0
+_existence_filter = False
+_existence_filter_capacity = 100000
+_existence_filter_refresh = 0
+_existence_filter_verify = 100
 
 if _fs_conf.read(os.path.join(SWIFT_DIR, 'fs.conf')):
     try:
@@ -105,10 +123,145 @@ if _fs_conf.read(os.path.join(SWIFT_DIR, 'fs.conf')):
     except (NoSectionError, NoOptionError):
         pass
 
+    try:
+        if _fs_conf.get('DEFAULT', 'metadata_format',
+                        "json").strip().lower() == 'binary':
+            _metadata_format = 'binary'
+    except (NoSectionError, NoOptionError):
+        pass
+
+    try:
+        _metadata_compression_threshold = \
+            int(_fs_conf.get('DEFAULT', 'metadata_compression_threshold',
+                             _metadata_compression_threshold))
+    except (NoSectionError, NoOptionError, ValueError):
+        pass
+
+    try:
+        _system_metadata_xattr = _fs_conf.get('DEFAULT',
+                                              'system_metadata_xattr',
+                                              "off") in TRUE_VALUES
+    except (NoSectionError, NoOptionError):
+        pass
+
+    try:
+        _container_index = _fs_conf.get('DEFAULT',
+                                        'container_index',
+                                        "off") in TRUE_VALUES
+    except (NoSectionError, NoOptionError):
+        pass
+
+    try:
+        _listing_metadata_concurrency = \
+            int(_fs_conf.get('DEFAULT', 'listing_metadata_concurrency',
+                             _listing_metadata_concurrency))
+    except (NoSectionError, NoOptionError, ValueError):
+        pass
+
+    try:
+        _listing_cache = _fs_conf.get('DEFAULT',
+                                      'listing_cache',
+                                      "off") in TRUE_VALUES
+    except (NoSectionError, NoOptionError):
+        pass
+
+    try:
+        _stats_refresh_ttl = \
+            float(_fs_conf.get('DEFAULT', 'stats_refresh_ttl',
+                               _stats_refresh_ttl))
+    except (NoSectionError, NoOptionError, ValueError):
+        pass
+
+    try:
+        _walk_workers = int(_fs_conf.get('DEFAULT', 'walk_workers',
+                                         _walk_workers))
+    except (NoSectionError, NoOptionError, ValueError):
+        pass
+
+    try:
+        # Comma separated list of volume:workers
+        _walk_workers_per_volume = dict(
+            (volume.strip(), int(workers)) for volume, workers in
+            (item.split(':') for item in _fs_conf.get(
+                'DEFAULT', 'walk_workers_per_volume').split(',')
+             if item.strip()))
+    except (NoSectionError, NoOptionError, ValueError):
+        pass
+
+    try:
+        _etag_queue_size = int(_fs_conf.get('DEFAULT', 'etag_queue_size',
+                                            _etag_queue_size))
+    except (NoSectionError, NoOptionError, ValueError):
+        pass
+
+    try:
+        _etag_queue_workers = int(_fs_conf.get('DEFAULT',
+                                               'etag_queue_workers',
+                                               _etag_queue_workers))
+    except (NoSectionError, NoOptionError, ValueError):
+        pass
+
+    try:
+        _listing_dir_cache_size = \
+            int(_fs_conf.get('DEFAULT', 'listing_dir_cache_size',
+                             _listing_dir_cache_size))
+    except (NoSectionError, NoOptionError, ValueError):
+        pass
+
+    try:
+        _streaming_listings = _fs_conf.get('DEFAULT',
+                                           'streaming_listings',
+                                           "off") in TRUE_VALUES
+    except (NoSectionError, NoOptionError):
+        pass
+
+    try:
+        _streaming_listing_limit = \
+            int(_fs_conf.get('DEFAULT', 'streaming_listing_limit',
+                             _streaming_listing_limit))
+    except (NoSectionError, NoOptionError, ValueError):
+        pass
+
+    try:
+        _existence_filter = _fs_conf.get('DEFAULT',
+                                         'existence_filter',
+                                         "off") in TRUE_VALUES
+    except (NoSectionError, NoOptionError):
+        pass
+
+    try:
+        _existence_filter_capacity = \
+            int(_fs_conf.get('DEFAULT', 'existence_filter_capacity',
+                             _existence_filter_capacity))
+    except (NoSectionError, NoOptionError, ValueError):
+        pass
+
+    try:
+        _existence_filter_refresh = \
+            float(_fs_conf.get('DEFAULT', 'existence_filter_refresh',
+                               _existence_filter_refresh))
+    except (NoSectionError, NoOptionError, ValueError):
+        pass
+
+    try:
+        _existence_filter_verify = \
+            int(_fs_conf.get('DEFAULT', 'existence_filter_verify',
+                             _existence_filter_verify))
+    except (NoSectionError, NoOptionError, ValueError):
+        pass
+
 
 NAME = 'glusterfs'
 
 
+def get_walk_workers(volume):
+    """
+    Number of directories read in parallel when the directory tree of a
+    container of volume is scanned in full.
+    """
+    return _walk_workers_per_volume.get(volume, _walk_workers)
+
+
 def _busy_wait(full_mount_path):
     # Iterate for definite number of time over a given
     # interval for successful mount
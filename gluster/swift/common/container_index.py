@@ -0,0 +1,397 @@
+# Copyright (c) 2016 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Persistent, sorted index of the object names present in a container.
+
+Listing a container otherwise requires walking its entire directory tree and
+sorting the names found. The index is a small SQLite database per container
+that the object server keeps up to date on every PUT and DELETE, and that the
+container server reads with marker/prefix/end_marker range queries.
+
+The index also records the size of every object, and keeps the object count
+and bytes used of the container up to date with triggers, so that accurate
+container stats no longer require walking the container.
+
+The databases live in a hidden directory at the root of the volume so that
+every node serving the volume sees the same index.
+"""
+
+import os
+import stat
+import logging
+import sqlite3
+from hashlib import md5
+from itertools import islice
+from contextlib import contextmanager
+
+from eventlet import sleep
+
+from gluster.swift.common import Glusterfs
+from gluster.swift.common.utils import INDEX_DIR, iter_container_objects, \
+    prefix_end_marker
+from gluster.swift.common.fs_utils import mkdirs, do_unlink, do_stat
+
+# Seconds to wait on a database locked by another process
+LOCK_TIMEOUT = 25
+# Number of names fetched from the database in one query while listing
+PAGE_SIZE = 1000
+# Number of names inserted in one transaction during a rebuild
+REBUILD_BATCH = 10000
+
+# Bumped whenever the schema changes. Indexes with another version are
+# rebuilt from scratch.
+SCHEMA_VERSION = 3
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS object (
+        name TEXT PRIMARY KEY,
+        epoch INTEGER NOT NULL DEFAULT 0,
+        size INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS stat (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS tombstone (
+        name TEXT PRIMARY KEY,
+        epoch INTEGER NOT NULL DEFAULT 0
+    );
+    INSERT OR IGNORE INTO stat (key, value) VALUES ('version', %d);
+    INSERT OR IGNORE INTO stat (key, value) VALUES ('epoch', 0);
+    INSERT OR IGNORE INTO stat (key, value) VALUES ('rebuilding', 0);
+    INSERT OR IGNORE INTO stat (key, value) VALUES ('ready', 0);
+    INSERT OR IGNORE INTO stat (key, value) VALUES ('object_count', 0);
+    INSERT OR IGNORE INTO stat (key, value) VALUES ('bytes_used', 0);
+
+    CREATE TRIGGER IF NOT EXISTS object_insert AFTER INSERT ON object
+    BEGIN
+        UPDATE stat SET value = value + 1 WHERE key = 'object_count';
+        UPDATE stat SET value = value + new.size WHERE key = 'bytes_used';
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS object_delete AFTER DELETE ON object
+    BEGIN
+        UPDATE stat SET value = value - 1 WHERE key = 'object_count';
+        UPDATE stat SET value = value - old.size WHERE key = 'bytes_used';
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS object_update AFTER UPDATE OF size
+    ON object
+    BEGIN
+        UPDATE stat SET value = value - old.size + new.size
+        WHERE key = 'bytes_used';
+    END;
+""" % SCHEMA_VERSION
+
+
+def get_index_path(volume_path, container):
+    """
+    Return the path of the index database of a container. Container names
+    can be as long as a file name, so the database is named after a hash of
+    the container name instead.
+    """
+    return os.path.join(volume_path, INDEX_DIR,
+                        md5(container).hexdigest() + '.db')
+
+
+class ContainerIndex(object):
+    """
+    Sorted index of object names of a single container.
+
+    :param volume_path: path to the mounted volume (account)
+    :param container: container name
+    """
+
+    def __init__(self, volume_path, container):
+        self.volume_path = volume_path
+        self.container = container
+        self.cont_path = os.path.join(volume_path, container)
+        self.db_file = get_index_path(volume_path, container)
+
+    @contextmanager
+    def _get_conn(self):
+        conn = sqlite3.connect(self.db_file, timeout=LOCK_TIMEOUT)
+        try:
+            # Object names are byte strings and must compare the same way
+            # they do in Python.
+            conn.text_factory = str
+            # Avoid creating and removing a journal file on every
+            # transaction, which is expensive over FUSE.
+            conn.execute('PRAGMA journal_mode = TRUNCATE')
+            yield conn
+        finally:
+            conn.close()
+
+    def exists(self):
+        return os.path.exists(self.db_file)
+
+    def _get_stats(self, conn):
+        return dict(conn.execute("SELECT key, value FROM stat"))
+
+    def get_stats(self):
+        """
+        Returns the stat table of the index as a dict, including the
+        object_count and bytes_used of the container, or None if the index
+        is missing, incomplete or unusable.
+        """
+        if not self.exists():
+            return None
+        try:
+            with self._get_conn() as conn:
+                stats = self._get_stats(conn)
+        except sqlite3.DatabaseError as err:
+            logging.warn("Container index %s is unusable: %s",
+                         self.db_file, err)
+            return None
+        if not stats.get('ready') or \
+                stats.get('version') != SCHEMA_VERSION:
+            return None
+        return stats
+
+    def is_ready(self):
+        """
+        Returns True if the index has been fully built and can be used to
+        serve listings.
+        """
+        return self.get_stats() is not None
+
+    def create(self, ready=False):
+        """
+        Create an empty index, replacing any existing one. An index is
+        created ready only when the container is known to be empty, for
+        example when it has just been created through the REST API.
+        """
+        # Drop any index left over from an earlier container of the same
+        # name, or made with an older schema.
+        self.drop()
+        mkdirs(os.path.dirname(self.db_file))
+        with self._get_conn() as conn:
+            conn.executescript(_SCHEMA)
+            conn.execute("UPDATE stat SET value = ? WHERE key = 'ready'",
+                         (int(ready),))
+            conn.commit()
+
+    def add(self, name, size=0):
+        """
+        Add an object to the index, or update its size if it is already
+        there, which adjusts bytes_used by the difference.
+        """
+        with self._get_conn() as conn:
+            cur = conn.execute("""
+                UPDATE object SET size = ?,
+                    epoch = (SELECT value FROM stat WHERE key = 'epoch')
+                WHERE name = ?
+            """, (size, name))
+            if not cur.rowcount:
+                conn.execute("""
+                    INSERT INTO object (name, epoch, size)
+                    SELECT ?, value, ? FROM stat WHERE key = 'epoch'
+                """, (name, size))
+            conn.execute("DELETE FROM tombstone WHERE name = ?", (name,))
+            conn.commit()
+
+    def remove(self, name):
+        """
+        Remove an object from the index. While the index is rebuilt, the
+        removal is recorded as well, for the rebuild not to add the object
+        back should its walk have found it before.
+        """
+        with self._get_conn() as conn:
+            conn.execute("DELETE FROM object WHERE name = ?", (name,))
+            conn.execute("""
+                INSERT OR REPLACE INTO tombstone (name, epoch)
+                SELECT ?, value FROM stat
+                WHERE key = 'rebuilding' AND value > 0
+            """, (name,))
+            conn.commit()
+
+    def drop(self):
+        if self.exists():
+            do_unlink(self.db_file)
+
+    def iter_names(self, marker=None, end_marker=None, prefix=None,
+                   reverse=False):
+        """
+        Yields object names in sorted order, starting after marker (or at
+        prefix) and stopping before end_marker. Names are fetched from the
+        database a page at a time so that callers can stop early.
+
+        With reverse, names are yielded in reverse sorted order, starting
+        before marker (or at the end of prefix) and stopping after
+        end_marker, by walking the primary key index backwards.
+        """
+        if reverse:
+            for name in self._iter_names_reverse(marker, end_marker, prefix):
+                yield name
+            return
+        lower, inclusive = marker or '', False
+        if prefix and prefix > lower:
+            lower, inclusive = prefix, True
+        while True:
+            query = 'SELECT name FROM object WHERE name %s ?' % \
+                ('>=' if inclusive else '>')
+            args = [lower]
+            if end_marker:
+                query += ' AND name < ?'
+                args.append(end_marker)
+            query += ' ORDER BY name LIMIT ?'
+            args.append(PAGE_SIZE)
+            with self._get_conn() as conn:
+                names = [row[0] for row in conn.execute(query, args)]
+            for name in names:
+                if prefix and not name.startswith(prefix):
+                    return
+                yield name
+            if len(names) < PAGE_SIZE:
+                return
+            lower, inclusive = names[-1], False
+            # Yield the co-routine cooperatively
+            sleep()
+
+    def _iter_names_reverse(self, marker, end_marker, prefix):
+        upper = marker or None
+        if prefix:
+            prefix_end = prefix_end_marker(prefix)
+            if upper is None or prefix_end < upper:
+                upper = prefix_end
+        while True:
+            query = 'SELECT name FROM object'
+            conditions, args = [], []
+            if upper is not None:
+                conditions.append('name < ?')
+                args.append(upper)
+            if end_marker:
+                conditions.append('name > ?')
+                args.append(end_marker)
+            if conditions:
+                query += ' WHERE ' + ' AND '.join(conditions)
+            query += ' ORDER BY name DESC LIMIT ?'
+            args.append(PAGE_SIZE)
+            with self._get_conn() as conn:
+                names = [row[0] for row in conn.execute(query, args)]
+            for name in names:
+                if prefix and not name.startswith(prefix):
+                    return
+                yield name
+            if len(names) < PAGE_SIZE:
+                return
+            upper = names[-1]
+            # Yield the co-routine cooperatively
+            sleep()
+
+    def _iter_objects_sizes(self):
+        for name in iter_container_objects(self.cont_path):
+            st = do_stat(os.path.join(self.cont_path, name))
+            if st:
+                # Directory objects are zero-byte objects
+                yield name, st.st_size if stat.S_ISREG(st.st_mode) else 0
+
+    def rebuild(self, pace=None):
+        """
+        Rebuild the index by walking the directory tree of the container,
+        and reconcile its object count and bytes used with what was found.
+        Returns the object count of the container. pace, when given, is
+        called with the number of objects of every batch found, and may
+        sleep to limit the rate of the walk.
+
+        Objects added concurrently by the object server while the walk is in
+        progress are tagged with the new epoch and thus survive the removal
+        of stale names at the end of the rebuild. Objects removed meanwhile
+        are recorded as tombstones, and removed again at the end.
+        """
+        version = None
+        if self.exists():
+            try:
+                with self._get_conn() as conn:
+                    version = self._get_stats(conn).get('version')
+            except sqlite3.DatabaseError:
+                pass
+        if version != SCHEMA_VERSION:
+            self.create()
+        with self._get_conn() as conn:
+            conn.execute("UPDATE stat SET value = value + 1 "
+                         "WHERE key = 'epoch'")
+            epoch = conn.execute("SELECT value FROM stat "
+                                 "WHERE key = 'epoch'").fetchone()[0]
+            conn.execute("UPDATE stat SET value = ? WHERE key = 'rebuilding'",
+                         (epoch,))
+            conn.commit()
+
+        objects = self._iter_objects_sizes()
+        with self._get_conn() as conn:
+            while True:
+                batch = [(name, epoch, size) for name, size in
+                         islice(objects, REBUILD_BATCH)]
+                if not batch:
+                    break
+                # Counters are recomputed below, no need for the triggers
+                # to maintain them while replacing rows.
+                conn.executemany(
+                    "INSERT OR REPLACE INTO object (name, epoch, size) "
+                    "VALUES (?, ?, ?)", batch)
+                conn.commit()
+                if pace:
+                    pace(len(batch))
+                sleep()
+            conn.execute("DELETE FROM object WHERE epoch < ? OR name IN "
+                         "(SELECT name FROM tombstone)", (epoch,))
+            # Another rebuild started since goes on recording removals
+            conn.execute("DELETE FROM tombstone WHERE epoch <= ?", (epoch,))
+            conn.execute("UPDATE stat SET value = 0 "
+                         "WHERE key = 'rebuilding' AND value = ?", (epoch,))
+            conn.execute("""
+                UPDATE stat SET value = (SELECT COUNT(*) FROM object)
+                WHERE key = 'object_count'
+            """)
+            conn.execute("""
+                UPDATE stat SET value = (SELECT IFNULL(SUM(size), 0)
+                                         FROM object)
+                WHERE key = 'bytes_used'
+            """)
+            conn.execute("UPDATE stat SET value = 1 WHERE key = 'ready'")
+            object_count = self._get_stats(conn)['object_count']
+            conn.commit()
+        return object_count
+
+
+def _update_index(volume_path, container, name, add, size=0):
+    """
+    Apply a single change to the index of a container, if there is one. The
+    index is dropped if it cannot be updated so that it gets rebuilt instead
+    of silently serving listings that miss the change.
+    """
+    if not Glusterfs._container_index:
+        return
+    index = ContainerIndex(volume_path, container)
+    if not index.exists():
+        return
+    try:
+        if add:
+            index.add(name, size)
+        else:
+            index.remove(name)
+    except sqlite3.Error as err:
+        logging.warn("Failed to update container index %s for %s (%s), "
+                     "dropping it", index.db_file, name, err)
+        index.drop()
+
+
+def index_add(volume_path, container, name, size=0):
+    _update_index(volume_path, container, name, True, size)
+
+
+def index_remove(volume_path, container, name):
+    _update_index(volume_path, container, name, False)
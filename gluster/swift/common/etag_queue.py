@@ -0,0 +1,148 @@
+# Copyright (c) 2016 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Background computation of the ETag of objects listed with missing or stale
+metadata.
+
+Files written to a volume over FUSE, NFS or SMB have no metadata until it is
+created, and creating it means reading the whole file to compute its md5.
+Container listings do not wait for that: they report the last known ETag, or
+an empty one, and queue the file here. A few workers compute the ETags in
+real threads and store the metadata, which later listings then report.
+"""
+
+import os
+import stat
+import time
+import errno
+import logging
+
+from eventlet import spawn_n, tpool
+from eventlet.queue import LightQueue
+
+from gluster.swift.common import Glusterfs
+from gluster.swift.common.fs_utils import do_open, do_close, do_fstat, \
+    do_stat
+from gluster.swift.common.utils import read_metadata, validate_object, \
+    get_object_metadata, restore_metadata
+from gluster.swift.common.exceptions import GlusterFileSystemOSError
+
+_queue = LightQueue()
+# Paths queued or being computed
+_queued = set()
+_workers = [0]
+# Every file taken off the queue is counted in exactly one of computed,
+# skipped or errors.
+_stats = {'queued': 0, 'dropped': 0, 'computed': 0, 'skipped': 0,
+          'errors': 0, 'bytes': 0}
+
+
+def get_stats():
+    """
+    Return the counters of the queue since the process started, along with
+    its current depth.
+    """
+    stats = dict(_stats)
+    stats['depth'] = len(_queued)
+    return stats
+
+
+def queue_etag(path, logger=None):
+    """
+    Queue the file at path for its ETag to be computed and stored in its
+    metadata. The file is dropped if etag_queue_size files are queued
+    already.
+
+    :returns: True if the file is queued
+    """
+    if path in _queued:
+        return True
+    if len(_queued) >= Glusterfs._etag_queue_size:
+        _stats['dropped'] += 1
+        if logger:
+            logger.increment('etag_queue.dropped')
+        return False
+    _queued.add(path)
+    _queue.put((path, logger))
+    _stats['queued'] += 1
+    if logger:
+        logger.increment('etag_queue.queued')
+    while _workers[0] < Glusterfs._etag_queue_workers:
+        _workers[0] += 1
+        spawn_n(_worker)
+    return True
+
+
+def compute_etag(path):
+    """
+    Compute the ETag of the file at path and store it in its metadata,
+    unless the metadata was made valid meanwhile or the file was replaced
+    while it was read.
+
+    :returns: the number of bytes read, or None if the file was skipped
+    """
+    try:
+        fd = do_open(path, os.O_RDONLY)
+    except GlusterFileSystemOSError as err:
+        if err.errno in (errno.ENOENT, errno.ESTALE):
+            return None
+        raise
+    try:
+        stats = do_fstat(fd)
+        if not stat.S_ISREG(stats.st_mode):
+            return None
+        metadata = read_metadata(path)
+        if validate_object(metadata, stats):
+            return None
+        new_metadata = get_object_metadata(fd, stats)
+        after = do_fstat(fd)
+        current = do_stat(path)
+        if not current or current.st_ino != stats.st_ino \
+                or after.st_size != stats.st_size \
+                or after.st_mtime != stats.st_mtime:
+            # Rewritten or replaced, the next listing queues it again.
+            return None
+        restore_metadata(path, new_metadata, metadata)
+    finally:
+        do_close(fd)
+    return stats.st_size
+
+
+def _worker():
+    while True:
+        path, logger = _queue.get()
+        start = time.time()
+        if logger:
+            # Sent as a timing for statsd to report its mean and maximum
+            # over every flush interval, the file taken counted in.
+            logger.timing('etag_queue.depth', len(_queued))
+        try:
+            size = tpool.execute(compute_etag, path)
+        except Exception:
+            logging.exception("Failed to compute the ETag of %s", path)
+            result, size = 'errors', None
+        else:
+            result = 'skipped' if size is None else 'computed'
+        finally:
+            _queued.discard(path)
+        _stats[result] += 1
+        if size:
+            _stats['bytes'] += size
+        if logger:
+            logger.increment('etag_queue.%s' % result)
+            if result == 'computed':
+                logger.update_stats('etag_queue.bytes', size)
+                logger.timing_since('etag_queue.timing', start)
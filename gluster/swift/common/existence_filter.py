@@ -0,0 +1,493 @@
+# Copyright (c) 2016 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Probabilistic filter of the names of the objects present in a container, for
+the object server to answer HEAD and GET requests for objects that were never
+created without going to the volume.
+
+Clients often probe for an object before creating it, and every probe
+otherwise costs lookup, open, stat and getxattr round trips over FUSE. The
+filter of a container is a Bloom filter: it always answers "maybe" for the
+objects added to it, and "absent" for most of the names that were not.
+
+A filter is created empty along with its container, the object server adds
+every object it creates to it, and the container crawler rebuilds it from
+the names found in the container. Deleting an object does not remove it from
+the filter, it is answered "maybe" until the next rebuild. Containers
+without a filter, such as the ones created before filters were enabled, are
+always looked up on the volume.
+
+Filters live in a hidden directory at the root of the volume so that every
+node serving the volume updates the same filters. Every update bumps a
+generation number in the header of the filter. Every object server worker
+keeps the filters it reads in memory, checks them for changes every
+existence_filter_refresh seconds, and always checks the generation of a
+filter before answering "absent" from it, so that an object just created
+through another worker or node is never reported missing. Files created
+directly over FUSE/SMB are not in the filter until its next rebuild: as a
+safeguard, one in existence_filter_verify "absent" answers is checked
+against the volume, and the filter is dropped if the object is found there.
+"""
+
+import os
+import math
+import time
+import errno
+import fcntl
+import random
+import struct
+import logging
+from hashlib import md5
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from eventlet.patcher import original
+
+from gluster.swift.common import Glusterfs
+from gluster.swift.common.utils import EXISTENCE_FILTER_DIR
+from gluster.swift.common.fs_utils import mkdirs, do_open, do_close, \
+    do_read, do_write, do_lseek, do_fsync, do_rename, do_fstat, do_unlink, \
+    do_exists
+from gluster.swift.common.exceptions import GlusterFileSystemOSError
+
+# Rate of "maybe" answers for names never added, for a filter holding as
+# many names as it was sized for.
+ERROR_RATE = 0.01
+# Number of filters every object server worker keeps in memory
+CACHE_SIZE = 100
+
+_MAGIC = 'GSEF'
+_VERSION = 2
+# magic, version, number of hashes, number of bits, generation
+_HEADER = struct.Struct('!4sBBQQ')
+_GENERATION = struct.Struct('!Q')
+_GENERATION_OFFSET = _HEADER.size - _GENERATION.size
+_PENDING_SUFFIX = '.pending'
+_LOCK_SUFFIX = '.lock'
+
+# Filter path -> [time checked, (inode, generation), BloomFilter or None]
+_cache = OrderedDict()
+# Filters are added to from threadpool threads as objects are PUT
+_cache_lock = original('threading').Lock()
+_absent_answers = [0]
+
+
+class BloomFilter(object):
+    """
+    Bloom filter of byte strings, using double hashing of their md5.
+
+    :param num_bits: size of the filter in bits, a multiple of 8
+    :param num_hashes: number of bits set for every name
+    :param bits: bytearray of num_bits / 8 bytes, empty filter by default
+    :param generation: number of updates of the filter file
+    """
+
+    def __init__(self, num_bits, num_hashes, bits=None, generation=0):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        if bits is None:
+            bits = bytearray(num_bits // 8)
+        self.bits = bits
+        self.generation = generation
+
+    @classmethod
+    def for_capacity(cls, capacity, error_rate=ERROR_RATE):
+        """
+        Create an empty filter sized for capacity names at error_rate.
+        """
+        capacity = max(capacity, 1)
+        num_bits = int(math.ceil(-capacity * math.log(error_rate) /
+                                 math.log(2) ** 2))
+        num_bits = (num_bits + 7) // 8 * 8
+        num_hashes = max(1, int(round(float(num_bits) / capacity *
+                                      math.log(2))))
+        return cls(num_bits, num_hashes)
+
+    def add(self, name):
+        for pos in _positions(name, self.num_bits, self.num_hashes):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def update(self, other):
+        """
+        Add all the names of a filter of the same size.
+        """
+        for i, byte in enumerate(other.bits):
+            if byte:
+                self.bits[i] |= byte
+
+    def __contains__(self, name):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7))
+                   for pos in _positions(name, self.num_bits,
+                                         self.num_hashes))
+
+    def serialize(self):
+        return _HEADER.pack(_MAGIC, _VERSION, self.num_hashes,
+                            self.num_bits, self.generation) + str(self.bits)
+
+    @classmethod
+    def deserialize(cls, data):
+        num_hashes, num_bits, generation = _parse_header(data)
+        bits = bytearray(data[_HEADER.size:])
+        if len(bits) * 8 != num_bits:
+            raise ValueError('Truncated filter')
+        return cls(num_bits, num_hashes, bits, generation)
+
+
+def _positions(name, num_bits, num_hashes):
+    h1, h2 = struct.unpack('!QQ', md5(name).digest())
+    return [(h1 + i * h2) % num_bits for i in xrange(num_hashes)]
+
+
+def _parse_header(data):
+    if len(data) < _HEADER.size:
+        raise ValueError('Truncated header')
+    magic, version, num_hashes, num_bits, generation = \
+        _HEADER.unpack(data[:_HEADER.size])
+    if magic != _MAGIC or version != _VERSION or not num_bits \
+            or num_bits % 8 or not num_hashes:
+        raise ValueError('Unknown format')
+    return num_hashes, num_bits, generation
+
+
+def get_filter_path(volume_path, container):
+    """
+    Return the path of the filter of a container, named after a hash of the
+    container name like its index.
+    """
+    return os.path.join(volume_path, EXISTENCE_FILTER_DIR,
+                        md5(container).hexdigest())
+
+
+@contextmanager
+def _locked(path):
+    fd = do_open(path + _LOCK_SUFFIX, os.O_RDWR | os.O_CREAT)
+    try:
+        fcntl.lockf(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        do_close(fd)
+
+
+def _open_filter(path):
+    try:
+        return do_open(path, os.O_RDONLY)
+    except GlusterFileSystemOSError as err:
+        if err.errno in (errno.ENOENT, errno.ESTALE):
+            return None
+        raise
+
+
+def _read_all(fd, data='', size=None):
+    """
+    Read up to size bytes from fd, to its end by default, after data.
+    """
+    chunks = [data]
+    while size is None or size > 0:
+        chunk = do_read(fd, 65536 if size is None else min(size, 65536))
+        if not chunk:
+            break
+        chunks.append(chunk)
+        if size is not None:
+            size -= len(chunk)
+    return ''.join(chunks)
+
+
+def _read_filter(path):
+    fd = _open_filter(path)
+    if fd is None:
+        return None
+    try:
+        data = _read_all(fd)
+    finally:
+        do_close(fd)
+    return BloomFilter.deserialize(data)
+
+
+def _read_generation(path):
+    """
+    Return the generation of the filter at path, -1 if there is no usable
+    filter.
+    """
+    fd = _open_filter(path)
+    if fd is None:
+        return -1
+    try:
+        return _parse_header(do_read(fd, _HEADER.size))[2]
+    except ValueError:
+        return -1
+    finally:
+        do_close(fd)
+
+
+def _write_filter(path, bloom):
+    # Same dot-prefix-dot-suffix temporary name as write_pickle(), so that
+    # the rename does not move the file to another brick.
+    dirname, basename = os.path.split(path)
+    tmppath = os.path.join(dirname, '.%s.%s' % (
+        basename, md5(basename + str(random.random())).hexdigest()))
+    fd = do_open(tmppath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+    try:
+        data = bloom.serialize()
+        while data:
+            data = data[do_write(fd, data):]
+        do_fsync(fd)
+    finally:
+        do_close(fd)
+    do_rename(tmppath, path)
+
+
+def _set_bits(path, names):
+    """
+    Set the bits of names in the filter file at path, in place, and bump its
+    generation. The bits are written first, so that a worker reading the
+    new generation also reads the new bits.
+
+    :returns: False if there is no such filter
+    """
+    try:
+        fd = do_open(path, os.O_RDWR)
+    except GlusterFileSystemOSError as err:
+        if err.errno in (errno.ENOENT, errno.ESTALE):
+            return False
+        raise
+    try:
+        num_hashes, num_bits, generation = \
+            _parse_header(do_read(fd, _HEADER.size))
+        masks = {}
+        for name in names:
+            for pos in _positions(name, num_bits, num_hashes):
+                masks[pos >> 3] = masks.get(pos >> 3, 0) | (1 << (pos & 7))
+        # One read and one write of the bytes spanning them, rather than
+        # round trips byte by byte.
+        start = min(masks)
+        do_lseek(fd, _HEADER.size + start, os.SEEK_SET)
+        data = bytearray(_read_all(fd, '', max(masks) - start + 1))
+        if len(data) <= max(masks) - start:
+            raise ValueError('Truncated filter')
+        changed = False
+        for offset, mask in masks.iteritems():
+            if data[offset - start] | mask != data[offset - start]:
+                data[offset - start] |= mask
+                changed = True
+        if changed:
+            do_lseek(fd, _HEADER.size + start, os.SEEK_SET)
+            data = str(data)
+            while data:
+                data = data[do_write(fd, data):]
+        do_lseek(fd, _GENERATION_OFFSET, os.SEEK_SET)
+        do_write(fd, _GENERATION.pack(generation + 1))
+    finally:
+        do_close(fd)
+    return True
+
+
+# Returned by _load() for a filter that did not change
+_UNCHANGED = object()
+
+
+def _load(path, known_stats):
+    """
+    Read the filter at path unless its inode and generation are still
+    known_stats, reading only its header then.
+
+    :returns: a (stats, filter) tuple, filter being None if there is no
+              usable filter, or known_stats and _UNCHANGED
+    """
+    fd = _open_filter(path)
+    if fd is None:
+        return None, None
+    try:
+        st = do_fstat(fd)
+        data = do_read(fd, _HEADER.size)
+        try:
+            generation = _parse_header(data)[2]
+        except ValueError as err:
+            logging.warn("Existence filter %s is unusable: %s", path, err)
+            return (st.st_ino, None), None
+        stats = (st.st_ino, generation)
+        if stats == known_stats:
+            return stats, _UNCHANGED
+        try:
+            return stats, BloomFilter.deserialize(_read_all(fd, data))
+        except ValueError as err:
+            logging.warn("Existence filter %s is unusable: %s", path, err)
+            return stats, None
+    finally:
+        do_close(fd)
+
+
+def _get_filter(path, threadpool=None, max_age=None):
+    """
+    Return the filter at path, from the cache if it was checked for changes
+    less than max_age seconds ago, existence_filter_refresh by default.
+    """
+    if max_age is None:
+        max_age = Glusterfs._existence_filter_refresh
+    now = time.time()
+    with _cache_lock:
+        entry = _cache.get(path)
+    if entry and now - entry[0] < max_age:
+        return entry[2]
+    known_stats = entry[1] if entry else None
+    if threadpool:
+        stats, bloom = threadpool.force_run_in_thread(_load, path,
+                                                      known_stats)
+    else:
+        stats, bloom = _load(path, known_stats)
+    if bloom is _UNCHANGED:
+        bloom = entry[2]
+    with _cache_lock:
+        _cache.pop(path, None)
+        _cache[path] = [now, stats, bloom]
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return bloom
+
+
+def is_absent(volume_path, container, name, threadpool=None):
+    """
+    Return True if the container has a filter and the object is definitely
+    not in it. The filter is read or checked for changes, in a thread of
+    threadpool when given, if it was last checked more than
+    existence_filter_refresh seconds ago, and always before answering True.
+    """
+    if not Glusterfs._existence_filter:
+        return False
+    path = get_filter_path(volume_path, container)
+    started = time.time()
+    bloom = _get_filter(path, threadpool)
+    if bloom is None or name in bloom:
+        return False
+    with _cache_lock:
+        entry = _cache.get(path)
+    if entry is None or entry[0] < started:
+        # The object may have been added by another worker or node since,
+        # or the filter evicted or dropped meanwhile.
+        bloom = _get_filter(path, threadpool, max_age=0)
+    return bloom is not None and name not in bloom
+
+
+def should_verify():
+    """
+    Return True for one in existence_filter_verify calls, for the caller to
+    check an "absent" answer against the volume.
+    """
+    if not Glusterfs._existence_filter_verify:
+        return False
+    _absent_answers[0] += 1
+    return _absent_answers[0] % Glusterfs._existence_filter_verify == 0
+
+
+def filter_add(volume_path, container, name):
+    """
+    Add an object to the filter of its container, if there is one, along
+    with the directories on its path, which are objects too for the object
+    server. The filter is dropped if it cannot be updated, so that the
+    object is not reported absent.
+
+    Filters are kept up to date while existence_filter is off too, as long
+    as the volume has any, so that they are still right once it is turned
+    back on.
+    """
+    path = get_filter_path(volume_path, container)
+    if not Glusterfs._existence_filter and \
+            not do_exists(os.path.dirname(path)):
+        return
+    pending = path + _PENDING_SUFFIX
+    if not do_exists(path) and not do_exists(pending):
+        return
+    parts = name.split(os.path.sep)
+    names = [os.path.sep.join(parts[:i]) for i in xrange(1, len(parts) + 1)]
+    try:
+        with _locked(path):
+            _set_bits(path, names)
+            # Being rebuilt: the walk may have missed the object
+            _set_bits(pending, names)
+    except (GlusterFileSystemOSError, OSError, IOError, ValueError) as err:
+        logging.warn("Failed to add %s to existence filter %s (%s), "
+                     "dropping it", name, path, err)
+        drop_filter(volume_path, container)
+        return
+    with _cache_lock:
+        entry = _cache.get(path)
+        if entry and entry[2] is not None:
+            for name in names:
+                entry[2].add(name)
+
+
+def create_filter(volume_path, container):
+    """
+    Create the empty filter of a container just created through the REST
+    API, replacing any filter left over from an earlier container of the
+    same name.
+    """
+    if not Glusterfs._existence_filter:
+        return
+    path = get_filter_path(volume_path, container)
+    mkdirs(os.path.dirname(path))
+    bloom = BloomFilter.for_capacity(Glusterfs._existence_filter_capacity)
+    with _locked(path):
+        # Generations keep increasing, for workers to never mistake the new
+        # filter for the one they read.
+        bloom.generation = _read_generation(path) + 1
+        _write_filter(path, bloom)
+        if do_exists(path + _PENDING_SUFFIX):
+            # Makes a rebuild in progress give up
+            do_unlink(path + _PENDING_SUFFIX)
+
+
+def rebuild_filter(volume_path, container, iter_names, object_count=0):
+    """
+    Rebuild the filter of a container from the names yielded by
+    iter_names(), sized for twice object_count names or
+    existence_filter_capacity, whichever is larger.
+
+    Objects added by the object server while the names are read are
+    recorded in a pending filter, merged into the new one before it
+    replaces the old one.
+
+    :returns: False if the filter was dropped while being rebuilt
+    """
+    path = get_filter_path(volume_path, container)
+    pending = path + _PENDING_SUFFIX
+    bloom = BloomFilter.for_capacity(
+        max(Glusterfs._existence_filter_capacity, 2 * object_count))
+    mkdirs(os.path.dirname(path))
+    with _locked(path):
+        _write_filter(pending, bloom)
+    for name in iter_names():
+        bloom.add(name)
+    with _locked(path):
+        try:
+            added = _read_filter(pending)
+        except ValueError:
+            added = None
+        if added is None or added.num_bits != bloom.num_bits:
+            return False
+        bloom.update(added)
+        bloom.generation = _read_generation(path) + 1
+        _write_filter(path, bloom)
+        do_unlink(pending)
+    return True
+
+
+def drop_filter(volume_path, container):
+    path = get_filter_path(volume_path, container)
+    for filter_path in (path, path + _PENDING_SUFFIX):
+        if do_exists(filter_path):
+            do_unlink(filter_path)
+    with _cache_lock:
+        _cache.pop(path, None)
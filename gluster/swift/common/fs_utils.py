@@ -67,6 +67,10 @@ def do_removexattr(path, key):
     xattr.removexattr(path, key)
 
 
+def do_listxattr(path):
+    return xattr.listxattr(path)
+
+
 def do_walk(*args, **kwargs):
     return os.walk(*args, **kwargs)
 
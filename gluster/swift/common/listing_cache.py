@@ -0,0 +1,324 @@
+# Copyright (c) 2016 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Snapshot cache of container listings, validated by directory mtimes.
+
+A snapshot records, for every directory of a container, its mtime and ctime
+along with the files and sub-directories found in it. Adding, removing or
+renaming an entry in a directory changes its mtime, and turning a directory
+into a directory object (an xattr update) changes its ctime. So the snapshot
+of a container is brought up to date by stat'ing its directories only, and
+by reading again only those directories whose times changed. Files found
+again with the same inode keep the size they had, and the sorted list of
+objects is updated with the names that changed rather than sorted again.
+
+Snapshots are stored in RUN_DIR so that all the container server workers of
+a node share them. A snapshot in which every directory read again was still
+being modified is only kept in memory: those directories are read again by
+the next listing anyway, and a container written to faster than it is listed
+would otherwise have its whole snapshot rewritten by every listing.
+"""
+
+import os
+import stat
+import time
+import logging
+import cPickle as pickle
+from hashlib import md5
+from heapq import merge
+from bisect import bisect_left, bisect_right
+
+from eventlet import sleep
+
+from gluster.swift.common import Glusterfs
+from gluster.swift.common.fs_utils import do_stat, do_getsize
+from gluster.swift.common.utils import gf_listdir, write_pickle, \
+    read_metadata, dir_is_object, prefix_end_marker
+from gluster.swift.common.exceptions import GlusterFileSystemIOError, \
+    GlusterFileSystemOSError
+
+CACHE_DIR = 'listing_cache'
+# Bumped whenever the layout of a snapshot changes
+SNAPSHOT_VERSION = 2
+# Directories modified less than this many seconds before they were read may
+# be modified again without their mtime changing, depending on the time
+# granularity of the file system. Such directories are always read again.
+RACY_WINDOW = 1.0
+# Number of parsed snapshots kept in memory by each process
+MEMO_SIZE = 16
+
+_memo = {}
+
+
+def get_cache_file(cont_path):
+    return os.path.join(Glusterfs.RUN_DIR, CACHE_DIR,
+                        md5(cont_path).hexdigest() + '.pkl')
+
+
+def _load_snapshot(cache_file, cont_path):
+    try:
+        st = os.stat(cache_file)
+    except OSError:
+        return None
+    file_key = (st.st_ino, st.st_mtime, st.st_size)
+    memo = _memo.get(cache_file)
+    if memo and memo[0] == file_key:
+        snapshot = memo[1]
+    else:
+        try:
+            with open(cache_file, 'rb') as fp:
+                snapshot = pickle.load(fp)
+        except Exception as err:
+            logging.warn("Ignoring unreadable listing snapshot %s: %s",
+                         cache_file, err)
+            return None
+        if not isinstance(snapshot, dict) or \
+                snapshot.get('version') != SNAPSHOT_VERSION or \
+                snapshot.get('cont_path') != cont_path:
+            return None
+        _remember(cache_file, file_key, snapshot)
+    # Snapshots made with other settings list other objects or sizes
+    if snapshot['do_getsize'] != Glusterfs._do_getsize or \
+            snapshot['implicit_dir_objects'] != \
+            Glusterfs._implicit_dir_objects:
+        return None
+    return snapshot
+
+
+def _remember(cache_file, file_key, snapshot):
+    if len(_memo) >= MEMO_SIZE and cache_file not in _memo:
+        _memo.clear()
+    _memo[cache_file] = (file_key, snapshot)
+
+
+def _save_snapshot(cache_file, snapshot):
+    try:
+        write_pickle(snapshot, cache_file,
+                     pickle_protocol=pickle.HIGHEST_PROTOCOL)
+        st = os.stat(cache_file)
+    except (IOError, OSError) as err:
+        logging.warn("Failed to save listing snapshot %s: %s",
+                     cache_file, err)
+        return
+    _remember(cache_file, (st.st_ino, st.st_mtime, st.st_size), snapshot)
+
+
+def _is_dir_object(path):
+    if Glusterfs._implicit_dir_objects:
+        return True
+    try:
+        return dir_is_object(read_metadata(path))
+    except GlusterFileSystemIOError:
+        return False
+
+
+def _scan_dir(path, is_root, old_entry=None):
+    """
+    Read a directory, returning its entry in the snapshot: the files it
+    holds with their sizes and inodes, the sub-directories to descend into,
+    and the symlinked directories that are directory objects. The files of
+    old_entry, its previous entry, found again with the same inode keep
+    their size: objects are replaced by renaming a new file over them.
+    """
+    files, dirs, links = [], [], []
+    known = {}
+    if old_entry and Glusterfs._do_getsize:
+        known = dict(((name, ino), size)
+                     for name, size, ino in old_entry['files'])
+    try:
+        for entry in gf_listdir(path):
+            if entry.is_dir():
+                if not entry.is_symlink():
+                    dirs.append(entry.name)
+                elif _is_dir_object(os.path.join(path, entry.name)):
+                    links.append(entry.name)
+            else:
+                # Free with scandir, read from the directory entry
+                ino = entry.inode() if hasattr(entry, 'inode') else None
+                size = 0
+                if (entry.name, ino) in known and ino is not None:
+                    size = known[(entry.name, ino)]
+                elif Glusterfs._do_getsize:
+                    try:
+                        size = do_getsize(os.path.join(path, entry.name))
+                    except OSError:
+                        # File removed since the directory was read
+                        continue
+                files.append((entry.name, size, ino))
+    except OSError as err:
+        logging.warn("Failed to read directory %s: %s", path, err)
+    return {'files': files, 'dirs': dirs, 'links': links,
+            'is_object': not is_root and _is_dir_object(path)}
+
+
+def _entry_objects(rel_path, entry):
+    """
+    Yield the (name, size) of the objects of the entry of a directory.
+    """
+    prefix = rel_path + os.path.sep if rel_path else ''
+    if entry['is_object']:
+        yield rel_path, 0
+    for name, size, _ino in entry['files']:
+        yield prefix + name, size
+    for name in entry['links']:
+        yield prefix + name, 0
+
+
+def _list_objects(dirs):
+    obj_list = []
+    bytes_used = 0
+    for rel_path, entry in dirs.iteritems():
+        for name, size in _entry_objects(rel_path, entry):
+            obj_list.append(name)
+            bytes_used += size
+    obj_list.sort()
+    return obj_list, bytes_used
+
+
+def _update_objects(snapshot, dirs, changed):
+    """
+    Update the sorted list of objects and the bytes used of a snapshot for
+    the directories at changed, read again or gone, now dirs.
+    """
+    old, new = {}, {}
+    for rel_path in changed:
+        if rel_path in snapshot['dirs']:
+            old.update(_entry_objects(rel_path, snapshot['dirs'][rel_path]))
+        if rel_path in dirs:
+            new.update(_entry_objects(rel_path, dirs[rel_path]))
+    removed = set(old).difference(new)
+    added = sorted(set(new).difference(old))
+    objects = snapshot['objects']
+    if removed:
+        objects = [name for name in objects if name not in removed]
+    if added:
+        objects = list(merge(objects, added))
+    bytes_used = snapshot['bytes_used'] - sum(old.itervalues()) + \
+        sum(new.itervalues())
+    return objects, bytes_used
+
+
+def get_container_details(cont_path, pace=None, names=None):
+    """
+    Same as gluster.swift.common.utils.get_container_details(), except that
+    the returned list of objects is sorted, and that the file system is only
+    walked for the directories modified since the snapshot of the container
+    was last brought up to date: pace is only called for those. names, when
+    given, is filled from the snapshot.
+    """
+    cache_file = get_cache_file(cont_path)
+    snapshot = _load_snapshot(cache_file, cont_path)
+    old_dirs = snapshot['dirs'] if snapshot else {}
+
+    dirs = {}
+    # Directories read again, and whether any of them can be reused
+    changed = []
+    settled = False
+    scan_time = time.time()
+    pending = ['']
+    while pending:
+        rel_path = pending.pop()
+        path = os.path.join(cont_path, rel_path) if rel_path else cont_path
+        try:
+            st = do_stat(path)
+        except GlusterFileSystemOSError as err:
+            logging.warn("Failed to stat directory %s: %s", path, err)
+            st = None
+        if not st or not stat.S_ISDIR(st.st_mode):
+            continue
+        times = (st.st_mtime, st.st_ctime)
+        entry = old_dirs.get(rel_path)
+        if not entry or entry['times'] != times:
+            entry = _scan_dir(path, not rel_path, entry)
+            if max(times) < scan_time - RACY_WINDOW:
+                entry['times'] = times
+                settled = True
+            else:
+                entry['times'] = None
+            changed.append(rel_path)
+            if pace:
+                pace(len(entry['files']) + len(entry['dirs']) +
+                     len(entry['links']))
+            # Yield the co-routine cooperatively
+            sleep()
+        dirs[rel_path] = entry
+        pending.extend(os.path.join(rel_path, name)
+                       for name in entry['dirs'])
+        if names is not None:
+            names.extend(os.path.join(rel_path, name)
+                         for name in entry['dirs'] + entry['links'])
+            names.extend(os.path.join(rel_path, name)
+                         for name, _size, _ino in entry['files'])
+
+    if snapshot is None:
+        obj_list, bytes_used = _list_objects(dirs)
+    else:
+        # Gone along with a parent directory read again
+        changed.extend(set(old_dirs).difference(dirs))
+        if not changed:
+            return snapshot['objects'], len(snapshot['objects']), \
+                snapshot['bytes_used']
+        obj_list, bytes_used = _update_objects(snapshot, dirs, changed)
+
+    new_snapshot = {
+        'version': SNAPSHOT_VERSION,
+        'cont_path': cont_path,
+        'do_getsize': Glusterfs._do_getsize,
+        'implicit_dir_objects': Glusterfs._implicit_dir_objects,
+        'dirs': dirs,
+        'objects': obj_list,
+        'bytes_used': bytes_used}
+    if settled or snapshot is None:
+        _save_snapshot(cache_file, new_snapshot)
+    elif cache_file in _memo:
+        # Newer than the file it is remembered for
+        _remember(cache_file, _memo[cache_file][0], new_snapshot)
+    return obj_list, len(obj_list), bytes_used
+
+
+def iter_container_objects(cont_path, marker=None, end_marker=None,
+                           prefix=None, reverse=False):
+    """
+    Yield the names of the objects of a container from its snapshot, in
+    sorted order, starting after marker (or at prefix) and stopping before
+    end_marker. With reverse, names are yielded in reverse sorted order,
+    starting before marker (or at the end of prefix) and stopping after
+    end_marker.
+    """
+    objects = get_container_details(cont_path)[0]
+    if reverse:
+        end = len(objects)
+        if marker:
+            end = bisect_left(objects, marker)
+        if prefix:
+            end = min(end, bisect_left(objects, prefix_end_marker(prefix)))
+        for i in xrange(end - 1, -1, -1):
+            if end_marker and objects[i] <= end_marker:
+                break
+            if prefix and objects[i] < prefix:
+                break
+            yield objects[i]
+        return
+    if marker and marker >= prefix:
+        start = bisect_right(objects, marker)
+    elif prefix:
+        start = bisect_left(objects, prefix)
+    else:
+        start = 0
+    for i in xrange(start, len(objects)):
+        if end_marker and objects[i] >= end_marker:
+            break
+        yield objects[i]
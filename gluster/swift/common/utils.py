@@ -16,21 +16,31 @@
 import os
 import stat
 import json
+import time
 import errno
 import random
+import zlib
+import struct
 import logging
+import binascii
 from hashlib import md5
-from eventlet import sleep
+from itertools import islice
+from functools import partial
+from collections import deque, OrderedDict
+from eventlet import sleep, spawn, tpool, GreenPool
+from eventlet.queue import LightQueue
+from eventlet.patcher import original
 import cPickle as pickle
 from cStringIO import StringIO
 import pickletools
-from gluster.swift.common.exceptions import GlusterFileSystemIOError
+from gluster.swift.common.exceptions import GlusterFileSystemIOError, \
+    GlusterFileSystemOSError
 from swift.common.exceptions import DiskFileNoSpace
 from swift.common.db import utf8encodekeys
 from gluster.swift.common.fs_utils import do_getctime, do_getmtime, do_stat, \
     do_rmdir, do_log_rl, get_filename_from_fd, do_open, do_getsize, \
     do_getxattr, do_setxattr, do_removexattr, do_read, do_close, do_dup, \
-    do_lseek, do_fstat, do_fsync, do_rename
+    do_lseek, do_fstat, do_fsync, do_rename, do_listxattr
 from gluster.swift.common import Glusterfs
 
 try:
@@ -48,18 +58,39 @@ X_TYPE = 'X-Type'
 X_ETAG = 'ETag'
 X_OBJECTS_COUNT = 'X-Object-Count'
 X_BYTES_USED = 'X-Bytes-Used'
+# Set while the object count and bytes used of a container are yet to be
+# computed
+X_STATS_PENDING = 'X-Stats-Pending'
+# Time the stats of a container or account were last refreshed in the
+# background (stats_refresh_ttl)
+X_STATS_REFRESHED = 'X-Stats-Refreshed'
+# Set, in listings only and never stored, on the metadata of an object whose
+# ETag is yet to be computed. Its value is the path of the object.
+X_ETAG_PENDING = 'X-ETag-Pending'
+# Inode, size and mtime of the file the ETag of an object was computed from
+X_CONTENT_SIGNATURE = 'X-Content-Signature'
+X_DELETE_AT = 'X-Delete-At'
 X_CONTAINER_COUNT = 'X-Container-Count'
 X_OBJECT_TYPE = 'X-Object-Type'
 DIR_TYPE = 'application/directory'
 ACCOUNT = 'Account'
 METADATA_KEY = 'user.swift.metadata'
+# Copy of the system fields of the metadata of an object, see
+# read_sys_metadata()
+SYS_METADATA_KEY = 'user.swift.system'
 MAX_XATTR_SIZE = 65536
+# Size of the chunks of the body of streamed listings
+LISTING_CHUNK_SIZE = 65536
+# Usage of a directory kept by GlusterFS directory quota
+QUOTA_SIZE_KEY = 'trusted.glusterfs.quota.size'
 CONTAINER = 'container'
 DIR_NON_OBJECT = 'dir'
 DIR_OBJECT = 'marker_dir'
 TEMP_DIR = 'tmp'
 ASYNCDIR = 'async_pending'  # Keep in sync with swift.obj.server.ASYNCDIR
 TRASHCAN = '.trashcan'
+INDEX_DIR = '.container_index'
+EXISTENCE_FILTER_DIR = '.existence_filter'
 FILE = 'file'
 FILE_TYPE = 'application/octet-stream'
 OBJECT = 'Object'
@@ -117,8 +148,161 @@ def normalize_timestamp(timestamp):
     return "%016.05f" % (float(timestamp))
 
 
+# Prefix of the metadata serialized in the binary format, followed by the
+# version of the format. It can be mistaken for neither a pickle nor JSON.
+BINARY_METADATA_MAGIC = '\x00GSM'
+BINARY_METADATA_VERSION = '\x01'
+_BINARY_COUNT = struct.Struct('!I')
+# Prefix of metadata compressed with zlib, see serialize_metadata()
+COMPRESSED_METADATA_MAGIC = '\x00GSZ'
+# Size compressed metadata is never decompressed beyond
+MAX_DECOMPRESSED_METADATA = 64 * MAX_XATTR_SIZE
+
+
+def _binary_pack(value):
+    """
+    Return the type tag and the payload of a metadata value in the binary
+    format.
+    """
+    if isinstance(value, str):
+        return 's', value
+    if isinstance(value, unicode):
+        return 's', value.encode('utf-8')
+    if value is None:
+        return 'n', ''
+    if isinstance(value, bool):
+        return 'T' if value else 'F', ''
+    if isinstance(value, (int, long)):
+        return 'i', str(value)
+    if isinstance(value, float):
+        return 'f', repr(value)
+    if isinstance(value, (tuple, list)):
+        return 't', _binary_pack_sequence(value)
+    if isinstance(value, dict):
+        return 'd', _binary_pack_dict(value)
+    raise TypeError('%r cannot be serialized' % (value,))
+
+
+def _binary_pack_sequence(values):
+    # Number of items, then the tag and payload length of every item, then
+    # the payloads.
+    packed = [_binary_pack(value) for value in values]
+    table = []
+    for tag, payload in packed:
+        table.extend((tag, len(payload)))
+    return ''.join([struct.pack('!I' + 'cI' * len(packed), len(packed),
+                                *table)] +
+                   [payload for tag, payload in packed])
+
+
+def _binary_pack_dict(metadata):
+    # Number of items, then the key length, value tag and value payload
+    # length of every item, then the keys and payloads.
+    table = []
+    data = []
+    for key, value in sorted(metadata.iteritems()):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        tag, payload = _binary_pack(value)
+        table.extend((len(key), tag, len(payload)))
+        data.extend((key, payload))
+    return ''.join([struct.pack('!I' + 'HcI' * len(metadata),
+                                len(metadata), *table)] + data)
+
+
+def _binary_unpack(tag, payload):
+    if tag == 's':
+        return payload
+    if tag == 'i':
+        return int(payload)
+    if tag == 't':
+        return _binary_unpack_sequence(payload)
+    if tag == 'n':
+        return None
+    if tag == 'T':
+        return True
+    if tag == 'F':
+        return False
+    if tag == 'f':
+        return float(payload)
+    if tag == 'd':
+        return _binary_unpack_dict(payload)
+    raise ValueError('Unknown type tag %r' % tag)
+
+
+def _binary_unpack_sequence(data):
+    count, = _BINARY_COUNT.unpack_from(data)
+    table = struct.unpack_from('!' + 'cI' * count, data, 4)
+    offset = 4 + 5 * count
+    values = []
+    for i in xrange(0, 2 * count, 2):
+        end = offset + table[i + 1]
+        values.append(_binary_unpack(table[i], data[offset:end]))
+        offset = end
+    if offset != len(data):
+        raise ValueError('Truncated or trailing data')
+    return tuple(values)
+
+
+def _binary_unpack_dict(data, offset=0):
+    count, = _BINARY_COUNT.unpack_from(data, offset)
+    table = struct.unpack_from('!' + 'HcI' * count, data, offset + 4)
+    offset += 4 + 7 * count
+    metadata = {}
+    for i in xrange(0, 3 * count, 3):
+        key_end = offset + table[i]
+        end = key_end + table[i + 2]
+        if table[i + 1] == 's':
+            metadata[data[offset:key_end]] = data[key_end:end]
+        else:
+            metadata[data[offset:key_end]] = \
+                _binary_unpack(table[i + 1], data[key_end:end])
+        offset = end
+    if offset != len(data):
+        raise ValueError('Truncated or trailing data')
+    return metadata
+
+
 def serialize_metadata(metadata):
-    return json.dumps(metadata, separators=(',', ':'))
+    if Glusterfs._metadata_format == 'binary':
+        metastr = BINARY_METADATA_MAGIC + BINARY_METADATA_VERSION + \
+            _binary_pack_dict(metadata)
+    else:
+        # Keys are sorted so that changing a value leaves the chunks before
+        # it, and after it too if its length is unchanged, as they were (see
+        # write_metadata()).
+        metastr = json.dumps(metadata, separators=(',', ':'),
+                             sort_keys=True)
+    threshold = Glusterfs._metadata_compression_threshold
+    if threshold and len(metastr) > threshold:
+        compressed = COMPRESSED_METADATA_MAGIC + zlib.compress(metastr)
+        if len(compressed) < len(metastr):
+            return compressed
+    return metastr
+
+
+def _decompress_metadata(metastr):
+    """
+    Return the serialized metadata compressed in metastr, or None if it
+    cannot be decompressed.
+    """
+    decompressor = zlib.decompressobj()
+    try:
+        data = decompressor.decompress(
+            metastr[len(COMPRESSED_METADATA_MAGIC):],
+            MAX_DECOMPRESSED_METADATA)
+    except zlib.error:
+        logging.warning("Invalid compressed metadata", exc_info=True)
+        return None
+    if decompressor.unconsumed_tail:
+        logging.warning("Compressed metadata larger than %d bytes",
+                        MAX_DECOMPRESSED_METADATA)
+        return None
+    if data.startswith(COMPRESSED_METADATA_MAGIC):
+        logging.warning("Compressed metadata compressed again")
+        return None
+    # A truncated stream is caught by the deserialization of data.
+    return data
 
 
 def deserialize_metadata(metastr):
@@ -126,7 +310,23 @@ def deserialize_metadata(metastr):
     Returns dict populated with metadata if deserializing is successful.
     Returns empty dict if deserialzing fails.
     """
-    if metastr.startswith('\x80\x02}') and metastr.endswith('.') and \
+    if metastr.startswith(COMPRESSED_METADATA_MAGIC):
+        metastr = _decompress_metadata(metastr)
+        if metastr is None:
+            return {}
+    if metastr.startswith(BINARY_METADATA_MAGIC):
+        # Strings are stored as byte strings, there is nothing to re-encode
+        if metastr[len(BINARY_METADATA_MAGIC):][:1] != \
+                BINARY_METADATA_VERSION:
+            logging.warning("Unsupported binary metadata version")
+            return {}
+        try:
+            return _binary_unpack_dict(metastr,
+                                       len(BINARY_METADATA_MAGIC) + 1)
+        except (struct.error, ValueError):
+            logging.warning("Invalid binary metadata", exc_info=True)
+            return {}
+    elif metastr.startswith('\x80\x02}') and metastr.endswith('.') and \
             Glusterfs._read_pickled_metadata:
         # Assert that the serialized metadata is pickled using
         # pickle protocol 2 and is a dictionary.
@@ -154,10 +354,256 @@ def deserialize_metadata(metastr):
             logging.warning("json.loads() failed.", exc_info=True)
             return {}
     else:
-        logging.warning("Invalid metadata format (neither PICKLE nor JSON)")
+        logging.warning("Invalid metadata format (neither binary, PICKLE "
+                        "nor JSON)")
+        return {}
+
+
+# Fixed layout of the system metadata xattr: version, flags, object type,
+# content length, X-Delete-At, binary ETag, and the lengths of the
+# timestamp, content type and content signature that follow.
+_SYS_METADATA = struct.Struct('!BBBQQ16sHHH')
+_SYS_METADATA_VERSION = 1
+_SYS_LENGTH_IS_STR = 0x1
+_SYS_HAS_DELETE_AT = 0x2
+_SYS_HAS_SIGNATURE = 0x4
+# The object has no metadata but the system fields
+_SYS_COMPLETE = 0x8
+_SYS_OBJECT_TYPES = (FILE, DIR_OBJECT, DIR_NON_OBJECT)
+# Keys of the metadata of an object held by the system metadata xattr
+SYS_METADATA_KEYS = frozenset((X_TIMESTAMP, X_CONTENT_LENGTH, X_ETAG,
+                               X_CONTENT_TYPE, X_TYPE, X_OBJECT_TYPE,
+                               X_CONTENT_SIGNATURE, X_DELETE_AT))
+
+
+def _pack_sys_metadata(metadata):
+    """
+    Return the system metadata xattr of the metadata of an object, or None
+    if its system fields cannot be stored there exactly.
+    """
+    if metadata.get(X_TYPE) != OBJECT:
+        return None
+    try:
+        object_type = _SYS_OBJECT_TYPES.index(metadata[X_OBJECT_TYPE])
+        timestamp = metadata[X_TIMESTAMP]
+        content_type = metadata[X_CONTENT_TYPE]
+        etag = metadata[X_ETAG]
+        length = metadata[X_CONTENT_LENGTH]
+    except (KeyError, ValueError):
+        return None
+    flags = 0
+    if isinstance(length, str):
+        if not length.isdigit() or str(int(length)) != length:
+            return None
+        flags |= _SYS_LENGTH_IS_STR
+        length = int(length)
+    delete_at = 0
+    if X_DELETE_AT in metadata:
+        delete_at = metadata[X_DELETE_AT]
+        if not isinstance(delete_at, str) or not delete_at.isdigit() or \
+                str(int(delete_at)) != delete_at:
+            return None
+        flags |= _SYS_HAS_DELETE_AT
+        delete_at = int(delete_at)
+    signature = ''
+    if X_CONTENT_SIGNATURE in metadata:
+        signature = metadata[X_CONTENT_SIGNATURE]
+        flags |= _SYS_HAS_SIGNATURE
+    if SYS_METADATA_KEYS.issuperset(metadata):
+        flags |= _SYS_COMPLETE
+    if not all(isinstance(value, str)
+               for value in (timestamp, content_type, etag, signature)) or \
+            len(etag) != 32 or etag != etag.lower():
+        return None
+    try:
+        return _SYS_METADATA.pack(
+            _SYS_METADATA_VERSION, flags, object_type, length, delete_at,
+            binascii.unhexlify(etag), len(timestamp), len(content_type),
+            len(signature)) + timestamp + content_type + signature
+    except (struct.error, TypeError):
+        return None
+
+
+def _unpack_sys_metadata(data):
+    version, flags, object_type, length, delete_at, etag, timestamp_len, \
+        content_type_len, signature_len = _SYS_METADATA.unpack_from(data)
+    if version != _SYS_METADATA_VERSION:
+        raise ValueError('Unsupported version %d' % version)
+    offset = _SYS_METADATA.size
+    if offset + timestamp_len + content_type_len + signature_len != \
+            len(data):
+        raise ValueError('Truncated or trailing data')
+    content_type_offset = offset + timestamp_len
+    signature_offset = content_type_offset + content_type_len
+    metadata = SysMetadata({
+        X_TYPE: OBJECT,
+        X_OBJECT_TYPE: _SYS_OBJECT_TYPES[object_type],
+        X_TIMESTAMP: data[offset:content_type_offset],
+        X_CONTENT_TYPE: data[content_type_offset:signature_offset],
+        X_ETAG: binascii.hexlify(etag),
+        X_CONTENT_LENGTH:
+            str(length) if flags & _SYS_LENGTH_IS_STR else length})
+    metadata.complete = bool(flags & _SYS_COMPLETE)
+    if flags & _SYS_HAS_DELETE_AT:
+        metadata[X_DELETE_AT] = str(delete_at)
+    if flags & _SYS_HAS_SIGNATURE:
+        metadata[X_CONTENT_SIGNATURE] = data[signature_offset:]
+    return metadata
+
+
+def read_sys_metadata(path_or_fd):
+    """
+    Read the system fields of the metadata of an object (the ones in
+    SYS_METADATA_KEYS) from the small, fixed-layout xattr write_metadata()
+    keeps a copy of them in when system_metadata_xattr is on, without
+    reading and decoding the rest of the metadata.
+
+    :param path_or_fd: File/Directory path or fd of the object
+    :returns: SysMetadata dictionary of the system fields, empty if
+              system_metadata_xattr is off or the object has no usable
+              system metadata xattr
+    """
+    if not Glusterfs._system_metadata_xattr:
+        return {}
+    try:
+        data = do_getxattr(path_or_fd, SYS_METADATA_KEY)
+    except IOError as err:
+        if err.errno != errno.ENODATA:
+            raise
+        return {}
+    try:
+        return _unpack_sys_metadata(data)
+    except (struct.error, ValueError, IndexError):
+        logging.warning("Invalid system metadata of %s", path_or_fd)
         return {}
 
 
+class SysMetadata(dict):
+    """
+    System fields of the metadata of an object returned by
+    read_sys_metadata(). complete is True when the object has no other
+    metadata, so that there is nothing more to read.
+    """
+    complete = False
+
+
+class StoredMetadata(dict):
+    """
+    Metadata returned by read_metadata(), along with the serialized form it
+    was read from, for write_metadata() to rewrite only the xattrs that
+    changed when it is written back. Copies keep the serialized form.
+    """
+    serialized = None
+
+    def copy(self):
+        metadata = StoredMetadata(self)
+        metadata.serialized = self.serialized
+        return metadata
+
+
+class LazyMetadata(dict):
+    """
+    Metadata of an object of which only the system fields, read from the
+    system metadata xattr, are known at first. The whole metadata is read
+    by calling load() the first time any other key is looked up, or the
+    metadata is iterated over, counted, copied or compared. Changes made
+    before then are kept.
+    """
+
+    # Same as StoredMetadata.serialized, once the metadata is read
+    serialized = None
+
+    def __init__(self, sys_metadata, load):
+        dict.__init__(self, sys_metadata)
+        self._load = load
+        self._removed = set()
+
+    def _full(self, key=None):
+        if self._load and key not in SYS_METADATA_KEYS:
+            load, self._load = self._load, None
+            metadata = load()
+            for k, v in metadata.iteritems():
+                if k not in self._removed and not dict.__contains__(self, k):
+                    dict.__setitem__(self, k, v)
+            self.serialized = getattr(metadata, 'serialized', None)
+        return self
+
+    def __getitem__(self, key):
+        return dict.__getitem__(self._full(key), key)
+
+    def get(self, key, default=None):
+        return dict.get(self._full(key), key, default)
+
+    def __contains__(self, key):
+        return dict.__contains__(self._full(key), key)
+
+    has_key = __contains__
+
+    def __delitem__(self, key):
+        dict.__delitem__(self._full(key), key)
+        self._removed.add(key)
+
+    def pop(self, key, *default):
+        value = dict.pop(self._full(key), key, *default)
+        self._removed.add(key)
+        return value
+
+    def setdefault(self, key, default=None):
+        return dict.setdefault(self._full(key), key, default)
+
+    def __nonzero__(self):
+        return bool(self._load) or dict.__len__(self) > 0
+
+    def __len__(self):
+        return dict.__len__(self._full())
+
+    def __iter__(self):
+        return dict.__iter__(self._full())
+
+    def keys(self):
+        return dict.keys(self._full())
+
+    def values(self):
+        return dict.values(self._full())
+
+    def items(self):
+        return dict.items(self._full())
+
+    def iterkeys(self):
+        return dict.iterkeys(self._full())
+
+    def itervalues(self):
+        return dict.itervalues(self._full())
+
+    def iteritems(self):
+        return dict.iteritems(self._full())
+
+    def update(self, *args, **kwargs):
+        dict.update(self._full(), *args, **kwargs)
+
+    def popitem(self):
+        return dict.popitem(self._full())
+
+    def clear(self):
+        dict.clear(self._full())
+
+    def copy(self):
+        metadata = StoredMetadata(self._full())
+        metadata.serialized = self.serialized
+        return metadata
+
+    def __eq__(self, other):
+        if isinstance(other, LazyMetadata):
+            other = other._full()
+        return dict.__eq__(self._full(), other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return dict.__repr__(self._full())
+
+
 def read_metadata(path_or_fd):
     """
     Helper function to read the serialized metadata from a File/Directory.
@@ -170,11 +616,13 @@ def read_metadata(path_or_fd):
     key = 0
     try:
         while True:
-            metastr += do_getxattr(path_or_fd, '%s%s' %
-                                   (METADATA_KEY, (key or '')))
+            chunk = do_getxattr(path_or_fd, '%s%s' %
+                                (METADATA_KEY, (key or '')))
+            metastr += chunk
             key += 1
-            if len(metastr) < MAX_XATTR_SIZE:
-                # Prevent further getxattr calls
+            if len(chunk) < MAX_XATTR_SIZE:
+                # Last one: any xattr after it is left over from larger
+                # metadata.
                 break
     except IOError as err:
         if err.errno != errno.ENODATA:
@@ -190,53 +638,141 @@ def read_metadata(path_or_fd):
         clean_metadata(path_or_fd)
 
     assert isinstance(metadata, dict)
+    if metadata:
+        metadata = StoredMetadata(metadata)
+        metadata.serialized = metastr
     return metadata
 
 
-def write_metadata(path_or_fd, metadata):
+def _is_metadata_key(name):
+    return name.startswith(METADATA_KEY) and \
+        (name == METADATA_KEY or name[len(METADATA_KEY):].isdigit())
+
+
+def write_metadata(path_or_fd, metadata, orig_metadata=None):
     """
     Helper function to write serialized metadata for a File/Directory.
 
+    When the metadata it replaces was read by read_metadata(), only the
+    xattrs holding chunks of its serialized form that changed are written,
+    and the trailing ones removed if it got shorter, provided that the
+    other ones still hold what was read: the metadata may have been
+    rewritten by another process since. Every chunk is written otherwise.
+
     :param path_or_fd: File/Directory path or fd to write the metadata
     :param metadata: dictionary of metadata write
+    :param orig_metadata: metadata of path_or_fd returned by
+                          read_metadata() that metadata replaces, by
+                          default metadata itself, or a copy of it, modified
+                          since it was read
     """
     assert isinstance(metadata, dict)
+    stored = metadata
+    if isinstance(metadata, LazyMetadata):
+        metadata = metadata.copy()
+    if orig_metadata is None:
+        orig_metadata = metadata
+    orig_metastr = getattr(orig_metadata, 'serialized', None)
     metastr = serialize_metadata(metadata)
-    key = 0
-    while metastr:
+    chunks = [metastr[i:i + MAX_XATTR_SIZE]
+              for i in xrange(0, len(metastr), MAX_XATTR_SIZE)]
+    orig_chunks = [orig_metastr[i:i + MAX_XATTR_SIZE]
+                   for i in xrange(0, len(orig_metastr or ''),
+                                   MAX_XATTR_SIZE)]
+    unchanged = [key for key, chunk in enumerate(chunks[:len(orig_chunks)])
+                 if orig_chunks[key] == chunk]
+    if not _metadata_chunks_match(path_or_fd, orig_chunks, unchanged):
+        # Left in place, they would mix two serialized forms
+        orig_chunks, unchanged = [], []
+    for key, chunk in enumerate(chunks):
+        if key in unchanged:
+            continue
+        _write_metadata_xattr(path_or_fd, '%s%s' % (METADATA_KEY, key or ''),
+                              chunk, key)
+    for key in xrange(len(chunks), len(orig_chunks)):
+        _remove_metadata_xattr(path_or_fd,
+                               '%s%s' % (METADATA_KEY, key or ''))
+    if len(orig_chunks) <= len(chunks) and chunks and \
+            len(chunks[-1]) == MAX_XATTR_SIZE:
+        # The chunk after a full last one would be read as part of the
+        # metadata, should it be left over from larger metadata.
+        _remove_metadata_xattr(path_or_fd,
+                               '%s%d' % (METADATA_KEY, len(chunks)))
+    if isinstance(stored, (StoredMetadata, LazyMetadata)):
+        stored.serialized = metastr
+    if Glusterfs._system_metadata_xattr and metadata.get(X_TYPE) == OBJECT:
+        # Copy of the system fields, read instead of the metadata by
+        # listings and DiskFile. Objects the fields of which cannot be
+        # stored there exactly have none.
+        sysstr = _pack_sys_metadata(metadata)
+        if sysstr is not None:
+            _write_metadata_xattr(path_or_fd, SYS_METADATA_KEY, sysstr,
+                                  SYS_METADATA_KEY)
+        else:
+            _remove_metadata_xattr(path_or_fd, SYS_METADATA_KEY)
+
+
+def _metadata_chunks_match(path_or_fd, orig_chunks, keys):
+    """
+    Return True if the xattrs of the chunks of the serialized metadata at
+    keys still hold orig_chunks. Reading them is cheaper than writing them.
+    """
+    for key in keys:
         try:
-            do_setxattr(path_or_fd,
-                        '%s%s' % (METADATA_KEY, key or ''),
-                        metastr[:MAX_XATTR_SIZE])
+            chunk = do_getxattr(path_or_fd, '%s%s' % (METADATA_KEY, key or ''))
         except IOError as err:
-            if err.errno in (errno.ENOSPC, errno.EDQUOT):
-                if isinstance(path_or_fd, int):
-                    filename = get_filename_from_fd(path_or_fd)
-                    do_log_rl("write_metadata(%d, metadata) failed: %s : %s",
-                              path_or_fd, err, filename)
-                else:
-                    do_log_rl("write_metadata(%s, metadata) failed: %s",
-                              path_or_fd, err)
-                raise DiskFileNoSpace()
-            else:
+            if err.errno != errno.ENODATA:
                 raise GlusterFileSystemIOError(
-                    err.errno,
-                    'setxattr("%s", %s, metastr)' % (path_or_fd, key))
-        metastr = metastr[MAX_XATTR_SIZE:]
-        key += 1
+                    err.errno, 'getxattr("%s", %s)' % (path_or_fd, key))
+            return False
+        if chunk != orig_chunks[key]:
+            return False
+    return True
+
+
+def _write_metadata_xattr(path_or_fd, xattr_key, value, key):
+    try:
+        do_setxattr(path_or_fd, xattr_key, value)
+    except IOError as err:
+        if err.errno in (errno.ENOSPC, errno.EDQUOT):
+            if isinstance(path_or_fd, int):
+                filename = get_filename_from_fd(path_or_fd)
+                do_log_rl("write_metadata(%d, metadata) failed: %s : %s",
+                          path_or_fd, err, filename)
+            else:
+                do_log_rl("write_metadata(%s, metadata) failed: %s",
+                          path_or_fd, err)
+            raise DiskFileNoSpace()
+        else:
+            raise GlusterFileSystemIOError(
+                err.errno,
+                'setxattr("%s", %s, metastr)' % (path_or_fd, key))
+
+
+def _remove_metadata_xattr(path_or_fd, key):
+    try:
+        do_removexattr(path_or_fd, key)
+    except IOError as err:
+        if err.errno != errno.ENODATA:
+            raise GlusterFileSystemIOError(
+                err.errno, 'removexattr("%s", %s)' % (path_or_fd, key))
 
 
 def clean_metadata(path_or_fd):
-    key = 0
-    while True:
+    try:
+        names = do_listxattr(path_or_fd)
+    except IOError as err:
+        raise GlusterFileSystemIOError(
+            err.errno, 'listxattr("%s")' % path_or_fd)
+    for name in names:
+        if not _is_metadata_key(name) and name != SYS_METADATA_KEY:
+            continue
         try:
-            do_removexattr(path_or_fd, '%s%s' % (METADATA_KEY, (key or '')))
+            do_removexattr(path_or_fd, name)
         except IOError as err:
-            if err.errno == errno.ENODATA:
-                break
-            raise GlusterFileSystemIOError(
-                err.errno, 'removexattr("%s", %s)' % (path_or_fd, key))
-        key += 1
+            if err.errno != errno.ENODATA:
+                raise GlusterFileSystemIOError(
+                    err.errno, 'removexattr("%s", %s)' % (path_or_fd, name))
 
 
 def validate_container(metadata):
@@ -286,12 +822,13 @@ def validate_object(metadata, statinfo=None):
     if not metadata:
         return False
 
-    if X_TIMESTAMP not in metadata.keys() or \
-       X_CONTENT_TYPE not in metadata.keys() or \
-       X_ETAG not in metadata.keys() or \
-       X_CONTENT_LENGTH not in metadata.keys() or \
-       X_TYPE not in metadata.keys() or \
-       X_OBJECT_TYPE not in metadata.keys():
+    # Membership tests only, so that the whole of a LazyMetadata is not read
+    if X_TIMESTAMP not in metadata or \
+       X_CONTENT_TYPE not in metadata or \
+       X_ETAG not in metadata or \
+       X_CONTENT_LENGTH not in metadata or \
+       X_TYPE not in metadata or \
+       X_OBJECT_TYPE not in metadata:
         return False
 
     if statinfo and stat.S_ISREG(statinfo.st_mode):
@@ -300,8 +837,13 @@ def validate_object(metadata, statinfo=None):
         if int(metadata[X_CONTENT_LENGTH]) != statinfo.st_size:
             return False
 
-        # TODO: Handle case where file content has changed but the length
-        # remains the same.
+        # File content has changed, even if its length has not. Metadata
+        # stored before signatures were has none, the length alone is
+        # checked then.
+        if X_CONTENT_SIGNATURE in metadata and \
+                metadata[X_CONTENT_SIGNATURE] != \
+                get_content_signature(statinfo):
+            return False
 
     if metadata[X_TYPE] == OBJECT:
         return True
@@ -363,44 +905,288 @@ def update_list(path, cont_path, dirs=[], files=[], object_count=0,
     return object_count, bytes_used
 
 
-def get_container_details(cont_path):
+def get_container_details(cont_path, workers=None, pace=None, names=None):
     """
-    get container details by traversing the filesystem
+    get container details by traversing the filesystem, reading up to
+    workers directories in parallel (see gf_parallel_walk()). pace, when
+    given, is called with the number of entries of every directory read,
+    and may sleep to limit the rate of the walk. names, when given, is a
+    list extended with the path relative to the container of every file
+    and directory found, objects or not.
     """
     bytes_used = 0
     object_count = 0
     obj_list = []
 
-    for (path, dirs, files) in gf_walk(cont_path):
+    for (path, dirs, files) in gf_parallel_walk(cont_path, workers=workers):
         object_count, bytes_used = update_list(path, cont_path, dirs,
                                                files, object_count,
                                                bytes_used, obj_list)
+        if names is not None:
+            rel_path = path[len(cont_path) + 1:]
+            names.extend(os.path.join(rel_path, name)
+                         for name in dirs + files)
+        if pace:
+            pace(len(dirs) + len(files))
 
         sleep()
 
     return obj_list, object_count, bytes_used
 
 
-def list_objects_gsexpiring_container(container_path):
+def get_quota_usage(path):
     """
-    This method does a simple walk, unlike get_container_details which
-    walks the filesystem tree and does a getxattr() on every directory
-    to check if it's a directory marker object and stat() on every file
-    to get it's size. These are not required for gsexpiring volume as
-    it can never have directory marker objects in it and all files are
-    zero-byte in size.
+    Return the usage of a directory maintained by GlusterFS directory quota
+    as a (bytes_used, file_count) tuple, or None if quota is not enabled on
+    the volume. GlusterFS releases older than 3.7 only keep track of the
+    size, in which case file_count is None.
     """
-    obj_list = []
+    try:
+        value = do_getxattr(path, QUOTA_SIZE_KEY)
+    except (IOError, OSError):
+        return None
+    if len(value) >= 24:
+        size, file_count, dir_count = struct.unpack('>qqq', value[:24])
+    elif len(value) == 8:
+        size, = struct.unpack('>q', value)
+        file_count = None
+    else:
+        return None
+    # Quota accounting of files being written or removed can briefly be off
+    return max(size, 0), \
+        max(file_count, 0) if file_count is not None else None
+
+
+def get_container_usage(cont_path, get_details=None, workers=None,
+                        pace=None, names=None):
+    """
+    Return the object count and bytes used of a container. They are read
+    from the GlusterFS quota xattrs of the container when quota is enabled,
+    which makes it a single getxattr. The container is walked otherwise,
+    using get_details, or get_container_details() with workers by default,
+    both passed pace, and names when given: the container is then walked
+    even when quota is enabled, for names to be filled.
+
+    The quota file count does not include directory objects, and includes
+    objects still being uploaded.
+    """
+    usage = get_quota_usage(cont_path)
+    if usage and usage[1] is not None and names is None:
+        return usage[1], usage[0]
+    kwargs = {'pace': pace}
+    if names is not None:
+        kwargs['names'] = names
+    if get_details:
+        objects, object_count, bytes_used = get_details(cont_path, **kwargs)
+    else:
+        objects, object_count, bytes_used = \
+            get_container_details(cont_path, workers, **kwargs)
+    if usage:
+        bytes_used = usage[0]
+        if usage[1] is not None:
+            object_count = usage[1]
+    return object_count, bytes_used
+
+
+# Kinds of entries returned by _sorted_entries(), in the order in which they
+# must be visited when their sort keys are equal.
+_ENTRY_FILE = 0
+_ENTRY_DIR = 1
+_ENTRY_DIR_CONTENTS = 2
+
+
+# Directories modified less than this many seconds before they were read may
+# be modified again without their mtime changing. Their entries are not
+# cached.
+SORTED_ENTRIES_RACY_WINDOW = 1.0
+
+# LRU of the sorted entries of the directories read last, by path, along with
+# the inode and mtime of the directory when it was read. Shared with the real
+# threads listing containers.
+_sorted_entries_cache = OrderedDict()
+_sorted_entries_cached = [0]
+_sorted_entries_lock = original('thread').allocate_lock()
+
+
+def _get_cached_entries(path, stats):
+    with _sorted_entries_lock:
+        try:
+            ino, mtime, entries = _sorted_entries_cache.pop(path)
+        except KeyError:
+            return None
+        if ino == stats.st_ino and mtime == stats.st_mtime:
+            _sorted_entries_cache[path] = (ino, mtime, entries)
+            return entries
+        _sorted_entries_cached[0] -= len(entries)
+    return None
+
+
+def _cache_entries(path, stats, entries):
+    max_entries = Glusterfs._listing_dir_cache_size
+    if len(entries) > max_entries or \
+            time.time() - stats.st_mtime < SORTED_ENTRIES_RACY_WINDOW:
+        return
+    with _sorted_entries_lock:
+        if path in _sorted_entries_cache:
+            _sorted_entries_cached[0] -= \
+                len(_sorted_entries_cache.pop(path)[2])
+        _sorted_entries_cache[path] = (stats.st_ino, stats.st_mtime, entries)
+        _sorted_entries_cached[0] += len(entries)
+        while _sorted_entries_cached[0] > max_entries:
+            _sorted_entries_cached[0] -= \
+                len(_sorted_entries_cache.popitem(last=False)[1][2])
+
+
+def _sorted_entries(path):
+    """
+    Return the entries of a directory as a list of (key, name, kind) tuples
+    sorted in the order of the object names they lead to. A sub-directory
+    appears twice: once as itself, with its name as key, and once for its
+    contents, with its name followed by a slash as key. This way 'a.txt'
+    correctly sorts between the directory 'a' and the objects under 'a/'.
+
+    The entries of the directories read last are kept in memory, up to
+    listing_dir_cache_size entries, and are returned again as long as the
+    mtime of the directory is unchanged. So paging through a container with
+    markers does not read and sort its largest directories again for every
+    page. The list returned must not be modified.
+    """
+    stats = None
+    if Glusterfs._listing_dir_cache_size:
+        try:
+            stats = do_stat(path)
+        except GlusterFileSystemOSError as err:
+            logging.warn("Skipping directory %s: %s", path, err)
+            return []
+        if not stats:
+            return []
+        entries = _get_cached_entries(path, stats)
+        if entries is not None:
+            return entries
+
+    entries = []
+    try:
+        for entry in gf_listdir(path):
+            if entry.is_dir():
+                entries.append((entry.name, entry.name, _ENTRY_DIR))
+                if not entry.is_symlink():
+                    entries.append((entry.name + os.path.sep, entry.name,
+                                    _ENTRY_DIR_CONTENTS))
+            else:
+                entries.append((entry.name, entry.name, _ENTRY_FILE))
+    except OSError as err:
+        # Same as gf_walk(), a directory that cannot be read is skipped.
+        if err.errno not in (errno.ENOENT, errno.ESTALE, errno.ENOTDIR):
+            logging.warn("Skipping directory %s: %s", path, err)
+    entries.sort()
+    if stats and stat.S_ISDIR(stats.st_mode):
+        _cache_entries(path, stats, entries)
+    return entries
+
+
+def _is_dir_object(path):
+    try:
+        metadata = read_metadata(path)
+    except GlusterFileSystemIOError as err:
+        if err.errno in (errno.ENOENT, errno.ESTALE):
+            # Directory might have been deleted by another process
+            return False
+        raise
+    return dir_is_object(metadata)
+
+
+def prefix_end_marker(prefix):
+    """
+    Return the smallest string greater than all the strings starting with
+    prefix, used to bound reverse listings. Object names are UTF-8, which
+    never holds a 0xFF byte, so the last character can always be bumped.
+    """
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
 
-    for (root, dirs, files) in os.walk(container_path):
-        for f in files:
-            obj_path = os.path.join(root, f)
-            obj = obj_path[(len(container_path) + 1):]
-            obj_list.append(obj)
+def iter_container_objects(cont_path, marker=None, end_marker=None,
+                           prefix=None, delimiter=None, path=None,
+                           reverse=False, files_only=False):
+    """
+    Lazily yield the names of the objects in a container, in sorted order,
+    without building the full list of objects first. Only the directories
+    that can hold names greater than marker and less than end_marker are
+    read, one at a time, so that a listing limited to N objects costs about
+    N directory entries of I/O instead of a walk of the whole container.
+
+    As object names map to real directories, a prefix is resolved by going
+    straight to the directory it names: 'photos/20' only reads the entries
+    of <container>/photos starting with '20', and the sub-trees below them.
+
+    With a '/' delimiter, only the first object of each sub-directory under
+    the prefix is yielded, which is all filter_delimiter() needs to roll it
+    up. With path set, sub-directories are not descended into at all.
+
+    With reverse, names are yielded in reverse sorted order and, same as
+    Swift, the meaning of the markers is swapped: names are less than marker
+    and greater than end_marker. The entries of every directory are walked
+    backwards, so the sub-tree of a directory comes before the directory.
+
+    Directories are listed as objects only if they are directory objects,
+    same as get_container_details(). With files_only, they are never listed
+    nor have their metadata read, for the tracker containers of gsexpiring
+    which hold no directory objects.
+    """
+    if reverse:
+        lower, upper = end_marker, marker
+    else:
+        lower, upper = marker, end_marker
+
+    def _below(obj_name, kind):
+        # All the names the entry leads to sort at or before lower
+        if kind == _ENTRY_DIR_CONTENTS:
+            return lower > obj_name and not lower.startswith(obj_name)
+        return obj_name <= lower
+
+    def _iter(dir_path, obj_prefix, partial='', rollup=False,
+              descend=True):
+        entries = _sorted_entries(dir_path)
         # Yield the co-routine cooperatively
         sleep()
+        if reverse:
+            entries = reversed(entries)
+        for key, name, kind in entries:
+            if partial and not key.startswith(partial):
+                if (key > partial) if reverse else (key < partial):
+                    continue
+                # Entries are sorted, none of the rest can match either
+                return
+            obj_name = obj_prefix + key
+            above = bool(upper) and obj_name >= upper
+            below = bool(lower) and _below(obj_name, kind)
+            if below if reverse else above:
+                # Past the last name of the listing
+                return
+            if above or below:
+                continue
+            if kind == _ENTRY_DIR_CONTENTS:
+                if not descend:
+                    continue
+                for obj in _iter(os.path.join(dir_path, name), obj_name):
+                    yield obj
+                    if rollup:
+                        break
+                continue
+            if kind == _ENTRY_DIR and (files_only or (
+                    not Glusterfs._implicit_dir_objects and
+                    not _is_dir_object(os.path.join(dir_path, name)))):
+                continue
+            yield obj_name
 
-    return obj_list
+    obj_prefix, partial = '', prefix or ''
+    if os.path.sep in partial:
+        dir_part, partial = partial.rsplit(os.path.sep, 1)
+        if set(dir_part.split(os.path.sep)) & set(['', '.', '..']):
+            # No object name has such path components
+            return iter([])
+        obj_prefix = dir_part + os.path.sep
+    return _iter(os.path.join(cont_path, obj_prefix), obj_prefix, partial,
+                 rollup=(delimiter == os.path.sep), descend=(path is None))
 
 
 def delete_tracker_object(container_path, obj):
@@ -446,7 +1232,8 @@ def get_account_details(acc_path):
 
     for entry in gf_listdir(acc_path):
         if entry.is_dir() and \
-                entry.name not in (TEMP_DIR, ASYNCDIR, TRASHCAN):
+                entry.name not in (TEMP_DIR, ASYNCDIR, TRASHCAN, INDEX_DIR,
+                                   EXISTENCE_FILTER_DIR):
             container_list.append(entry.name)
 
     return container_list, len(container_list)
@@ -501,9 +1288,21 @@ def _get_etag(path_or_fd):
     return etag
 
 
-def get_object_metadata(obj_path_or_fd, stats=None):
+def get_content_signature(stats):
     """
-    Return metadata of object.
+    Return the signature of the content of a file, as stored in the
+    X_CONTENT_SIGNATURE metadata: any write to the file or replacement of it
+    changes its signature. The ctime is left out, as writing the metadata
+    itself changes it.
+    """
+    return '%d:%d:%d' % (stats.st_ino, stats.st_size,
+                         int(round(stats.st_mtime * 1000000000)))
+
+
+def get_object_metadata(obj_path_or_fd, stats=None, etag=True):
+    """
+    Return metadata of object. When etag is False, the file is not read and
+    the metadata of a file has no ETag.
     """
     if not stats:
         if isinstance(obj_path_or_fd, int):
@@ -524,8 +1323,12 @@ def get_object_metadata(obj_path_or_fd, stats=None):
             X_TIMESTAMP: normalize_timestamp(stats.st_ctime),
             X_CONTENT_TYPE: DIR_TYPE if is_dir else FILE_TYPE,
             X_OBJECT_TYPE: DIR_NON_OBJECT if is_dir else FILE,
-            X_CONTENT_LENGTH: 0 if is_dir else stats.st_size,
-            X_ETAG: md5().hexdigest() if is_dir else _get_etag(obj_path_or_fd)}
+            X_CONTENT_LENGTH: 0 if is_dir else stats.st_size}
+        if is_dir:
+            metadata[X_ETAG] = md5().hexdigest()
+        elif etag:
+            metadata[X_ETAG] = _get_etag(obj_path_or_fd)
+            metadata[X_CONTENT_SIGNATURE] = get_content_signature(stats)
     return metadata
 
 
@@ -542,11 +1345,23 @@ def _add_timestamp(metadata_i):
     return metadata
 
 
-def get_container_metadata(cont_path):
-    objects = []
-    object_count = 0
-    bytes_used = 0
-    objects, object_count, bytes_used = get_container_details(cont_path)
+def get_container_metadata(cont_path, count=True):
+    """
+    Return the metadata of a container directory. When count is False, the
+    container is not walked: unless GlusterFS quota keeps its usage, its
+    object count and bytes used are set to 0 and marked X_STATS_PENDING, to
+    be computed later.
+    """
+    pending = False
+    if count:
+        object_count, bytes_used = get_container_usage(cont_path)
+    else:
+        usage = get_quota_usage(cont_path)
+        if usage and usage[1] is not None:
+            bytes_used, object_count = usage
+        else:
+            object_count, bytes_used = 0, 0
+            pending = True
     metadata = {X_TYPE: CONTAINER,
                 X_TIMESTAMP: normalize_timestamp(
                     do_getctime(cont_path)),
@@ -554,6 +1369,8 @@ def get_container_metadata(cont_path):
                     do_getmtime(cont_path)),
                 X_OBJECTS_COUNT: object_count,
                 X_BYTES_USED: bytes_used}
+    if pending:
+        metadata[X_STATS_PENDING] = 1
     return _add_timestamp(metadata)
 
 
@@ -594,8 +1411,8 @@ def create_object_metadata(obj_path_or_fd, stats=None, existing_meta={}):
     return restore_metadata(obj_path_or_fd, metadata_from_stat, existing_meta)
 
 
-def create_container_metadata(cont_path):
-    metadata = get_container_metadata(cont_path)
+def create_container_metadata(cont_path, count=True):
+    metadata = get_container_metadata(cont_path, count)
     rmd = restore_metadata(cont_path, metadata, {})
     return rmd
 
@@ -618,10 +1435,11 @@ def dir_is_object(metadata):
     return metadata.get(X_OBJECT_TYPE, "") == DIR_OBJECT
 
 
-def rmobjdir(dir_path, marker_dir_check=True):
+def rmobjdir(dir_path, marker_dir_check=True, workers=None):
     """
     Removes the directory as long as there are no objects stored in it. This
-    works for containers also.
+    works for containers also. Up to workers directories are read in
+    parallel (see gf_parallel_walk()).
     """
     try:
         do_rmdir(dir_path)
@@ -638,7 +1456,8 @@ def rmobjdir(dir_path, marker_dir_check=True):
     # We have a directory that is not empty, walk it to see if it is filled
     # with empty sub-directories that are not user created objects
     # (gratuitously created as a result of other object creations).
-    for (path, dirs, files) in gf_walk(dir_path, topdown=False):
+    for (path, dirs, files) in gf_parallel_walk(dir_path, topdown=False,
+                                                workers=workers):
         for directory in dirs:
             fullpath = os.path.join(path, directory)
 
@@ -683,6 +1502,55 @@ def rmobjdir(dir_path, marker_dir_check=True):
         return True
 
 
+def imap_ordered(func, iterable, concurrency):
+    """
+    Like itertools.imap(), but runs up to concurrency calls of func in
+    parallel green threads while yielding the results in the order of
+    iterable. Items are only taken from iterable as results are consumed,
+    so a caller that stops iterating early leaves at most concurrency calls
+    behind. Exceptions raised by func are re-raised in the caller.
+    """
+    items = iter(iterable)
+    pending = deque(spawn(func, item) for item in islice(items, concurrency))
+    while pending:
+        result = pending.popleft().wait()
+        for item in islice(items, 1):
+            pending.append(spawn(func, item))
+        yield result
+
+
+def iter_listing_chunks(pieces, chunk_size=LISTING_CHUNK_SIZE):
+    """
+    Join the strings yielded by pieces into chunks of at least chunk_size
+    bytes, but the last one, so that a streamed listing is not sent as one
+    tiny chunk per entry.
+    """
+    buf = []
+    size = 0
+    for piece in pieces:
+        buf.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield ''.join(buf)
+            buf = []
+            size = 0
+    if buf:
+        yield ''.join(buf)
+
+
+def iter_json_listing(records):
+    """
+    Yield the JSON array of the listing records, dicts, piece by piece: the
+    pieces joined are what json.dumps() of the list of records returns.
+    """
+    yield '['
+    separator = ''
+    for record in records:
+        yield separator + json.dumps(record)
+        separator = ', '
+    yield ']'
+
+
 def write_pickle(obj, dest, tmp=None, pickle_protocol=0):
     """
     Ensure that a pickle file gets written to disk.  The file is first written
@@ -723,6 +1591,7 @@ def write_pickle(obj, dest, tmp=None, pickle_protocol=0):
 
 DT_UNKNOWN = 0
 DT_DIR = 4
+DT_LNK = 10
 
 
 class SmallDirEntry(object):
@@ -751,6 +1620,19 @@ class SmallDirEntry(object):
         else:
             return self._d_type == DT_DIR
 
+    def is_symlink(self):
+        if self._d_type == DT_UNKNOWN:
+            try:
+                if not self._stat:
+                    self._stat = os.lstat(os.path.join(self._path, self.name))
+            except OSError as err:
+                if err.errno != errno.ENOENT:
+                    raise
+                return False
+            return stat.S_ISLNK(self._stat.st_mode)
+        else:
+            return self._d_type == DT_LNK
+
 
 def gf_listdir(path):
     if scandir_present:
@@ -805,3 +1687,118 @@ if scandir_present:
     gf_walk = _walk
 else:
     gf_walk = os.walk
+
+
+def _read_walk_dir(path, followlinks):
+    """
+    Read a directory for gf_parallel_walk(). Returns the names of its
+    sub-directories, of its other entries, and of the sub-directories to
+    descend into.
+    """
+    dirs, nondirs, descend = [], [], []
+    for entry in gf_listdir(path):
+        if entry.is_dir():
+            dirs.append(entry.name)
+            if followlinks or not entry.is_symlink():
+                descend.append(entry.name)
+        else:
+            nondirs.append(entry.name)
+    return dirs, nondirs, descend
+
+
+_stdlib_threading = original('threading')
+_stdlib_queue = original('Queue')
+
+
+def _in_hub_thread():
+    """
+    Return True if called from the main thread, where the eventlet hub of
+    the servers and daemons runs, rather than from a tpool or ThreadPool
+    thread.
+    """
+    return isinstance(_stdlib_threading.current_thread(),
+                      _stdlib_threading._MainThread)
+
+
+def gf_parallel_walk(top, topdown=True, onerror=None, followlinks=False,
+                     workers=None):
+    """
+    Same as gf_walk(), except that up to workers directories are read at
+    the same time, in real threads, so that the latency of reading
+    directories over FUSE is overlapped. A directory is always yielded
+    before its sub-directories (after them if topdown is False), but in no
+    particular order otherwise, and the list of sub-directories yielded
+    cannot be modified to prune the walk.
+
+    From the main thread, directories are read by green threads through
+    tpool so that the hub is not blocked. From any other thread, such as
+    the ones full scans run in, tpool.execute() would read them one by one
+    in the calling thread, so they are read by threads started for the
+    walk instead.
+
+    :param workers: number of directories read in parallel, defaults to the
+                    walk_workers option. 1 walks serially using gf_walk().
+    """
+    if workers is None:
+        workers = Glusterfs._walk_workers
+    if workers <= 1:
+        for x in gf_walk(top, topdown, onerror, followlinks):
+            yield x
+        return
+
+    def _read(path):
+        try:
+            results.put((path, read_dir(path, followlinks), None))
+        except Exception as err:
+            results.put((path, None, err))
+
+    threads = []
+    if _in_hub_thread():
+        results = LightQueue()
+        read_dir = partial(tpool.execute, _read_walk_dir)
+        submit = partial(GreenPool(workers).spawn_n, _read)
+    else:
+        results = _stdlib_queue.Queue()
+        read_dir = _read_walk_dir
+        paths = _stdlib_queue.Queue()
+        submit = paths.put
+
+        def _worker():
+            for path in iter(paths.get, None):
+                _read(path)
+
+        for i in xrange(workers):
+            thread = _stdlib_threading.Thread(target=_worker)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+    try:
+        submit(top)
+        pending = 1
+        visited = []
+        while pending:
+            path, entries, err = results.get()
+            pending -= 1
+            if err is not None:
+                if not isinstance(err, OSError):
+                    raise err
+                if onerror is not None:
+                    onerror(err)
+                continue
+            dirs, nondirs, descend = entries
+            for name in descend:
+                submit(os.path.join(path, name))
+                pending += 1
+            if topdown:
+                yield path, dirs, nondirs
+            else:
+                visited.append((path, dirs, nondirs))
+    finally:
+        # Stops the threads once done with the directories submitted
+        for thread in threads:
+            paths.put(None)
+    # Directories are visited after their parent, so in reverse order a
+    # directory comes after all of its sub-directories.
+    for x in reversed(visited):
+        yield x
@@ -0,0 +1,332 @@
+# Copyright (c) 2016 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Background crawler keeping the object count and bytes used of containers up
+to date.
+
+Counting the objects of a container means walking its whole directory tree,
+which is far too slow to do while serving a HEAD or GET request on a large
+container. The crawler does it in the background instead, and records the
+result in the container xattrs, where DiskDir.get_info() finds it when
+container_update_object_count is turned off in fs.conf. It also rebuilds the
+existence filters of containers when existence_filter is on.
+"""
+
+# This import will monkey-patch Ring and other classes.
+# Do not remove.
+import gluster.swift.common.constraints  # noqa
+
+import os
+import json
+import time
+from random import random
+
+from eventlet import GreenPool, sleep
+from eventlet.patcher import original
+
+from gluster.swift.common import Glusterfs, listing_cache
+from gluster.swift.common.container_index import ContainerIndex
+from gluster.swift.common.existence_filter import rebuild_filter
+from gluster.swift.common.utils import read_metadata, write_metadata, \
+    get_container_usage, get_account_details, \
+    X_OBJECTS_COUNT, X_BYTES_USED, X_STATS_PENDING
+
+from swift.common.daemon import Daemon
+from swift.common.utils import get_logger, config_true_value, ismount, \
+    ratelimit_sleep, ThreadPool
+
+
+def _with_parents(names):
+    """
+    Yield every name along with its parent directories, the first time
+    they are found.
+    """
+    parents = set()
+    for name in names:
+        missing = []
+        parent = os.path.dirname(name)
+        while parent and parent not in parents:
+            parents.add(parent)
+            missing.append(parent)
+            parent = os.path.dirname(parent)
+        for parent in reversed(missing):
+            yield parent
+        yield name
+
+
+class ContainerCrawler(Daemon):
+    """
+    Crawl the containers of every volume and update their object count and
+    bytes used.
+    """
+
+    def __init__(self, conf, logger=None):
+        self.conf = conf
+        self.logger = logger or get_logger(conf,
+                                           log_route='container-crawler')
+        self.devices = conf.get('devices', '/mnt/gluster-object')
+        self.mount_check = config_true_value(conf.get('mount_check', 'true'))
+        self.interval = int(conf.get('interval', 3600))
+        self.concurrency = int(conf.get('concurrency', 4))
+        # Maximum number of objects counted per second on every volume
+        self.objects_per_second = float(conf.get('objects_per_second', 1000))
+        self.checkpoint_file = conf.get(
+            'checkpoint_file',
+            os.path.join(Glusterfs.RUN_DIR, 'container-crawler.json'))
+        # Seconds between two saves of the checkpoint
+        self.checkpoint_interval = float(conf.get('checkpoint_interval', 30))
+        self.expiring_objects_account = \
+            (conf.get('auto_create_account_prefix') or 'gs') + \
+            (conf.get('expiring_objects_account_name') or 'expiring')
+
+        self.checkpoint = {}
+        self.checkpoint_saved = 0
+        # nthread=0 is intentional. This ensures that no green pool is
+        # used. Call to force_run_in_thread() will ensure that the method
+        # passed as arg is run in a real external thread using eventlet.tpool
+        # which has a threadpool of 20 threads (default)
+        self.threadpool = ThreadPool(nthreads=0)
+
+    def load_checkpoint(self):
+        """
+        Load the last container crawled on every volume by an interrupted
+        crawl, if any.
+        """
+        try:
+            with open(self.checkpoint_file) as fp:
+                checkpoint = json.load(fp)
+        except IOError:
+            checkpoint = {}
+        except ValueError as err:
+            self.logger.warning('Ignoring unreadable checkpoint %s: %s',
+                                self.checkpoint_file, err)
+            checkpoint = {}
+        if not isinstance(checkpoint, dict):
+            checkpoint = {}
+        self.checkpoint = dict((volume.encode('utf-8'),
+                                container.encode('utf-8'))
+                               for volume, container in checkpoint.items())
+
+    def save_checkpoint(self, force=False):
+        now = time.time()
+        if not force and now - self.checkpoint_saved < \
+                self.checkpoint_interval:
+            return
+        tmp_file = self.checkpoint_file + '.tmp'
+        try:
+            with open(tmp_file, 'w') as fp:
+                json.dump(self.checkpoint, fp)
+            os.rename(tmp_file, self.checkpoint_file)
+        except (IOError, OSError) as err:
+            self.logger.error('Failed to save checkpoint %s: %s',
+                              self.checkpoint_file, err)
+            return
+        self.checkpoint_saved = now
+
+    def get_volumes(self):
+        try:
+            volumes = os.listdir(self.devices)
+        except OSError as err:
+            self.logger.error('Failed to list volumes in %s: %s',
+                              self.devices, err)
+            return []
+        paths = []
+        for volume in sorted(volumes):
+            if volume == self.expiring_objects_account:
+                # Tracker objects are not counted by the container server
+                continue
+            vol_path = os.path.join(self.devices, volume)
+            if self.mount_check and not ismount(vol_path):
+                self.logger.warning('%s is not mounted', volume)
+                continue
+            paths.append(vol_path)
+        return paths
+
+    def crawl_container(self, vol_path, container, pace=None):
+        """
+        Count the objects and bytes used of a container and record them in
+        its xattrs, rebuilding its existence filter on the way when
+        existence_filter is on.
+
+        :param pace: called with the number of objects found as the
+                     container is walked, sleeps to limit the rate of the
+                     walk
+        :returns: the number of objects in the container
+        """
+        cont_path = os.path.join(vol_path, container)
+        metadata = read_metadata(cont_path)
+        if not metadata:
+            # Not a container created through the REST API yet, the
+            # container server initializes its metadata on first access.
+            return 0
+        index = None
+        if Glusterfs._container_index:
+            index = ContainerIndex(vol_path, container)
+            if not index.exists():
+                index = None
+
+        if Glusterfs._existence_filter:
+            # The filter is fed the names found while counting, sized for
+            # the count last recorded.
+            usage = []
+
+            def _iter_names():
+                names = []
+                usage.extend(self._count_objects(vol_path, container, index,
+                                                 pace, names))
+                return names
+
+            if not rebuild_filter(vol_path, container, _iter_names,
+                                  int(metadata.get(X_OBJECTS_COUNT,
+                                                   (0, 0))[0])):
+                self.logger.info('Existence filter of %s dropped while '
+                                 'being rebuilt', cont_path)
+            object_count, bytes_used = usage
+        else:
+            object_count, bytes_used = self._count_objects(
+                vol_path, container, index, pace)
+
+        # The walk can take long: start again from the metadata as it is
+        # now, not to revert the changes made meanwhile, by a POST for
+        # example.
+        metadata = read_metadata(cont_path)
+        if not metadata:
+            return object_count
+        if X_OBJECTS_COUNT not in metadata \
+                or int(metadata[X_OBJECTS_COUNT][0]) != object_count \
+                or X_BYTES_USED not in metadata \
+                or int(metadata[X_BYTES_USED][0]) != bytes_used \
+                or X_STATS_PENDING in metadata:
+            metadata[X_OBJECTS_COUNT] = (object_count, 0)
+            metadata[X_BYTES_USED] = (bytes_used, 0)
+            metadata.pop(X_STATS_PENDING, None)
+            write_metadata(cont_path, metadata)
+        return object_count
+
+    def _count_objects(self, vol_path, container, index, pace, names=None):
+        """
+        Count the objects and bytes used of a container, from its index
+        rebuilt when there is one. names, when given, is a list extended
+        with the names of all the files and directories of the container,
+        which the object server all serves as objects.
+        """
+        cont_path = os.path.join(vol_path, container)
+        if index is not None:
+            # Rebuilding the index reconciles its counters as well
+            index.rebuild(pace)
+            stats = index.get_stats()
+            if names is not None:
+                names.extend(_with_parents(index.iter_names()))
+            return stats['object_count'], stats['bytes_used']
+        if Glusterfs._listing_cache:
+            return get_container_usage(
+                cont_path, listing_cache.get_container_details, pace=pace,
+                names=names)
+        return get_container_usage(
+            cont_path, workers=Glusterfs.get_walk_workers(
+                os.path.basename(vol_path)), pace=pace, names=names)
+
+    def _crawl_container(self, vol_path, container, pace=None):
+        start = time.time()
+        try:
+            object_count = self.threadpool.force_run_in_thread(
+                self.crawl_container, vol_path, container, pace)
+        except Exception:
+            self.logger.exception('Failed to crawl container %s',
+                                  os.path.join(vol_path, container))
+            self.logger.increment('errors')
+            return container, 0
+        self.logger.timing_since('container.timing', start)
+        return container, object_count
+
+    def crawl_volume(self, vol_path):
+        """
+        Crawl the containers of a volume in name order, concurrently, and
+        no faster than objects_per_second. The last container crawled is
+        checkpointed so that an interrupted crawl resumes from there.
+
+        :returns: the number of objects counted
+        """
+        volume = os.path.basename(vol_path)
+        try:
+            containers = sorted(get_account_details(vol_path)[0])
+        except OSError as err:
+            self.logger.error('Failed to list containers of %s: %s',
+                              vol_path, err)
+            return 0
+        last = self.checkpoint.get(volume)
+        if last:
+            self.logger.info('Resuming crawl of %s after container %s',
+                             volume, last)
+            containers = [c for c in containers if c > last]
+
+        running_time = [0]
+        # Containers are walked in real threads
+        pacing = original('threading').Lock()
+
+        def _pace(count):
+            # Hold the walk back, directory by directory, until the objects
+            # found fit in the rate allowed on the volume.
+            with pacing:
+                running_time[0] = ratelimit_sleep(running_time[0],
+                                                  self.objects_per_second,
+                                                  incr_by=count)
+
+        def _crawl(container):
+            return self._crawl_container(vol_path, container, _pace)
+
+        object_count = 0
+        pool = GreenPool(self.concurrency)
+        # imap yields in order, so every container up to the one returned
+        # has been crawled.
+        for container, count in pool.imap(_crawl, containers):
+            object_count += count
+            self.logger.update_stats('objects', count)
+            self.checkpoint[volume] = container
+            self.save_checkpoint()
+        self.checkpoint.pop(volume, None)
+        self.save_checkpoint(force=True)
+        return object_count
+
+    def run_once(self, *args, **kwargs):
+        """
+        Crawl every volume once, concurrently.
+        """
+        self.logger.info('Begin container crawl')
+        begin = time.time()
+        self.load_checkpoint()
+        pool = GreenPool()
+        object_count = sum(pool.imap(self.crawl_volume, self.get_volumes()))
+        elapsed = time.time() - begin
+        self.logger.timing_since('crawl.timing', begin)
+        self.logger.info('Container crawl completed: %d objects in %.02fs '
+                         '(%.02f objects/s)', object_count, elapsed,
+                         object_count / elapsed if elapsed else 0)
+
+    def run_forever(self, *args, **kwargs):
+        """
+        Crawl every volume every interval seconds.
+        """
+        sleep(random() * self.interval)
+        while True:
+            begin = time.time()
+            try:
+                self.run_once(*args, **kwargs)
+            except Exception:
+                self.logger.exception('Unhandled exception')
+            elapsed = time.time() - begin
+            if elapsed < self.interval:
+                sleep(self.interval - elapsed)
@@ -19,18 +19,29 @@
 # needs
 import gluster.swift.common.constraints    # noqa
 
+import math
+from itertools import chain
+from xml.etree.cElementTree import Element, SubElement, tostring
+from xml.sax import saxutils
+
 from swift.container import server
+from gluster.swift.common import Glusterfs
 from gluster.swift.common.DiskDir import DiskDir
-from swift.common.utils import public, timing_stats
+from gluster.swift.common.utils import iter_listing_chunks, iter_json_listing
+from swift.common.utils import public, timing_stats, config_true_value
 from swift.common.exceptions import DiskFileNoSpace
 from swift.common.swob import HTTPInsufficientStorage, HTTPNotFound, \
-    HTTPPreconditionFailed
+    HTTPPreconditionFailed, HTTPNoContent, Response
+from swift.common.request_helpers import is_sys_or_user_meta
 from swift.common.request_helpers import get_param, get_listing_content_type, \
     split_and_validate_path
 from swift.common.constraints import check_mount
 from swift.container.server import gen_resp_headers
 from swift.common import constraints
 
+# Container metadata making its listings stat-only
+STAT_ONLY_META = 'X-Container-Meta-Stat-Only'
+
 
 class ContainerController(server.ContainerController):
     """
@@ -103,15 +114,18 @@ class ContainerController(server.ContainerController):
             return HTTPPreconditionFailed(body='Bad delimiter')
         marker = get_param(req, 'marker', '')
         end_marker = get_param(req, 'end_marker')
+        reverse = config_true_value(get_param(req, 'reverse'))
         limit = constraints.CONTAINER_LISTING_LIMIT
+        max_limit = constraints.CONTAINER_LISTING_LIMIT
+        if Glusterfs._streaming_listings:
+            max_limit = max(max_limit, Glusterfs._streaming_listing_limit)
         given_limit = get_param(req, 'limit')
         if given_limit and given_limit.isdigit():
             limit = int(given_limit)
-            if limit > constraints.CONTAINER_LISTING_LIMIT:
+            if limit > max_limit:
                 return HTTPPreconditionFailed(
                     request=req,
-                    body='Maximum limit is %d'
-                    % constraints.CONTAINER_LISTING_LIMIT)
+                    body='Maximum limit is %d' % max_limit)
         out_content_type = get_listing_content_type(req)
         if self.mount_check and not check_mount(self.root, drive):
             return HTTPInsufficientStorage(drive=drive, request=req)
@@ -122,13 +136,80 @@ class ContainerController(server.ContainerController):
         resp_headers = gen_resp_headers(info, is_deleted=is_deleted)
         if is_deleted:
             return HTTPNotFound(request=req, headers=resp_headers)
+        # Listings of names, sizes and times only, without reading the
+        # xattrs of every object, when asked for by the request or the
+        # container.
+        stat_only = config_true_value(get_param(req, 'stat_only')) or \
+            config_true_value(broker.metadata.get(STAT_ONLY_META,
+                                                  ('', 0))[0])
+        if Glusterfs._streaming_listings:
+            container_list = broker.iter_objects(
+                limit, marker, end_marker, prefix, delimiter, path,
+                storage_policy_index=info['storage_policy_index'],
+                out_content_type=out_content_type, stat_only=stat_only,
+                reverse=reverse)
+            return self.create_streaming_listing(
+                req, out_content_type, info, resp_headers, broker.metadata,
+                container_list, container)
         container_list = broker.list_objects_iter(
             limit, marker, end_marker, prefix, delimiter, path,
             storage_policy_index=info['storage_policy_index'],
-            out_content_type=out_content_type)
+            out_content_type=out_content_type, stat_only=stat_only,
+            reverse=reverse)
         return self.create_listing(req, out_content_type, info, resp_headers,
                                    broker.metadata, container_list, container)
 
+    def create_streaming_listing(self, req, out_content_type, info,
+                                 resp_headers, metadata, container_list,
+                                 container):
+        """
+        Same as create_listing(), but the body is sent as the objects are
+        listed instead of being built in memory first. container_list may
+        be any iterable.
+        """
+        for key, (value, timestamp) in metadata.items():
+            if value and (key.lower() in self.save_headers or
+                          is_sys_or_user_meta('container', key)):
+                resp_headers[key] = value
+        container_list = iter(container_list)
+        if out_content_type == 'application/json':
+            body = iter_json_listing(self.update_data_record(record)
+                                     for record in container_list)
+        elif out_content_type.endswith('/xml'):
+            body = self._iter_listing_xml(container_list, container)
+        else:
+            try:
+                first = next(container_list)
+            except StopIteration:
+                return HTTPNoContent(request=req, headers=resp_headers)
+            body = (rec[0] + '\n' for rec in chain([first], container_list))
+        ret = Response(request=req, headers=resp_headers,
+                       content_type=out_content_type, charset='utf-8',
+                       app_iter=iter_listing_chunks(body))
+        ret.last_modified = math.ceil(float(resp_headers['X-PUT-Timestamp']))
+        return ret
+
+    def _iter_listing_xml(self, container_list, container):
+        yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+        yield '<container name=%s>' % saxutils.quoteattr(container)
+        for obj in container_list:
+            record = self.update_data_record(obj)
+            if 'subdir' in record:
+                name = record['subdir'].decode('utf-8')
+                element = Element('subdir', name=name)
+                SubElement(element, 'name').text = name
+            else:
+                element = Element('object')
+                for field in ["name", "hash", "bytes", "content_type",
+                              "last_modified"]:
+                    SubElement(element, field).text = str(
+                        record.pop(field)).decode('utf-8')
+                for field in sorted(record):
+                    SubElement(element, field).text = str(
+                        record[field]).decode('utf-8')
+            yield tostring(element, encoding='utf-8')
+        yield '</container>'
+
 
 def app_factory(global_conf, **local_conf):
     """paste.deploy app factory for creating WSGI container server apps."""
@@ -35,16 +35,19 @@ from swift.common.exceptions import DiskFileNotExist, DiskFileError, \
 from swift.common.swob import multi_range_iterator
 
 from gluster.swift.common.exceptions import GlusterFileSystemOSError
+from gluster.swift.common.container_index import index_add, index_remove
+from gluster.swift.common.existence_filter import filter_add
 from gluster.swift.common.fs_utils import do_fstat, do_open, do_close, \
     do_unlink, do_chown, do_fsync, do_fchown, do_stat, do_write, do_read, \
     do_fadvise64, do_rename, do_fdatasync, do_lseek, do_mkdir
 from gluster.swift.common.utils import read_metadata, write_metadata, \
     validate_object, create_object_metadata, rmobjdir, dir_is_object, \
-    get_object_metadata
+    get_object_metadata, get_content_signature, read_sys_metadata, \
+    LazyMetadata
 from gluster.swift.common.utils import X_CONTENT_TYPE, \
     X_TIMESTAMP, X_TYPE, X_OBJECT_TYPE, FILE, OBJECT, DIR_TYPE, \
     FILE_TYPE, DEFAULT_UID, DEFAULT_GID, DIR_NON_OBJECT, DIR_OBJECT, \
-    X_ETAG, X_CONTENT_LENGTH
+    X_ETAG, X_CONTENT_LENGTH, X_CONTENT_SIGNATURE
 from swift.obj.diskfile import DiskFileManager as SwiftDiskFileManager
 
 # FIXME: Hopefully we'll be able to move to Python 2.7+ where O_CLOEXEC will
@@ -276,6 +279,10 @@ class DiskFileWriter(object):
         return self._upload_size
 
     def _finalize_put(self, metadata):
+        # The ETag was computed while the data was written, record what it
+        # was computed from so that it is not computed again on GET.
+        metadata[X_CONTENT_SIGNATURE] = \
+            get_content_signature(do_fstat(self._fd))
         # Write out metadata before fsync() to ensure it is also forced to
         # disk.
         write_metadata(self._fd, metadata)
@@ -361,6 +368,9 @@ class DiskFileWriter(object):
             else:
                 # Success!
                 break
+        index_add(df._device_path, df._container, df._obj_name,
+                  self._upload_size)
+        filter_add(df._device_path, df._container, df._obj_name)
         # Close here so the calling context does not have to perform this
         # in a thread.
         self.close()
@@ -382,6 +392,10 @@ class DiskFileWriter(object):
         if dir_is_object(metadata):
             df._threadpool.force_run_in_thread(
                 df._create_dir_object, df._data_file, metadata)
+            df._threadpool.force_run_in_thread(
+                index_add, df._device_path, df._container, df._obj_name)
+            df._threadpool.force_run_in_thread(
+                filter_add, df._device_path, df._container, df._obj_name)
             return
 
         if df._stat and stat.S_ISDIR(df._stat.st_mode):
@@ -576,6 +590,7 @@ class DiskFile(object):
         self._container_path = os.path.join(self._device_path, self._container)
 
         obj = obj.strip(os.path.sep)
+        self._obj_name = obj
         obj_path, self._obj = os.path.split(obj)
         if obj_path:
             self._obj_path = obj_path.strip(os.path.sep)
@@ -587,6 +602,8 @@ class DiskFile(object):
 
         self._data_file = os.path.join(self._put_datadir, self._obj)
         self._disk_file_open = False
+        # Reader the file opened was handed over to
+        self._reader = None
 
     def open(self):
         """
@@ -621,7 +638,7 @@ class DiskFile(object):
             obj_size = self._stat.st_size
 
             if not self._metadata:
-                self._metadata = read_metadata(self._fd)
+                self._metadata = self._read_metadata(self._fd)
             if not validate_object(self._metadata, self._stat):
                 self._metadata = create_object_metadata(self._fd, self._stat,
                                                         self._metadata)
@@ -656,6 +673,31 @@ class DiskFile(object):
         self._disk_file_open = True
         return self
 
+    def _read_metadata(self, path_or_fd):
+        """
+        Read the system metadata xattr of the object alone if it has one,
+        and the rest of its metadata only once it is needed, usually to
+        build the response to a GET or HEAD. Reads the whole metadata
+        otherwise.
+        """
+        sys_metadata = read_sys_metadata(path_or_fd)
+        if not sys_metadata:
+            return read_metadata(path_or_fd)
+        if sys_metadata.complete:
+            # Nothing else to read
+            return sys_metadata
+        return LazyMetadata(sys_metadata, self._load_metadata)
+
+    def _load_metadata(self):
+        # From the file opened, if it still is, by the reader it was handed
+        # over to for a GET.
+        fd = self._fd
+        if fd is None and self._reader is not None:
+            fd = self._reader._fd
+        if fd is not None and fd > -1:
+            return read_metadata(fd)
+        return read_metadata(self._data_file)
+
     def _is_object_expired(self, metadata):
         try:
             x_delete_at = int(metadata['X-Delete-At'])
@@ -746,7 +788,7 @@ class DiskFile(object):
                             errors as the `open()` method.
         """
         try:
-            self._metadata = read_metadata(self._data_file)
+            self._metadata = self._read_metadata(self._data_file)
         except (OSError, IOError) as err:
             if err.errno in (errno.ENOENT, errno.ESTALE):
                 self._disk_file_does_not_exist = True
@@ -797,6 +839,7 @@ class DiskFile(object):
         # At this point the reader object is now responsible for closing
         # the file pointer.
         self._fd = None
+        self._reader = dr
         return dr
 
     def _create_dir_object(self, dir_path, metadata=None):
@@ -1000,26 +1043,25 @@ class DiskFile(object):
         :raises DiskFileError: this implementation will raise the same
                             errors as the `create()` method.
         """
-        metadata = self._keep_sys_metadata(metadata)
+        # If metadata has been previously fetched, use that.
+        # Stale metadata (outdated size/etag) would've been updated when
+        # metadata is fetched for the first time.
+        orig_metadata = self._metadata or read_metadata(self._data_file)
+        metadata = self._keep_sys_metadata(metadata, orig_metadata)
         data_file = os.path.join(self._put_datadir, self._obj)
         self._threadpool.run_in_thread(
-            write_metadata, data_file, metadata)
+            write_metadata, data_file, metadata, orig_metadata)
 
-    def _keep_sys_metadata(self, metadata):
+    def _keep_sys_metadata(self, metadata, orig_metadata):
         """
         Make sure system metadata is not lost when writing new user metadata
 
-        This method will read the existing metadata and check for system
-        metadata. If there are any, it should be appended to the metadata obj
-        the user is trying to write.
+        This method will check the existing metadata, orig_metadata, for
+        system metadata. If there are any, it should be appended to the
+        metadata obj the user is trying to write.
         """
-        # If metadata has been previously fetched, use that.
-        # Stale metadata (outdated size/etag) would've been updated when
-        # metadata is fetched for the first time.
-        orig_metadata = self._metadata or read_metadata(self._data_file)
-
         sys_keys = [X_CONTENT_TYPE, X_ETAG, 'name', X_CONTENT_LENGTH,
-                    X_OBJECT_TYPE, X_TYPE]
+                    X_OBJECT_TYPE, X_TYPE, X_CONTENT_SIGNATURE]
 
         for key in sys_keys:
             if key in orig_metadata:
@@ -1055,6 +1097,7 @@ class DiskFile(object):
         else:
             # Delete file object
             do_unlink(self._data_file)
+        index_remove(self._device_path, self._container, self._obj_name)
 
         # Garbage collection of non-object directories.  Now that we
         # deleted the file, determine if the current directory and any
@@ -20,14 +20,17 @@ import gluster.swift.common.constraints  # noqa
 import errno
 import os
 
-from gluster.swift.common.utils import delete_tracker_object
+from gluster.swift.common.utils import delete_tracker_object, \
+    iter_container_objects
 
 from swift.obj.expirer import ObjectExpirer as SwiftObjectExpirer
 from swift.common.http import HTTP_NOT_FOUND
+from swift.common.swob import HTTPNotFound
 from swift.common.internal_client import InternalClient, UnexpectedResponse
 from swift.common.utils import ThreadPool
 
-EXCLUDE_DIRS = ('.trashcan', '.glusterfs')
+EXCLUDE_DIRS = ('.trashcan', '.glusterfs', '.container_index',
+                '.existence_filter')
 
 
 class GlusterSwiftInternalClient(InternalClient):
@@ -60,14 +63,30 @@ class GlusterSwiftInternalClient(InternalClient):
             if os.path.isdir(container_path):
                 yield {'name': container.encode('utf8')}
 
-    def iter_objects(self, account, container):
+    def iter_objects(self, account, container, marker='', end_marker='',
+                     acceptable_statuses=(2, HTTP_NOT_FOUND)):
+        """
+        Yield the tracker objects of a container in sorted order, the same
+        as a container listing, walking the container lazily. The expirer
+        stops at the first tracker object not due yet, so only the due ones
+        and the directories holding them are read.
+
+        A missing container is what a 404 response to the listing would be:
+        nothing is yielded if it is one of acceptable_statuses, and
+        UnexpectedResponse is raised otherwise.
+        """
         container_path = os.path.join(self.devices, account, container)
-        # TODO: Use a slightly better implementation of os.walk()
-        for (root, dirs, files) in os.walk(container_path):
-            for f in files:
-                obj_path = os.path.join(root, f)
-                obj = obj_path[(len(container_path) + 1):]
-                yield {'name': obj.encode('utf8')}
+        if not os.path.isdir(container_path):
+            resp = HTTPNotFound()
+            if resp.status_int in acceptable_statuses or \
+                    resp.status_int // 100 in acceptable_statuses:
+                return
+            raise UnexpectedResponse('Unexpected response: %s' % resp.status,
+                                     resp)
+        for obj in iter_container_objects(container_path, marker,
+                                          end_marker or None,
+                                          files_only=True):
+            yield {'name': obj.decode('utf8')}
 
 
 class ObjectExpirer(SwiftObjectExpirer):
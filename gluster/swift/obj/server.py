@@ -17,11 +17,15 @@
 import errno
 import os
 
-from swift.common.swob import HTTPConflict, HTTPNotImplemented
-from swift.common.utils import public, timing_stats, replication, mkdirs
+from swift.common.swob import HTTPConflict, HTTPNotImplemented, \
+    HTTPNotFound, HTTPException
+from swift.common.utils import public, timing_stats, replication, mkdirs, \
+    ThreadPool
 from swift.common.request_helpers import split_and_validate_path
+from swift.common.http import HTTP_NOT_FOUND
 from swift.obj import server
 
+from gluster.swift.common import Glusterfs, existence_filter
 from gluster.swift.obj.diskfile import DiskFileManager
 from gluster.swift.common.fs_utils import do_ismount
 from gluster.swift.common.ring import Ring
@@ -61,6 +65,8 @@ class ObjectController(server.ObjectController):
         self.devices = conf.get('devices', '/mnt/gluster-object')
         self.swift_dir = conf.get('swift_dir', '/etc/swift')
         self.object_ring = self.get_object_ring()
+        # Reads the existence filters in real threads
+        self.threadpool = ThreadPool(nthreads=0)
 
     def container_update(self, *args, **kwargs):
         """
@@ -142,6 +148,49 @@ class ObjectController(server.ObjectController):
                 split_and_validate_path(request, 1, 5, True)
             return HTTPConflict(drive=device, request=request)
 
+    def _existence_probe(self, request, handler):
+        """
+        Respond 404 to a GET or HEAD request without going to the volume
+        when the existence filter of the container has no such object. One
+        in existence_filter_verify such requests is served from the volume
+        instead, and the filter is dropped if the object is found there.
+        """
+        if not Glusterfs._existence_filter:
+            return handler(self, request)
+        try:
+            device, partition, account, container, obj = \
+                split_and_validate_path(request, 5, 5, True)
+        except HTTPException:
+            return handler(self, request)
+        vol_path = os.path.join(self.devices, device)
+        # Same name as DiskFile adds to the filter: a directory marker PUT
+        # as "photos/" is stored as "photos".
+        obj = obj.strip(os.path.sep)
+        if not existence_filter.is_absent(vol_path, container, obj,
+                                          self.threadpool):
+            return handler(self, request)
+        if not existence_filter.should_verify():
+            self.logger.increment('existence_filter.absent')
+            return HTTPNotFound(request=request)
+        resp = handler(self, request)
+        if resp.status_int != HTTP_NOT_FOUND and resp.status_int < 500:
+            self.logger.warning('Object %s/%s was not in the existence '
+                                'filter of its container, dropping it',
+                                container, obj)
+            self.logger.increment('existence_filter.missed')
+            self.threadpool.force_run_in_thread(
+                existence_filter.drop_filter, vol_path, container)
+        return resp
+
+    # Timed by the methods of Swift's ObjectController they wrap
+    @public
+    def GET(self, request):
+        return self._existence_probe(request, server.ObjectController.GET)
+
+    @public
+    def HEAD(self, request):
+        return self._existence_probe(request, server.ObjectController.HEAD)
+
     @public
     @replication
     @timing_stats(sample_rate=0.1)
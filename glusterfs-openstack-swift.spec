@@ -79,6 +79,8 @@ done
 %{_bindir}/gluster-swift-print-metadata
 %{_bindir}/gluster-swift-migrate-metadata
 %{_bindir}/gluster-swift-object-expirer
+%{_bindir}/gluster-swift-container-crawler
+%{_bindir}/gluster-swift-rebuild-index
 %{_bindir}/gswauth-add-account
 %{_bindir}/gswauth-add-user
 %{_bindir}/gswauth-cleanup-tokens
@@ -97,6 +99,7 @@ done
 %config(noreplace) %{_confdir}/proxy-server.conf-gluster
 %config(noreplace) %{_confdir}/fs.conf-gluster
 %config(noreplace) %{_confdir}/object-expirer.conf-gluster
+%config(noreplace) %{_confdir}/container-crawler.conf-gluster
 
 %changelog
 * Tue Mar 15 2015 Prashanth Pai <ppai@redhat.com> - 2.3.0-0
@@ -45,6 +45,8 @@ setup(
         'bin/gluster-swift-print-metadata',
         'bin/gluster-swift-migrate-metadata',
         'bin/gluster-swift-object-expirer',
+        'bin/gluster-swift-container-crawler',
+        'bin/gluster-swift-rebuild-index',
         'gluster/swift/common/middleware/gswauth/bin/gswauth-add-account',
         'gluster/swift/common/middleware/gswauth/bin/gswauth-add-user',
         'gluster/swift/common/middleware/gswauth/bin/gswauth-cleanup-tokens',
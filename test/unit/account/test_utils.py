@@ -0,0 +1,108 @@
+# Copyright (c) 2016 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Tests for gluster.swift.account.utils """
+
+import unittest
+from mock import patch
+
+from swift.common.swob import Request
+from gluster.swift.account import utils
+
+
+class FakeBroker(object):
+
+    def __init__(self, account_list):
+        self.account_list = account_list
+        self.iterated = False
+        self.args = None
+
+    def get_info(self):
+        return {'container_count': len(self.account_list),
+                'object_count': 0, 'bytes_used': 0,
+                'created_at': '1', 'put_timestamp': '1'}
+
+    @property
+    def metadata(self):
+        return {}
+
+    def get_policy_stats(self):
+        return {}
+
+    def list_containers_iter(self, *args):
+        self.args = args
+        return list(self.account_list)
+
+    def iter_containers(self, *args):
+        self.args = args
+        for item in self.account_list:
+            self.iterated = True
+            yield item
+
+
+class TestAccountUtils(unittest.TestCase):
+    """ Tests for gluster.swift.account.utils """
+
+    def test_streaming_account_listing_response(self):
+        req = Request.blank('/d/p/a')
+        account_list = [('c', 1, 2, 0), ('c&<>"', 3, 4, 0), ('d/', 0, 0, 1)]
+        for content_type in ('application/json', 'application/xml',
+                             'text/plain'):
+            expected = utils.account_listing_response(
+                'a', req, content_type, FakeBroker(account_list))
+            broker = FakeBroker(account_list)
+            with patch('gluster.swift.common.Glusterfs._streaming_listings',
+                       True):
+                resp = utils.account_listing_response(
+                    'a', req, content_type, broker)
+            if content_type != 'text/plain':
+                # Nothing is listed until the body is sent
+                self.assertFalse(broker.iterated)
+            self.assertEqual(''.join(resp.app_iter), expected.body)
+            self.assertEqual(resp.headers['Content-Type'],
+                             expected.headers['Content-Type'])
+            self.assertEqual(resp.headers['X-Account-Container-Count'], '3')
+
+    def test_streaming_account_listing_response_empty(self):
+        req = Request.blank('/d/p/a')
+        with patch('gluster.swift.common.Glusterfs._streaming_listings',
+                   True):
+            resp = utils.account_listing_response(
+                'a', req, 'text/plain', FakeBroker([]))
+            self.assertEqual(resp.status_int, 204)
+            resp = utils.account_listing_response(
+                'a', req, 'application/json', FakeBroker([]))
+            self.assertEqual(resp.status_int, 200)
+            self.assertEqual(resp.body, '[]')
+
+    def test_account_listing_response_reverse(self):
+        for streaming in (False, True):
+            with patch('gluster.swift.common.Glusterfs._streaming_listings',
+                       streaming):
+                broker = FakeBroker([('c', 1, 2, 0)])
+                utils.account_listing_response(
+                    'a', Request.blank('/d/p/a?reverse=on'), 'text/plain',
+                    broker)
+                self.assertTrue(broker.args[-1])
+                broker = FakeBroker([('c', 1, 2, 0)])
+                utils.account_listing_response(
+                    'a', Request.blank('/d/p/a'), 'text/plain', broker)
+                self.assertFalse(broker.args[-1])
+                # Given by the account server
+                broker = FakeBroker([('c', 1, 2, 0)])
+                utils.account_listing_response(
+                    'a', Request.blank('/d/p/a?reverse=on'), 'text/plain',
+                    broker, reverse=False)
+                self.assertFalse(broker.args[-1])
@@ -0,0 +1,234 @@
+# Copyright (c) 2016 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Tests for gluster.swift.common.container_index """
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from mock import patch
+
+from gluster.swift.common import container_index as ci
+from gluster.swift.common.utils import INDEX_DIR
+from test_utils import _initxattr, _destroyxattr
+
+
+class TestContainerIndex(unittest.TestCase):
+    """ Tests for gluster.swift.common.container_index """
+
+    def setUp(self):
+        _initxattr()
+        self.volume = tempfile.mkdtemp()
+        self.cont_path = os.path.join(self.volume, 'cont')
+        os.mkdir(self.cont_path)
+        self.index = ci.ContainerIndex(self.volume, 'cont')
+
+    def tearDown(self):
+        _destroyxattr()
+        shutil.rmtree(self.volume)
+
+    def _create_file(self, name):
+        path = os.path.join(self.cont_path, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fp:
+            fp.write(name)
+
+    def test_index_path(self):
+        assert self.index.db_file.startswith(
+            os.path.join(self.volume, INDEX_DIR) + os.sep)
+        assert self.index.db_file != \
+            ci.ContainerIndex(self.volume, 'cont2').db_file
+
+    def test_create(self):
+        assert not self.index.exists()
+        assert not self.index.is_ready()
+        self.index.create()
+        assert self.index.exists()
+        assert not self.index.is_ready()
+        self.index.create(ready=True)
+        assert self.index.is_ready()
+
+    def test_create_discards_stale_names(self):
+        self.index.create()
+        self.index.add('stale')
+        self.index.create(ready=True)
+        self.assertEqual(list(self.index.iter_names()), [])
+
+    def test_add_remove(self):
+        self.index.create(ready=True)
+        for name in ('b', 'a', 'c/d', 'c'):
+            self.index.add(name)
+        self.index.add('a')
+        self.assertEqual(list(self.index.iter_names()),
+                         ['a', 'b', 'c', 'c/d'])
+        self.index.remove('b')
+        self.index.remove('nonexistent')
+        self.assertEqual(list(self.index.iter_names()), ['a', 'c', 'c/d'])
+
+    def test_iter_names_bounds(self):
+        self.index.create(ready=True)
+        for name in ('a', 'b/1', 'b/2', 'b/3', 'c', 'd'):
+            self.index.add(name)
+        self.assertEqual(list(self.index.iter_names(marker='b/1')),
+                         ['b/2', 'b/3', 'c', 'd'])
+        self.assertEqual(list(self.index.iter_names(end_marker='b/2')),
+                         ['a', 'b/1'])
+        self.assertEqual(list(self.index.iter_names(prefix='b/')),
+                         ['b/1', 'b/2', 'b/3'])
+        self.assertEqual(list(self.index.iter_names(marker='b/1',
+                                                    prefix='b/')),
+                         ['b/2', 'b/3'])
+        self.assertEqual(list(self.index.iter_names(marker='a',
+                                                    prefix='b/')),
+                         ['b/1', 'b/2', 'b/3'])
+        self.assertEqual(list(self.index.iter_names(prefix='e')), [])
+
+    def test_iter_names_paging(self):
+        self.index.create(ready=True)
+        names = ['obj%03d' % i for i in range(25)]
+        for name in names:
+            self.index.add(name)
+        with patch.object(ci, 'PAGE_SIZE', 10):
+            self.assertEqual(list(self.index.iter_names()), names)
+            self.assertEqual(list(self.index.iter_names(marker='obj009')),
+                             names[10:])
+
+    def test_rebuild(self):
+        for name in ('z', 'a/b', 'a/c'):
+            self._create_file(name)
+        assert self.index.rebuild() == 3
+        assert self.index.is_ready()
+        self.assertEqual(list(self.index.iter_names()),
+                         ['a/b', 'a/c', 'z'])
+
+        # Stale names are removed, new names are added
+        os.unlink(os.path.join(self.cont_path, 'z'))
+        self._create_file('y')
+        self.index.rebuild()
+        self.assertEqual(list(self.index.iter_names()),
+                         ['a/b', 'a/c', 'y'])
+
+    def test_rebuild_concurrent_changes(self):
+        for name in ('a', 'b', 'c'):
+            self._create_file(name)
+        self.index.rebuild()
+        _orig_iter = self.index._iter_objects_sizes
+
+        def _iter_objects_sizes():
+            for name, size in _orig_iter():
+                if name == 'c':
+                    # Found by the walk, then the object server handles a
+                    # DELETE of a and c, a PUT of d and a PUT of b again.
+                    for obj in ('a', 'c'):
+                        os.unlink(os.path.join(self.cont_path, obj))
+                        self.index.remove(obj)
+                    self._create_file('d')
+                    self.index.add('d', 1)
+                    self.index.remove('b')
+                    self.index.add('b', 1)
+                yield name, size
+
+        with patch.object(self.index, '_iter_objects_sizes',
+                          _iter_objects_sizes):
+            self.assertEqual(self.index.rebuild(), 2)
+        self.assertEqual(list(self.index.iter_names()), ['b', 'd'])
+        # Removals are recorded while a rebuild is in progress only
+        self.index.remove('b')
+        conn = sqlite3.connect(self.index.db_file)
+        self.assertEqual(list(conn.execute("SELECT * FROM tombstone")), [])
+        conn.close()
+
+    def test_counters(self):
+        self.index.create(ready=True)
+        self.index.add('a', 10)
+        self.index.add('b', 5)
+        self.index.add('c')
+        stats = self.index.get_stats()
+        self.assertEqual((stats['object_count'], stats['bytes_used']),
+                         (3, 15))
+        # Overwriting an object only adjusts bytes used
+        self.index.add('a', 3)
+        stats = self.index.get_stats()
+        self.assertEqual((stats['object_count'], stats['bytes_used']),
+                         (3, 8))
+        self.index.remove('b')
+        self.index.remove('nonexistent')
+        stats = self.index.get_stats()
+        self.assertEqual((stats['object_count'], stats['bytes_used']),
+                         (2, 3))
+
+    def test_rebuild_reconciles_counters(self):
+        for name in ('z', 'a/b'):
+            self._create_file(name)
+        self.index.rebuild()
+        stats = self.index.get_stats()
+        self.assertEqual((stats['object_count'], stats['bytes_used']),
+                         (2, len('z') + len('a/b')))
+
+        # Counters drifted by changes made behind the back of the index
+        self.index.add('gone', 100)
+        self.index.rebuild()
+        stats = self.index.get_stats()
+        self.assertEqual((stats['object_count'], stats['bytes_used']),
+                         (2, len('z') + len('a/b')))
+
+    def test_rebuild_old_schema(self):
+        self._create_file('a')
+        self.index.rebuild()
+        conn = sqlite3.connect(self.index.db_file)
+        conn.execute("UPDATE stat SET value = ? WHERE key = 'version'",
+                     (ci.SCHEMA_VERSION - 1,))
+        conn.commit()
+        conn.close()
+        assert not self.index.is_ready()
+        self.index.rebuild()
+        assert self.index.is_ready()
+        self.assertEqual(list(self.index.iter_names()), ['a'])
+
+    def test_drop(self):
+        self.index.create(ready=True)
+        self.index.drop()
+        assert not self.index.exists()
+        # Dropping a missing index is not an error
+        self.index.drop()
+
+    def test_index_add_remove_disabled(self):
+        self.index.create(ready=True)
+        with patch('gluster.swift.common.Glusterfs._container_index', False):
+            ci.index_add(self.volume, 'cont', 'a')
+        self.assertEqual(list(self.index.iter_names()), [])
+
+    def test_index_add_remove(self):
+        with patch('gluster.swift.common.Glusterfs._container_index', True):
+            # No index has been built for this container yet
+            ci.index_add(self.volume, 'cont', 'a')
+            assert not self.index.exists()
+
+            self.index.create(ready=True)
+            ci.index_add(self.volume, 'cont', 'a')
+            ci.index_add(self.volume, 'cont', 'b')
+            ci.index_remove(self.volume, 'cont', 'a')
+        self.assertEqual(list(self.index.iter_names()), ['b'])
+
+    def test_index_add_failure_drops_index(self):
+        self.index.create(ready=True)
+        with patch('gluster.swift.common.Glusterfs._container_index', True):
+            with patch.object(ci.ContainerIndex, 'add',
+                              side_effect=sqlite3.OperationalError('locked')):
+                ci.index_add(self.volume, 'cont', 'a')
+        assert not self.index.exists()
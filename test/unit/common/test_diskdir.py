@@ -22,11 +22,15 @@ import unittest
 import shutil
 import tarfile
 import hashlib
+import types
+import eventlet
+from contextlib import nested
 from mock import Mock, patch
 from time import time
 from swift.common.utils import normalize_timestamp
-from gluster.swift.common import utils
+from gluster.swift.common import utils, existence_filter
 from gluster.swift.common.utils import serialize_metadata, deserialize_metadata
+from gluster.swift.common.exceptions import GlusterFileSystemIOError
 import gluster.swift.common.Glusterfs
 from test_utils import _initxattr, _destroyxattr, _setxattr, _getxattr
 from test.unit import FakeLogger
@@ -249,6 +253,12 @@ class TestDiskDirModuleFunctions(unittest.TestCase):
         l = list(out_objs)
         assert l == ['abc/123', 'abc/456'], repr(l)
 
+        in_objs, delimiter, prefix, marker = ['def_456', 'def_123', 'abc_456', 'abc_123', 'abc'], '_', '', 'abc_'
+        out_objs = dd.filter_delimiter(in_objs, delimiter, prefix, marker,
+                                       reverse=True)
+        l = list(out_objs)
+        assert l == ['def_', 'abc'], repr(l)
+
 
 class TestDiskCommon(unittest.TestCase):
     """ Tests for gluster.swift.common.DiskDir.DiskCommon """
@@ -378,8 +388,15 @@ class TestContainerBroker(unittest.TestCase):
         self.path = tempfile.mkdtemp()
         self.drive = 'drv'
         self.container = None
+        # Background refreshes are only run by the tests calling them, not
+        # to outlive the test that started them.
+        self._spawn_n_patch = patch.object(dd, 'spawn_n')
+        self.spawn_n = self._spawn_n_patch.start()
 
     def tearDown(self):
+        self._spawn_n_patch.stop()
+        dd._stats_refreshing.clear()
+        dd._index_rebuilding.clear()
         self.container = None
         _destroyxattr()
         shutil.rmtree(self.path)
@@ -434,6 +451,41 @@ class TestContainerBroker(unittest.TestCase):
         self.assertEqual(info['object_count'], 0)
         self.assertEqual(info['bytes_used'], 0)
 
+    def test_list_objects_iter_gsexpiring(self):
+        account_path = os.path.join(self.path, "gsexpiring")
+        cpath = os.path.join(account_path, "1400000000")
+        for ts in ('1400000300', '1400000100', '1400000200'):
+            for obj in ('o1', 'o2'):
+                obj_path = os.path.join(cpath, '%s-AUTH_a' % ts, 'c', obj)
+                if not os.path.isdir(os.path.dirname(obj_path)):
+                    os.makedirs(os.path.dirname(obj_path))
+                open(obj_path, 'w').close()
+        disk_dir = dd.DiskDir(self.path, 'gsexpiring', account='gsexpiring',
+                              container='1400000000', logger=FakeLogger())
+
+        _orig_gf_listdir = utils.gf_listdir
+        _m_gf_listdir = Mock(side_effect=_orig_gf_listdir)
+        with nested(
+                patch('gluster.swift.common.utils.gf_listdir', _m_gf_listdir),
+                patch('gluster.swift.common.utils.read_metadata',
+                      side_effect=AssertionError('read'))):
+            listing = disk_dir.list_objects_iter(
+                3, '1400000100-AUTH_a/c/o1', None, None, '',
+                out_content_type='application/json')
+        self.assertEqual(listing,
+                         [('1400000100-AUTH_a/c/o2', '0', 0, 'text/plain',
+                           ''),
+                          ('1400000200-AUTH_a/c/o1', '0', 0, 'text/plain',
+                           ''),
+                          ('1400000200-AUTH_a/c/o2', '0', 0, 'text/plain',
+                           '')])
+        # The walk stopped at limit, 1400000300-AUTH_a was never read
+        self.assertEqual(_m_gf_listdir.call_count, 5)
+        self.assertEqual(
+            [row[0] for row in disk_dir.list_objects_iter(
+                2, '', None, None, '', reverse=True)],
+            ['1400000300-AUTH_a/c/o2', '1400000300-AUTH_a/c/o1'])
+
     def test_creation(self):
         # Test swift.common.db.ContainerBroker.__init__
         broker = self._get_broker(account='a', container='c')
@@ -552,6 +604,198 @@ class TestContainerBroker(unittest.TestCase):
         gluster.swift.common.Glusterfs._container_update_object_count = \
             __save_config
 
+    def _wait_for_refresh(self):
+        for i in xrange(500):
+            if not dd._stats_refreshing:
+                break
+            eventlet.sleep(0.01)
+        self.assertFalse(dd._stats_refreshing)
+
+    def test_get_info_stats_refresh_ttl(self):
+        _spawn_n = Mock(side_effect=eventlet.spawn_n)
+        with nested(
+                patch('gluster.swift.common.Glusterfs.'
+                      '_container_update_object_count', True),
+                patch('gluster.swift.common.Glusterfs._stats_refresh_ttl',
+                      60),
+                patch.object(dd, '_stats_refreshing', set()),
+                patch.object(dd, 'spawn_n', _spawn_n)):
+            broker = self._get_broker(account='a', container='c')
+            broker.initialize(self.initial_ts)
+            self._create_file('o1')
+
+            # The stored counts are returned while they are refreshed
+            info = broker.get_info()
+            self.assertEquals(int(info['object_count']), 0)
+            self.assertTrue(broker.datadir in dd._stats_refreshing)
+            # A refresh in progress is not started again
+            broker.get_info()
+            self.assertEquals(_spawn_n.call_count, 1)
+
+            self._wait_for_refresh()
+            self.assertEquals(int(broker.get_info()['object_count']), 1)
+            # Counts are not refreshed again before they expire
+            self._create_file('o2')
+            self.assertEquals(int(broker.get_info()['object_count']), 1)
+            self.assertEquals(_spawn_n.call_count, 1)
+
+            # The time of the refresh is stored with the counts
+            broker.metadata[utils.X_STATS_REFRESHED] = \
+                (normalize_timestamp(time() - 60), 0)
+            utils.write_metadata(broker.datadir, broker.metadata)
+            broker.get_info()
+            self._wait_for_refresh()
+            self.assertEquals(int(broker.get_info()['object_count']), 2)
+            self.assertEquals(_spawn_n.call_count, 2)
+
+    def test_get_info_stats_refreshed_by_other_process(self):
+        _spawn_n = Mock(side_effect=eventlet.spawn_n)
+        with nested(
+                patch('gluster.swift.common.Glusterfs.'
+                      '_container_update_object_count', True),
+                patch('gluster.swift.common.Glusterfs._stats_refresh_ttl',
+                      60),
+                patch.object(dd, '_stats_refreshing', set()),
+                patch.object(dd, 'spawn_n', _spawn_n)):
+            broker = self._get_broker(account='a', container='c')
+            broker.initialize(self.initial_ts)
+            self._create_file('o1')
+            broker.get_info()
+            self._wait_for_refresh()
+            self.assertTrue(utils.X_STATS_REFRESHED in
+                            utils.read_metadata(broker.datadir))
+
+            # Another worker reads the time of the refresh from the metadata
+            self._create_file('o2')
+            with patch.object(dd, '_stats_refreshing', set()):
+                broker = self._get_broker(account='a', container='c')
+                self.assertEquals(int(broker.get_info()['object_count']), 1)
+            self.assertEquals(_spawn_n.call_count, 1)
+
+            # Or finds the refresh locked by another process
+            broker.metadata[utils.X_STATS_REFRESHED] = \
+                (normalize_timestamp(time() - 60), 0)
+            with patch.object(dd.fcntl, 'lockf',
+                              side_effect=IOError(errno.EAGAIN, 'locked')):
+                broker.get_info()
+            self.assertEquals(_spawn_n.call_count, 1)
+
+            # Or refreshed by another process once this one got the lock
+            refreshed = dict(broker.metadata)
+            refreshed[utils.X_STATS_REFRESHED] = \
+                (normalize_timestamp(time()), 0)
+            utils.write_metadata(broker.datadir, refreshed)
+            broker.get_info()
+            self._wait_for_refresh()
+            self.assertEquals(_spawn_n.call_count, 2)
+            self.assertEquals(
+                utils.read_metadata(broker.datadir)[utils.X_OBJECTS_COUNT],
+                (1, 0))
+
+    def test_get_info_stats_refresh_keeps_post(self):
+        _orig_usage = dd.get_container_usage
+
+        def _get_container_usage(*args, **kwargs):
+            # Container POST while the container is walked
+            metadata = utils.read_metadata(broker.datadir)
+            metadata['X-Container-Meta-Color'] = ('blue', 0)
+            utils.write_metadata(broker.datadir, metadata)
+            return _orig_usage(*args, **kwargs)
+
+        with nested(
+                patch('gluster.swift.common.Glusterfs.'
+                      '_container_update_object_count', True),
+                patch('gluster.swift.common.Glusterfs._stats_refresh_ttl',
+                      60),
+                patch.object(dd, '_stats_refreshing', set()),
+                patch.object(dd, 'get_container_usage',
+                             _get_container_usage)):
+            broker = self._get_broker(account='a', container='c')
+            broker.initialize(self.initial_ts)
+            self._create_file('o1')
+            broker.get_info()
+            self.assertEquals(self.spawn_n.call_count, 1)
+            self.spawn_n.call_args[0][0]()
+        metadata = utils.read_metadata(broker.datadir)
+        self.assertEquals(metadata['X-Container-Meta-Color'], ('blue', 0))
+        self.assertEquals(metadata[utils.X_OBJECTS_COUNT], (1, 0))
+
+    def test_lazy_metadata_init(self):
+        # A directory filled over FUSE before it is accessed through the
+        # REST API
+        self.container = os.path.join(self.path, self.drive, 'c')
+        self._create_file('o1')
+        self._create_file('d/o2')
+        _spawn_n = Mock()
+        with nested(
+                patch('gluster.swift.common.utils.get_container_details',
+                      side_effect=AssertionError('walked')),
+                patch.object(dd, '_stats_refreshing', set()),
+                patch.object(dd, 'spawn_n', _spawn_n)):
+            broker = self._get_broker(account='a', container='c')
+            self.assertTrue(utils.validate_container(broker.metadata))
+            self.assertTrue(utils.X_STATS_PENDING in broker.metadata)
+            self.assertEquals(broker.get_info()['object_count'], 0)
+            self.assertEquals(_spawn_n.call_count, 1)
+
+            # A PUT on the container does not walk it either
+            broker.initialize(normalize_timestamp(time()))
+            self.assertTrue(utils.X_STATS_PENDING in broker.metadata)
+            self.assertEquals(_spawn_n.call_count, 1)
+
+        # Counts are filled in the background
+        _spawn_n.call_args[0][0]()
+        metadata = utils.read_metadata(self.container)
+        self.assertFalse(utils.X_STATS_PENDING in metadata)
+        self.assertEquals(metadata[utils.X_OBJECTS_COUNT], (2, 0))
+
+        # The counts known so far are kept by a PUT
+        with patch.object(dd, 'spawn_n', _spawn_n):
+            broker = self._get_broker(account='a', container='c')
+            self.assertFalse(utils.X_STATS_PENDING in broker.metadata)
+            broker.initialize(normalize_timestamp(time()))
+        self.assertEquals(broker.get_info()['object_count'], 2)
+
+    def test_initialize_new_container_not_pending(self):
+        with patch.object(dd, 'spawn_n',
+                          side_effect=AssertionError('refreshed')):
+            broker = self._get_broker(account='a', container='c')
+            broker.initialize(self.initial_ts)
+        self.assertFalse(utils.X_STATS_PENDING in broker.metadata)
+        self.assertEquals(broker.get_info()['object_count'], 0)
+
+    def test_get_info_container_index(self):
+        with nested(
+                patch('gluster.swift.common.Glusterfs._container_index',
+                      True),
+                patch('gluster.swift.common.Glusterfs.'
+                      '_container_update_object_count', True)):
+            broker = self._get_broker(account='a', container='c')
+            broker.initialize(self.initial_ts)
+            size1 = os.path.getsize(self._create_file('o1'))
+            size2 = os.path.getsize(self._create_file('d/o2'))
+            broker._index.drop()
+
+            # The container is walked while the index is rebuilt in the
+            # background, with the sizes found
+            _spawn_n = Mock()
+            with patch.object(dd, 'spawn_n', _spawn_n):
+                info = broker.get_info()
+            self.assertEquals(info['object_count'], 2)
+            self.assertEquals(info['bytes_used'], size1 + size2)
+            self.assertEquals(_spawn_n.call_count, 1)
+            _spawn_n.call_args[0][0]()
+            self.assertTrue(broker._index.is_ready())
+
+            # Counters are then kept up to date by the object server
+            broker._index.add('o3', 10)
+            broker._index.remove('o1')
+            with patch('gluster.swift.common.utils.get_container_details',
+                       side_effect=AssertionError('walked')):
+                info = broker.get_info()
+            self.assertEquals(info['object_count'], 2)
+            self.assertEquals(info['bytes_used'], size2 + 10)
+
     def test_get_info_nonexistent_container(self):
         broker = dd.DiskDir(self.path, self.drive, account='no_account',
                           container='no_container', logger=FakeLogger())
@@ -688,6 +932,320 @@ class TestContainerBroker(unittest.TestCase):
         self.assertEquals(len(listing), 2)
         self.assertEquals([row[0] for row in listing], ['3.d/0000', '3.d/0001'])
 
+    def test_list_objects_iter_container_index(self):
+        with patch('gluster.swift.common.Glusterfs._container_index', True):
+            broker = self._get_broker(account='a', container='c')
+            broker.initialize(self.initial_ts)
+            # A new container starts out with a complete, empty index
+            self.assertTrue(broker._index.is_ready())
+            self.assertEquals(broker.list_objects_iter(100, '', None, None,
+                                                       ''), [])
+
+            for obj1 in xrange(4):
+                for obj2 in xrange(25):
+                    self._create_file('%d.d/%04d' % (obj1, obj2))
+            # Files created behind the back of the object server are not
+            # seen until the index is rebuilt
+            self.assertEquals(broker.list_objects_iter(100, '', None, None,
+                                                       ''), [])
+            broker._index.drop()
+
+            # Listed by walking the container until the index is rebuilt,
+            # once, in the background
+            _spawn_n = Mock()
+            with patch.object(dd, 'spawn_n', _spawn_n):
+                for i in xrange(2):
+                    listing = broker.list_objects_iter(100, '', None, None,
+                                                       '')
+                    self.assertEquals(len(listing), 100)
+                    self.assertEquals(listing[0][0], '0.d/0000')
+                    self.assertEquals(listing[-1][0], '3.d/0024')
+            self.assertEquals(_spawn_n.call_count, 1)
+            _spawn_n.call_args[0][0]()
+            self.assertTrue(broker._index.is_ready())
+
+            # Listings are served from the index, without walking
+            walk = Mock(side_effect=AssertionError('walked'))
+            with nested(
+                    patch('gluster.swift.common.utils.'
+                          'get_container_details', walk),
+                    patch('gluster.swift.common.container_index.'
+                          'iter_container_objects', walk)):
+                listing = broker.list_objects_iter(10, '0.d/0020', '1.d/0003',
+                                                   None, '')
+                self.assertEquals([row[0] for row in listing],
+                                  ['0.d/0021', '0.d/0022', '0.d/0023',
+                                   '0.d/0024', '1.d/0000', '1.d/0001',
+                                   '1.d/0002'])
+                listing = broker.list_objects_iter(10, '', None, '1.d/001',
+                                                   '/')
+                self.assertEquals([row[0] for row in listing],
+                                  ['1.d/%04d' % i for i in xrange(10, 20)])
+                listing = broker.list_objects_iter(3, '2.d/0010', None,
+                                                   '2.d/', '/')
+                self.assertEquals([row[0] for row in listing],
+                                  ['2.d/0011', '2.d/0012', '2.d/0013'])
+
+    def test_list_objects_iter_lazy_walk(self):
+        broker = self._get_broker(account='a', container='c')
+        broker.initialize(self.initial_ts)
+        for obj1 in xrange(10):
+            for obj2 in xrange(10):
+                self._create_file('dir%d/obj%d' % (obj1, obj2))
+
+        _orig_gf_listdir = utils.gf_listdir
+        _m_gf_listdir = Mock(side_effect=_orig_gf_listdir)
+        # Metadata read-ahead is disabled so that no more than the objects
+        # listed are walked.
+        with nested(
+                patch('gluster.swift.common.utils.get_container_details',
+                      side_effect=AssertionError('walked')),
+                patch('gluster.swift.common.utils.gf_listdir',
+                      _m_gf_listdir),
+                patch('gluster.swift.common.Glusterfs.'
+                      '_listing_metadata_concurrency', 1)):
+            listing = broker.list_objects_iter(5, 'dir3/obj7', None, None,
+                                               '')
+        self.assertEquals([row[0] for row in listing],
+                          ['dir3/obj8', 'dir3/obj9', 'dir4/obj0',
+                           'dir4/obj1', 'dir4/obj2'])
+        # Only the container, dir3 and dir4 were read
+        self.assertEqual(_m_gf_listdir.call_count, 3)
+
+    def test_list_objects_iter_directed_descent(self):
+        # Listings must match filtering the full, sorted list of objects
+        broker = self._get_broker(account='a', container='c')
+        broker.initialize(self.initial_ts)
+        names = ['photos/2023.txt', 'photos/2023/a', 'photos/2024/a',
+                 'photos/2024/b/c', 'photos/2024/b/d', 'photos/2024-x/a',
+                 'photos/3', 'photos.txt', 'videos/1', 'photo']
+        for name in names:
+            self._create_file(name)
+        names.sort()
+
+        def _full_walk(cont_path, marker, end_marker, prefix, delimiter,
+                       path, reverse=False):
+            # What listings did before directed descent: walk everything,
+            # then filter.
+            objects = sorted(utils.get_container_details(cont_path)[0])
+            if marker and marker >= prefix:
+                objects = dd.filter_marker(objects, marker)
+            elif prefix:
+                objects = dd.filter_prefix_as_marker(objects, prefix)
+            return objects
+
+        def _names(*args):
+            return [row[0] for row in broker.list_objects_iter(*args)]
+
+        for prefix in (None, '', 'p', 'photos', 'photos/', 'photos/20',
+                       'photos/2024/', 'photos/2024/b', 'videos/', 'zz/'):
+            for delimiter in ('', '/', '-', '.'):
+                for marker in ('', 'photos/2023', 'photos/2024/',
+                               'photos/2024/b/c'):
+                    args = (100, marker, None, prefix, delimiter)
+                    listing = _names(*args)
+                    with patch('gluster.swift.common.DiskDir.'
+                               'iter_container_objects', _full_walk):
+                        self.assertEquals(listing, _names(*args), args)
+        for path in ('', 'photos', 'photos/2024', 'photos/2024/b', 'none'):
+            args = (100, '', None, None, '', path)
+            listing = _names(*args)
+            with patch('gluster.swift.common.DiskDir.'
+                       'iter_container_objects', _full_walk):
+                self.assertEquals(listing, _names(*args), args)
+
+    def test_list_objects_iter_reverse(self):
+        # Reverse listings must match the forward listing with the markers
+        # swapped, reversed.
+        broker = self._get_broker(account='a', container='c')
+        broker.initialize(self.initial_ts)
+        names = ['photos/2023.txt', 'photos/2023/a', 'photos/2024/a',
+                 'photos/2024/b/c', 'photos/2024/b/d', 'photos/2024-x/a',
+                 'photos/3', 'photos.txt', 'videos/1', 'photo']
+        for name in names:
+            self._create_file(name)
+
+        def _names(*args, **kwargs):
+            return [row[0] for row in broker.list_objects_iter(*args,
+                                                               **kwargs)]
+
+        def _check():
+            for prefix in (None, '', 'p', 'photos', 'photos/', 'photos/20',
+                           'photos/2024/', 'videos/', 'zz/'):
+                for delimiter in ('', '/', '-'):
+                    for marker, end_marker in (
+                            ('', None), ('photos/2024/b/d', None),
+                            ('', 'photos/2024/'), ('photos/3', 'photos/2023'),
+                            ('videos', 'photos/2024/b/c')):
+                        args = (prefix, delimiter)
+                        forward = _names(100, end_marker, marker, *args)
+                        listing = _names(100, marker, end_marker, *args,
+                                         reverse=True)
+                        self.assertEquals(listing, forward[::-1],
+                                          (marker, end_marker) + args)
+                        self.assertEquals(
+                            _names(2, marker, end_marker, *args,
+                                   reverse=True), listing[:2])
+            for path in ('', 'photos', 'photos/2024', 'none'):
+                self.assertEquals(
+                    _names(100, '', None, None, '', path, reverse=True),
+                    _names(100, '', None, None, '', path)[::-1])
+
+        _check()
+        with nested(
+                patch('gluster.swift.common.Glusterfs._listing_cache', True),
+                patch('gluster.swift.common.listing_cache.RACY_WINDOW', -1)):
+            _check()
+        with patch('gluster.swift.common.Glusterfs._container_index', True):
+            broker = self._get_broker(account='a', container='c')
+            broker._index.rebuild()
+            with patch('gluster.swift.common.container_index.PAGE_SIZE', 2):
+                _check()
+
+    def test_list_objects_iter_reverse_lazy_walk(self):
+        broker = self._get_broker(account='a', container='c')
+        broker.initialize(self.initial_ts)
+        for obj1 in xrange(10):
+            for obj2 in xrange(10):
+                self._create_file('dir%d/obj%d' % (obj1, obj2))
+
+        _orig_gf_listdir = utils.gf_listdir
+        _m_gf_listdir = Mock(side_effect=_orig_gf_listdir)
+        with nested(
+                patch('gluster.swift.common.utils.get_container_details',
+                      side_effect=AssertionError('walked')),
+                patch('gluster.swift.common.utils.gf_listdir',
+                      _m_gf_listdir),
+                patch('gluster.swift.common.Glusterfs.'
+                      '_listing_metadata_concurrency', 1)):
+            listing = broker.list_objects_iter(5, 'dir7/obj2', None, None,
+                                               '', reverse=True)
+        self.assertEquals([row[0] for row in listing],
+                          ['dir7/obj1', 'dir7/obj0', 'dir6/obj9',
+                           'dir6/obj8', 'dir6/obj7'])
+        # Only the container, dir7 and dir6 were read
+        self.assertEqual(_m_gf_listdir.call_count, 3)
+
+    def test_list_objects_iter_prefix_reads_prefix_directory(self):
+        broker = self._get_broker(account='a', container='c')
+        broker.initialize(self.initial_ts)
+        for obj1 in xrange(10):
+            for obj2 in xrange(10):
+                self._create_file('dir%d/sub%d/obj' % (obj1, obj2))
+
+        _orig_gf_listdir = utils.gf_listdir
+        _m_gf_listdir = Mock(side_effect=_orig_gf_listdir)
+        with nested(
+                patch('gluster.swift.common.utils.gf_listdir', _m_gf_listdir),
+                patch('gluster.swift.common.Glusterfs._implicit_dir_objects',
+                      True)):
+            listing = broker.list_objects_iter(100, '', None, 'dir3/', '/')
+        self.assertEquals([row[0] for row in listing],
+                          sorted(['dir3/sub%d' % i for i in xrange(10)] +
+                                 ['dir3/sub%d/' % i for i in xrange(10)]))
+        # A single scandir of dir3, plus one of each sub-directory to find
+        # out that it holds an object.
+        self.assertEqual(_m_gf_listdir.call_count, 11)
+        self.assertEqual(_m_gf_listdir.call_args_list[0][0][0],
+                         os.path.join(self.container, 'dir3/'))
+
+        _m_gf_listdir.reset_mock()
+        with patch('gluster.swift.common.utils.gf_listdir', _m_gf_listdir):
+            listing = broker.list_objects_iter(100, '', None, None, '',
+                                               'dir3')
+        self.assertEquals(listing, [])
+        self.assertEqual(_m_gf_listdir.call_count, 1)
+
+    def test_list_objects_iter_concurrent_metadata_reads(self):
+        broker = self._get_broker(account='a', container='c')
+        broker.initialize(self.initial_ts)
+        for obj in xrange(50):
+            self._create_file('obj%02d' % obj)
+        # Objects removed after being walked are skipped
+        os.unlink(os.path.join(self.container, 'obj03'))
+
+        _orig_read_metadata = dd.read_metadata
+        read = []
+
+        def _mock_read_metadata(path):
+            read.append(os.path.basename(path))
+            if path.endswith('obj03'):
+                raise GlusterFileSystemIOError(errno.ENOENT,
+                                               os.strerror(errno.ENOENT))
+            return _orig_read_metadata(path)
+
+        for concurrency in (1, 8):
+            del read[:]
+            with nested(
+                    patch('gluster.swift.common.DiskDir.read_metadata',
+                          _mock_read_metadata),
+                    patch('gluster.swift.common.DiskDir.'
+                          'iter_container_objects',
+                          return_value=['obj%02d' % i for i in xrange(50)]),
+                    patch('gluster.swift.common.Glusterfs.'
+                          '_listing_metadata_concurrency', concurrency)):
+                listing = broker.list_objects_iter(10, '', None, None, '')
+            self.assertEquals([row[0] for row in listing],
+                              ['obj%02d' % i for i in xrange(11) if i != 3])
+            for row in listing:
+                obj_path = os.path.join(self.container, row[0])
+                self.assertEquals(row[2], os.path.getsize(obj_path))
+            # Let abandoned reads finish: read-ahead is bounded by the
+            # concurrency
+            eventlet.sleep()
+            self.assertTrue(len(read) <= 11 + concurrency, read)
+
+    def test_list_objects_iter_listing_cache(self):
+        broker = self._get_broker(account='a', container='c')
+        broker.initialize(self.initial_ts)
+        for obj1 in xrange(4):
+            for obj2 in xrange(25):
+                self._create_file('%d.d/%04d' % (obj1, obj2))
+
+        def _names(*args):
+            return [row[0] for row in broker.list_objects_iter(*args)]
+
+        for args in ((100, '', None, None, ''),
+                     (10, '1.d/0020', '2.d/0003', None, ''),
+                     (10, '', None, '2.d/', '/'),
+                     (10, '', None, '', '/'),
+                     (10, '', None, None, '', '3.d')):
+            listing = _names(*args)
+            # The directories were all just modified: trust their mtime
+            with nested(
+                    patch('gluster.swift.common.Glusterfs._listing_cache',
+                          True),
+                    patch('gluster.swift.common.listing_cache.RACY_WINDOW',
+                          -1)):
+                self.assertEquals(_names(*args), listing, args)
+                # Served from the snapshot the second time
+                with patch('gluster.swift.common.listing_cache.gf_listdir',
+                           side_effect=AssertionError('walked')):
+                    self.assertEquals(_names(*args), listing, args)
+
+        with patch('gluster.swift.common.Glusterfs._listing_cache', True):
+            self._create_file('4.d/0000')
+            self.assertEquals(_names(1, '3.d/0024', None, None, ''),
+                              ['4.d/0000'])
+
+    def test_delete_db_drops_container_index(self):
+        with patch('gluster.swift.common.Glusterfs._container_index', True):
+            broker = self._get_broker(account='a', container='c')
+            broker.initialize(self.initial_ts)
+            self.assertTrue(broker._index.exists())
+            broker.delete_db(normalize_timestamp(time()))
+            self.assertFalse(broker._index.exists())
+
+    def test_existence_filter(self):
+        with patch('gluster.swift.common.Glusterfs._existence_filter', True):
+            broker = self._get_broker(account='a', container='c')
+            broker.initialize(self.initial_ts)
+            filter_path = existence_filter.get_filter_path(
+                os.path.join(self.path, self.drive), 'c')
+            self.assertTrue(os.path.exists(filter_path))
+            broker.delete_db(normalize_timestamp(time()))
+            self.assertFalse(os.path.exists(filter_path))
+
     def test_list_objects_iter_non_slash(self):
         # Test swift.common.db.ContainerBroker.list_objects_iter using a
         # delimiter that is not a slash
@@ -833,6 +1391,115 @@ class TestContainerBroker(unittest.TestCase):
         self.assertEquals([row[0] for row in listing],
                           ['pets/fish/a', 'pets/fish/b'])
 
+    def test_list_objects_iter_etag_queued(self):
+        broker = self._get_broker(account='a', container='c')
+        broker.initialize(self.initial_ts)
+        path_a = self._create_file('a')
+        path_b = self._create_file('b')
+        # Last known ETag of an object with invalid metadata
+        metadata = utils.create_object_metadata(path_b)
+        etag_b = metadata[utils.X_ETAG]
+        del metadata[utils.X_OBJECT_TYPE]
+        utils.write_metadata(path_b, metadata)
+        _m_queue_etag = Mock()
+        with nested(
+                patch('gluster.swift.common.utils._get_etag',
+                      Mock(side_effect=AssertionError('read'))),
+                patch('gluster.swift.common.etag_queue.queue_etag',
+                      _m_queue_etag)):
+            listing = broker.list_objects_iter(100, '', None, None, '')
+        self.assertEqual([(row[0], row[2], row[4]) for row in listing],
+                         [('a', os.path.getsize(path_a), ''),
+                          ('b', os.path.getsize(path_b), etag_b)])
+        self.assertEqual(_m_queue_etag.call_args_list,
+                         [((path_a, broker.logger), {}),
+                          ((path_b, broker.logger), {})])
+        # Nothing is stored until the ETag is computed
+        self.assertEqual(utils.read_metadata(path_a), {})
+
+    def test_iter_objects(self):
+        broker = self._get_broker(account='a', container='c')
+        broker.initialize(self.initial_ts)
+        for obj in ('a', 'b/c', 'd'):
+            self._create_file(obj)
+        for content_type in (None, 'text/plain'):
+            objects = broker.iter_objects(2, '', None, None, '',
+                                          out_content_type=content_type)
+            self.assertEqual(type(objects), types.GeneratorType)
+            self.assertEqual(
+                [row[:3] for row in objects],
+                [row[:3] for row in broker.list_objects_iter(
+                    2, '', None, None, '', out_content_type=content_type)])
+
+    def test_list_objects_iter_stat_only(self):
+        broker = self._get_broker(account='a', container='c')
+        broker.initialize(self.initial_ts)
+        path_a = self._create_file('a')
+        self._create_file('b/c')
+        os.mkdir(os.path.join(self.container, 'd'))
+        utils.write_metadata(os.path.join(self.container, 'd'),
+                             {utils.X_OBJECT_TYPE: utils.DIR_OBJECT,
+                              utils.X_CONTENT_TYPE: utils.DIR_TYPE,
+                              utils.X_TIMESTAMP: normalize_timestamp(1),
+                              utils.X_CONTENT_LENGTH: 0,
+                              utils.X_ETAG: 'dir',
+                              utils.X_TYPE: utils.OBJECT})
+        _orig_read_metadata = dd.read_metadata
+        read = []
+
+        def _mock_read_metadata(path):
+            read.append(os.path.relpath(path, self.container))
+            return _orig_read_metadata(path)
+
+        with patch('gluster.swift.common.DiskDir.read_metadata',
+                   _mock_read_metadata):
+            listing = broker.list_objects_iter(100, '', None, None, '',
+                                               stat_only=True)
+        # Only the directory has its xattrs read
+        self.assertEqual(read, ['d'])
+        stats = os.stat(path_a)
+        self.assertEqual(listing[0], ['a', normalize_timestamp(stats.st_mtime),
+                                      stats.st_size, '', ''])
+        self.assertEqual([row[0] for row in listing], ['a', 'b/c', 'd'])
+        self.assertEqual(listing[2][3:], [utils.DIR_TYPE, 'dir'])
+
+    def test_list_objects_iter_sys_metadata(self):
+        broker = self._get_broker(account='a', container='c')
+        broker.initialize(self.initial_ts)
+        path_a = self._create_file('a')
+        path_b = self._create_file('b')
+        metadata = {utils.X_OBJECT_TYPE: utils.FILE,
+                    utils.X_CONTENT_TYPE: 'text/plain',
+                    utils.X_TIMESTAMP: normalize_timestamp(1),
+                    utils.X_CONTENT_LENGTH: os.path.getsize(path_a),
+                    utils.X_ETAG: hashlib.md5('a').hexdigest(),
+                    utils.X_TYPE: utils.OBJECT,
+                    'X-Object-Meta-Color': 'blue'}
+        with patch('gluster.swift.common.Glusterfs._system_metadata_xattr',
+                   True):
+            utils.write_metadata(path_a, metadata)
+        # Written without a copy of the system fields
+        metadata[utils.X_CONTENT_LENGTH] = os.path.getsize(path_b)
+        utils.write_metadata(path_b, metadata)
+        _orig_read_metadata = dd.read_metadata
+        read = []
+
+        def _mock_read_metadata(path):
+            read.append(os.path.relpath(path, self.container))
+            return _orig_read_metadata(path)
+
+        with nested(
+                patch('gluster.swift.common.DiskDir.read_metadata',
+                      _mock_read_metadata),
+                patch('gluster.swift.common.Glusterfs._system_metadata_xattr',
+                      True)):
+            listing = broker.list_objects_iter(100, '', None, None, '')
+        self.assertEqual(read, ['b'])
+        self.assertEqual(listing[0], [
+            'a', normalize_timestamp(1), os.path.getsize(path_a),
+            'text/plain', hashlib.md5('a').hexdigest()])
+        self.assertEqual(listing[1][0], 'b')
+
     def test_list_objects_iter_plain_listing(self):
         broker = self._get_broker(account='a', container='c')
         broker.initialize(self.initial_ts)
@@ -869,11 +1536,16 @@ class TestContainerBroker(unittest.TestCase):
         # Confirm that metadata of objects (xattrs) are still fetched when
         # out_content_type is NOT text/plain
         _m_r_md.reset_mock()
-        with patch('gluster.swift.common.utils.read_metadata', _m_r_md):
+        _m_dd_r_md = Mock(return_value={})
+        with nested(
+                patch('gluster.swift.common.utils.read_metadata', _m_r_md),
+                patch('gluster.swift.common.DiskDir.read_metadata',
+                      _m_dd_r_md)):
             listing = broker.list_objects_iter(500, '', None, None, '')
             self.assertEquals(len(listing), 100)
         # 10 getxattr() calls for 10 directories and 100 more for 100 objects
-        self.assertEqual(_m_r_md.call_count, 110)
+        self.assertEqual(_m_r_md.call_count, 10)
+        self.assertEqual(_m_dd_r_md.call_count, 100)
 
     def test_double_check_trailing_delimiter(self):
         # Test swift.common.db.ContainerBroker.list_objects_iter for a
@@ -1052,8 +1724,14 @@ class TestAccountBroker(unittest.TestCase):
         self.drive_fullpath = os.path.join(self.path, self.drive)
         os.mkdir(self.drive_fullpath)
         self.account = None
+        # Background refreshes are only run by the tests calling them, not
+        # to outlive the test that started them.
+        self._spawn_n_patch = patch.object(dd, 'spawn_n')
+        self.spawn_n = self._spawn_n_patch.start()
 
     def tearDown(self):
+        self._spawn_n_patch.stop()
+        dd._stats_refreshing.clear()
         self.account = None
         _destroyxattr()
         shutil.rmtree(self.path)
@@ -1124,6 +1802,21 @@ class TestAccountBroker(unittest.TestCase):
         os.rmdir(c1)
         self.assert_(broker.empty())
 
+    def test_get_info_stats_refresh_ttl(self):
+        with nested(
+                patch('gluster.swift.common.Glusterfs.'
+                      '_account_update_container_count', True),
+                patch('gluster.swift.common.Glusterfs._stats_refresh_ttl',
+                      60),
+                patch.object(dd, '_stats_refreshing', set())):
+            broker = self._get_broker(account='a')
+            broker.initialize(self.initial_ts)
+            self._create_container('c1')
+            self.assertEquals(int(broker.get_info()['container_count']), 0)
+            self.assertEquals(self.spawn_n.call_count, 1)
+            self.spawn_n.call_args[0][0]()
+            self.assertEquals(int(broker.get_info()['container_count']), 1)
+
     def test_get_info(self):
         # Test swift.common.db.AccountBroker.get_info
         __save_config = \
@@ -1254,6 +1947,45 @@ class TestAccountBroker(unittest.TestCase):
         self.assertEquals([row[0] for row in listing],
                           ['3-0049-', '3-0049-0049'])
 
+    def test_list_containers_iter_reverse(self):
+        broker = self._get_broker(account='a')
+        broker.initialize(self.initial_ts)
+        for cont in ('0-0000', '0-0001', '1-0000', '1-0001', '1-0001-0000',
+                     '2-0000'):
+            self._create_container(cont)
+
+        def _names(*args, **kwargs):
+            return [row[0] for row in broker.list_containers_iter(*args,
+                                                                  **kwargs)]
+
+        self.assertEquals(_names(100, '', None, None, '', reverse=True),
+                          ['2-0000', '1-0001-0000', '1-0001', '1-0000',
+                           '0-0001', '0-0000'])
+        self.assertEquals(_names(2, '1-0001', None, None, '', reverse=True),
+                          ['1-0000', '0-0001'])
+        self.assertEquals(_names(100, '', '1-0000', None, '', reverse=True),
+                          ['2-0000', '1-0001-0000', '1-0001'])
+        self.assertEquals(_names(100, '', None, '1-', '', reverse=True),
+                          ['1-0001-0000', '1-0001', '1-0000'])
+        self.assertEquals(_names(100, '', None, '', '-', reverse=True),
+                          ['2-', '1-', '0-'])
+        self.assertEquals(_names(100, '', '1-', '', '-', reverse=True),
+                          ['2-'])
+        self.assertEquals(_names(100, '', None, '1-', '-', reverse=True),
+                          ['1-0001-', '1-0001', '1-0000'])
+
+    def test_iter_containers(self):
+        broker = self._get_broker(account='a')
+        broker.initialize(self.initial_ts)
+        for cont in ('c1', 'c2', 'c3'):
+            self._create_container(cont)
+        for content_type in (None, 'text/plain'):
+            containers = broker.iter_containers(
+                2, '', None, None, '', response_content_type=content_type)
+            self.assertEqual(type(containers), types.GeneratorType)
+            self.assertEqual(list(containers), broker.list_containers_iter(
+                2, '', None, None, '', response_content_type=content_type))
+
     def test_list_containers_iter_plain_listing(self):
         broker = self._get_broker(account='a')
         broker.initialize(self.initial_ts)
@@ -1295,6 +2027,60 @@ class TestAccountBroker(unittest.TestCase):
         self.assertTrue(_m_r_md.called)
         self.assertEqual(_m_r_md.call_count, 10)
 
+    def test_list_containers_iter_no_walk(self):
+        broker = self._get_broker(account='a')
+        broker.initialize(self.initial_ts)
+        for cont in xrange(3):
+            cont_path = self._create_container('lci%d' % cont)
+            with open(os.path.join(cont_path, 'obj'), 'w') as fp:
+                fp.write('x')
+        # The first container has valid metadata with counts pending
+        cont_path = os.path.join(self.drive_fullpath, 'lci0')
+        md = utils.get_container_metadata(cont_path, count=False)
+        md[utils.X_OBJECTS_COUNT] = (5, 0)
+        md[utils.X_BYTES_USED] = (50, 0)
+        utils.write_metadata(cont_path, md)
+
+        _m_details = Mock(side_effect=AssertionError('walked'))
+        _m_spawn_n = Mock()
+        with nested(
+                patch('gluster.swift.common.utils.get_container_details',
+                      _m_details),
+                patch('gluster.swift.common.Glusterfs.'
+                      '_listing_metadata_concurrency', 2),
+                patch('gluster.swift.common.DiskDir.spawn_n', _m_spawn_n)):
+            listing = broker.list_containers_iter(100, '', None, None,
+                                                  '', 'application/json')
+        # Last known counts are reported, and zero for new metadata
+        self.assertEqual(listing, [['lci0', 5, 50, 0], ['lci1', 0, 0, 0],
+                                   ['lci2', 0, 0, 0]])
+        self.assertFalse(_m_details.called)
+        # Every container is queued for a background refresh
+        self.assertEqual(_m_spawn_n.call_count, 3)
+        for cont in xrange(3):
+            md = utils.read_metadata(
+                os.path.join(self.drive_fullpath, 'lci%d' % cont))
+            self.assertTrue(utils.validate_container(md))
+            self.assertTrue(utils.X_STATS_PENDING in md)
+
+    def test_list_containers_iter_refresh(self):
+        broker = self._get_broker(account='a')
+        broker.initialize(self.initial_ts)
+        cont_path = self._create_container('c')
+        with open(os.path.join(cont_path, 'obj'), 'w') as fp:
+            fp.write('xyz')
+        with patch('gluster.swift.common.Glusterfs._do_getsize', True):
+            listing = broker.list_containers_iter(100, '', None, None,
+                                                  '', 'application/json')
+            self.assertEqual(listing, [['c', 0, 0, 0]])
+            # Run the background refresh
+            self.assertEquals(self.spawn_n.call_count, 1)
+            self.spawn_n.call_args[0][0]()
+            listing = broker.list_containers_iter(100, '', None, None,
+                                                  '', 'application/json')
+        self.assertEqual(listing, [['c', 1, 3, 0]])
+        self.assertFalse(utils.X_STATS_PENDING in
+                         utils.read_metadata(cont_path))
 
     def test_double_check_trailing_delimiter(self):
         # Test swift.common.db.AccountBroker.list_containers_iter for an
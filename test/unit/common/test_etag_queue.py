@@ -0,0 +1,129 @@
+# Copyright (c) 2016 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Tests for gluster.swift.common.etag_queue """
+
+import os
+import shutil
+import hashlib
+import tempfile
+import unittest
+import eventlet
+from mock import patch, Mock
+
+from gluster.swift.common import utils
+from gluster.swift.common import etag_queue as eq
+from test_utils import _initxattr, _destroyxattr
+from test.unit import FakeLogger
+
+
+class TestEtagQueue(unittest.TestCase):
+    """ Tests for gluster.swift.common.etag_queue """
+
+    def setUp(self):
+        _initxattr()
+        self.td = tempfile.mkdtemp()
+        self.path = os.path.join(self.td, 'obj')
+        with open(self.path, 'w') as fp:
+            fp.write('abcd')
+
+    def tearDown(self):
+        _destroyxattr()
+        shutil.rmtree(self.td)
+
+    def _wait(self):
+        while eq.get_stats()['depth']:
+            eventlet.sleep(0.01)
+
+    def test_compute_etag(self):
+        self.assertEqual(eq.compute_etag(self.path), 4)
+        metadata = utils.read_metadata(self.path)
+        self.assertEqual(metadata[utils.X_ETAG],
+                         hashlib.md5('abcd').hexdigest())
+        self.assertTrue(utils.validate_object(metadata, os.stat(self.path)))
+
+    def test_compute_etag_valid_metadata(self):
+        utils.create_object_metadata(self.path)
+        with patch('gluster.swift.common.utils._get_etag',
+                   Mock(side_effect=AssertionError('read'))):
+            self.assertEqual(eq.compute_etag(self.path), None)
+
+    def test_compute_etag_stale_metadata(self):
+        utils.create_object_metadata(self.path)
+        with open(self.path, 'a') as fp:
+            fp.write('ef')
+        self.assertEqual(eq.compute_etag(self.path), 6)
+        self.assertEqual(utils.read_metadata(self.path)[utils.X_ETAG],
+                         hashlib.md5('abcdef').hexdigest())
+
+    def test_compute_etag_missing(self):
+        self.assertEqual(eq.compute_etag(os.path.join(self.td, 'x')), None)
+        self.assertEqual(eq.compute_etag(self.td), None)
+
+    def test_compute_etag_replaced(self):
+        stats = os.stat(self.path)
+        replaced = Mock(st_ino=stats.st_ino + 1)
+        with patch.object(eq, 'do_stat', return_value=replaced):
+            self.assertEqual(eq.compute_etag(self.path), None)
+        self.assertEqual(utils.read_metadata(self.path), {})
+
+    def test_queue_etag(self):
+        logger = FakeLogger()
+        stats = eq.get_stats()
+        self.assertTrue(eq.queue_etag(self.path, logger))
+        # Queued once only
+        self.assertTrue(eq.queue_etag(self.path, logger))
+        self._wait()
+        self.assertEqual(utils.read_metadata(self.path)[utils.X_ETAG],
+                         hashlib.md5('abcd').hexdigest())
+        new_stats = eq.get_stats()
+        self.assertEqual(new_stats['queued'] - stats['queued'], 1)
+        self.assertEqual(new_stats['computed'] - stats['computed'], 1)
+        self.assertEqual(new_stats['bytes'] - stats['bytes'], 4)
+        self.assertEqual(logger.log_dict['increment'],
+                         [(('etag_queue.queued',), {}),
+                          (('etag_queue.computed',), {})])
+        self.assertEqual(logger.log_dict['update_stats'],
+                         [(('etag_queue.bytes', 4), {})])
+        self.assertEqual(len(logger.log_dict['timing_since']), 1)
+        self.assertEqual(logger.log_dict['timing'],
+                         [(('etag_queue.depth', 1), {})])
+
+    def test_queue_etag_full(self):
+        logger = FakeLogger()
+        stats = eq.get_stats()
+        with patch('gluster.swift.common.Glusterfs._etag_queue_size', 1):
+            self.assertTrue(eq.queue_etag(self.path, logger))
+            self.assertFalse(eq.queue_etag(self.path + '2', logger))
+        self.assertEqual(eq.get_stats()['depth'], 1)
+        self._wait()
+        new_stats = eq.get_stats()
+        self.assertEqual(new_stats['dropped'] - stats['dropped'], 1)
+        self.assertEqual(new_stats['computed'] - stats['computed'], 1)
+        self.assertEqual(logger.log_dict['increment'],
+                         [(('etag_queue.queued',), {}),
+                          (('etag_queue.dropped',), {}),
+                          (('etag_queue.computed',), {})])
+
+    def test_queue_etag_error(self):
+        logger = FakeLogger()
+        stats = eq.get_stats()
+        with patch.object(eq, 'compute_etag',
+                          Mock(side_effect=OSError('failed'))):
+            eq.queue_etag(self.path, logger)
+            self._wait()
+        self.assertEqual(eq.get_stats()['errors'] - stats['errors'], 1)
+        self.assertEqual(logger.log_dict['increment'][-1],
+                         (('etag_queue.errors',), {}))
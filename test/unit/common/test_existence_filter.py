@@ -0,0 +1,235 @@
+# Copyright (c) 2016 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Tests for gluster.swift.common.existence_filter """
+
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import nested
+from mock import patch
+
+from gluster.swift.common import existence_filter as ef
+
+
+class TestBloomFilter(unittest.TestCase):
+    """ Tests for gluster.swift.common.existence_filter.BloomFilter """
+
+    def test_add(self):
+        bloom = ef.BloomFilter.for_capacity(1000)
+        names = ['obj%d' % i for i in xrange(1000)]
+        for name in names:
+            bloom.add(name)
+        for name in names:
+            self.assertTrue(name in bloom)
+        false_positives = sum(1 for i in xrange(10000)
+                              if 'other%d' % i in bloom)
+        self.assertTrue(false_positives < 300, false_positives)
+
+    def test_serialize(self):
+        bloom = ef.BloomFilter.for_capacity(100)
+        bloom.add('a')
+        copy = ef.BloomFilter.deserialize(bloom.serialize())
+        self.assertEqual(copy.num_bits, bloom.num_bits)
+        self.assertEqual(copy.num_hashes, bloom.num_hashes)
+        self.assertTrue('a' in copy)
+        self.assertRaises(ValueError, ef.BloomFilter.deserialize,
+                          bloom.serialize()[:-1])
+        self.assertRaises(ValueError, ef.BloomFilter.deserialize, 'junk')
+
+    def test_update(self):
+        bloom1 = ef.BloomFilter.for_capacity(100)
+        bloom2 = ef.BloomFilter.for_capacity(100)
+        bloom1.add('a')
+        bloom2.add('b')
+        bloom1.update(bloom2)
+        self.assertTrue('a' in bloom1)
+        self.assertTrue('b' in bloom1)
+
+
+class TestExistenceFilter(unittest.TestCase):
+    """ Tests for gluster.swift.common.existence_filter """
+
+    def setUp(self):
+        self.td = tempfile.mkdtemp()
+        self.path = ef.get_filter_path(self.td, 'c')
+        ef._cache.clear()
+        self.patches = [
+            patch('gluster.swift.common.Glusterfs._existence_filter', True),
+            patch('gluster.swift.common.Glusterfs.'
+                  '_existence_filter_refresh', 0)]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        ef._cache.clear()
+        shutil.rmtree(self.td)
+
+    def test_no_filter(self):
+        self.assertFalse(ef.is_absent(self.td, 'c', 'o'))
+        # Objects are not added to containers without a filter
+        ef.filter_add(self.td, 'c', 'o')
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_filter_add(self):
+        ef.create_filter(self.td, 'c')
+        self.assertTrue(ef.is_absent(self.td, 'c', 'a/b/o'))
+        ef.filter_add(self.td, 'c', 'a/b/o')
+        # Directories on the path of an object are objects too
+        for name in ('a', 'a/b', 'a/b/o'):
+            self.assertFalse(ef.is_absent(self.td, 'c', name))
+        self.assertTrue(ef.is_absent(self.td, 'c', 'a/b/p'))
+
+    def test_filter_add_seen_by_other_workers(self):
+        ef.create_filter(self.td, 'c')
+        self.assertTrue(ef.is_absent(self.td, 'c', 'o'))
+        with patch('gluster.swift.common.Glusterfs.'
+                   '_existence_filter_refresh', 60):
+            # Added by another process
+            with patch.dict(ef._cache, clear=True):
+                ef.filter_add(self.td, 'c', 'o')
+            # The generation is checked before answering "absent"
+            self.assertFalse(ef.is_absent(self.td, 'c', 'o'))
+            self.assertTrue(ef.is_absent(self.td, 'c', 'p'))
+            # Other answers come from memory
+            with patch.object(ef, '_load') as _load:
+                self.assertFalse(ef.is_absent(self.td, 'c', 'o'))
+            self.assertFalse(_load.called)
+
+    def test_filter_dropped_while_checked(self):
+        ef.create_filter(self.td, 'c')
+        _orig_get_filter = ef._get_filter
+
+        def _get_filter(*args, **kwargs):
+            bloom = _orig_get_filter(*args, **kwargs)
+            # Dropped by another thread, or evicted from the cache
+            ef._cache.clear()
+            return bloom
+
+        with patch.object(ef, '_get_filter', side_effect=_get_filter):
+            self.assertTrue(ef.is_absent(self.td, 'c', 'o'))
+            ef.drop_filter(self.td, 'c')
+            self.assertFalse(ef.is_absent(self.td, 'c', 'o'))
+
+    def test_filter_add_turned_off(self):
+        ef.create_filter(self.td, 'c')
+        with patch('gluster.swift.common.Glusterfs._existence_filter',
+                   False):
+            ef.filter_add(self.td, 'c', 'o')
+            self.assertFalse(ef.is_absent(self.td, 'c', 'p'))
+        # Still in the filter once turned back on
+        self.assertFalse(ef.is_absent(self.td, 'c', 'o'))
+        self.assertTrue(ef.is_absent(self.td, 'c', 'p'))
+
+        # Nothing to keep up to date on volumes without filters
+        shutil.rmtree(os.path.dirname(self.path))
+        with nested(
+                patch('gluster.swift.common.Glusterfs._existence_filter',
+                      False),
+                patch.object(ef, '_locked')) as (_, _locked):
+            ef.filter_add(self.td, 'c', 'o')
+        self.assertFalse(_locked.called)
+
+    def test_set_bits_reads_and_writes_once(self):
+        with patch('gluster.swift.common.Glusterfs.'
+                   '_existence_filter_capacity', 100):
+            ef.create_filter(self.td, 'c')
+        with nested(
+                patch.object(ef, 'do_read', side_effect=ef.do_read),
+                patch.object(ef, 'do_write', side_effect=ef.do_write)) as \
+                (_read, _write):
+            ef._set_bits(self.path, ['a', 'b', 'a/b'])
+        # Header, bits
+        self.assertEqual(_read.call_count, 2)
+        # Bits, generation
+        self.assertEqual(_write.call_count, 2)
+        bloom = ef._read_filter(self.path)
+        for name in ('a', 'b', 'a/b'):
+            self.assertTrue(name in bloom)
+        self.assertEqual(bloom.generation, 1)
+
+        # Nothing written but the generation when the bits are all set
+        with patch.object(ef, 'do_write', side_effect=ef.do_write) as _write:
+            ef._set_bits(self.path, ['a'])
+        self.assertEqual(_write.call_count, 1)
+
+    def test_generation(self):
+        ef.create_filter(self.td, 'c')
+        self.assertEqual(ef._read_generation(self.path), 0)
+        ef.filter_add(self.td, 'c', 'o')
+        ef.filter_add(self.td, 'c', 'o')
+        self.assertEqual(ef._read_generation(self.path), 2)
+        # Still increasing once the filter is replaced
+        ef.create_filter(self.td, 'c')
+        self.assertEqual(ef._read_generation(self.path), 3)
+        self.assertTrue(ef.rebuild_filter(self.td, 'c', lambda: iter([])))
+        self.assertEqual(ef._read_generation(self.path), 4)
+
+    def test_create_filter_replaces_old_one(self):
+        ef.create_filter(self.td, 'c')
+        ef.filter_add(self.td, 'c', 'o')
+        ef.create_filter(self.td, 'c')
+        self.assertTrue(ef.is_absent(self.td, 'c', 'o'))
+
+    def test_drop_filter(self):
+        ef.create_filter(self.td, 'c')
+        self.assertTrue(ef.is_absent(self.td, 'c', 'o'))
+        ef.drop_filter(self.td, 'c')
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(ef.is_absent(self.td, 'c', 'o'))
+
+    def test_unusable_filter(self):
+        ef.create_filter(self.td, 'c')
+        with open(self.path, 'w') as fp:
+            fp.write('junk')
+        self.assertFalse(ef.is_absent(self.td, 'c', 'o'))
+        # Dropped when it cannot be updated
+        ef.filter_add(self.td, 'c', 'o')
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_rebuild_filter(self):
+        ef.create_filter(self.td, 'c')
+        ef.filter_add(self.td, 'c', 'deleted')
+
+        def _iter_names():
+            # Created while the container is walked
+            ef.filter_add(self.td, 'c', 'new')
+            return iter(['a', 'b'])
+
+        self.assertTrue(ef.rebuild_filter(self.td, 'c', _iter_names, 10))
+        for name in ('a', 'b', 'new'):
+            self.assertFalse(ef.is_absent(self.td, 'c', name))
+        self.assertTrue(ef.is_absent(self.td, 'c', 'deleted'))
+        self.assertFalse(os.path.exists(self.path + '.pending'))
+
+    def test_rebuild_filter_dropped(self):
+        def _iter_names():
+            ef.drop_filter(self.td, 'c')
+            return iter(['a'])
+
+        self.assertFalse(ef.rebuild_filter(self.td, 'c', _iter_names))
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_should_verify(self):
+        with patch('gluster.swift.common.Glusterfs._existence_filter_verify',
+                   3):
+            answers = [ef.should_verify() for i in xrange(9)]
+        self.assertEqual(answers.count(True), 3)
+        with patch('gluster.swift.common.Glusterfs._existence_filter_verify',
+                   0):
+            self.assertFalse(ef.should_verify())
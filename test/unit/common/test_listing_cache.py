@@ -0,0 +1,206 @@
+# Copyright (c) 2016 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Tests for gluster.swift.common.listing_cache """
+
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import nested
+from mock import patch, Mock
+
+from gluster.swift.common import utils, Glusterfs
+from gluster.swift.common import listing_cache as lc
+from test_utils import _initxattr, _destroyxattr
+
+
+class TestListingCache(unittest.TestCase):
+    """ Tests for gluster.swift.common.listing_cache """
+
+    def setUp(self):
+        _initxattr()
+        self.td = tempfile.mkdtemp()
+        self.cont_path = os.path.join(self.td, 'vol', 'cont')
+        self.run_dir = os.path.join(self.td, 'run')
+        os.makedirs(self.cont_path)
+        self._saved_RUN_DIR = Glusterfs.RUN_DIR
+        Glusterfs.RUN_DIR = self.run_dir
+        lc._memo.clear()
+        for name in ('a', 'b/c', 'b/d/e', 'f/g'):
+            self._create_file(name)
+        # Directories are not modified concurrently in these tests
+        self._racy_window = patch.object(lc, 'RACY_WINDOW', -1)
+        self._racy_window.start()
+
+    def tearDown(self):
+        self._racy_window.stop()
+        Glusterfs.RUN_DIR = self._saved_RUN_DIR
+        lc._memo.clear()
+        _destroyxattr()
+        shutil.rmtree(self.td)
+
+    def _create_file(self, name, body=''):
+        path = os.path.join(self.cont_path, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fp:
+            fp.write(body)
+
+    def _details(self):
+        _orig_gf_listdir = lc.gf_listdir
+        _m_gf_listdir = Mock(side_effect=_orig_gf_listdir)
+        with patch('gluster.swift.common.listing_cache.gf_listdir',
+                   _m_gf_listdir):
+            details = lc.get_container_details(self.cont_path)
+        scanned = [os.path.relpath(call[0][0], self.cont_path)
+                   for call in _m_gf_listdir.call_args_list]
+        return details, sorted(scanned)
+
+    def test_same_as_walk(self):
+        utils.write_metadata(os.path.join(self.cont_path, 'b'),
+                             {utils.X_OBJECT_TYPE: utils.DIR_OBJECT})
+        objects, count, bytes_used = utils.get_container_details(
+            self.cont_path)
+        details, scanned = self._details()
+        self.assertEqual(details, (sorted(objects), count, bytes_used))
+        self.assertEqual(scanned, ['.', 'b', 'b/d', 'f'])
+
+    def test_only_modified_directories_are_read(self):
+        details, scanned = self._details()
+        self.assertEqual(details[0], ['a', 'b/c', 'b/d/e', 'f/g'])
+        self.assertEqual(scanned, ['.', 'b', 'b/d', 'f'])
+
+        details, scanned = self._details()
+        self.assertEqual(details[0], ['a', 'b/c', 'b/d/e', 'f/g'])
+        self.assertEqual(scanned, [])
+
+        self._create_file('b/d/h')
+        os.unlink(os.path.join(self.cont_path, 'f/g'))
+        details, scanned = self._details()
+        self.assertEqual(details[0], ['a', 'b/c', 'b/d/e', 'b/d/h'])
+        self.assertEqual(scanned, ['b/d', 'f'])
+
+        # Removed directories are dropped with their objects
+        shutil.rmtree(os.path.join(self.cont_path, 'b'))
+        details, scanned = self._details()
+        self.assertEqual(details[0], ['a'])
+        self.assertEqual(scanned, ['.'])
+
+    def test_dir_object_change_is_seen(self):
+        self._details()
+        utils.write_metadata(os.path.join(self.cont_path, 'f'),
+                             {utils.X_OBJECT_TYPE: utils.DIR_OBJECT})
+        # Setting an xattr does not change the mtime of a directory but it
+        # changes its ctime. xattrs are mocked here, so change it by hand.
+        os.chmod(os.path.join(self.cont_path, 'f'), 0700)
+        details, scanned = self._details()
+        self.assertEqual(details[0], ['a', 'b/c', 'b/d/e', 'f', 'f/g'])
+        self.assertEqual(scanned, ['f'])
+
+    def test_racy_directories_are_read_again(self):
+        self._racy_window.stop()
+        try:
+            self._details()
+            details, scanned = self._details()
+            self.assertEqual(scanned, ['.', 'b', 'b/d', 'f'])
+        finally:
+            self._racy_window.start()
+
+    def test_shared_between_processes(self):
+        self._details()
+        self.assertTrue(os.path.exists(lc.get_cache_file(self.cont_path)))
+        # Another worker has not parsed the snapshot yet
+        lc._memo.clear()
+        details, scanned = self._details()
+        self.assertEqual(details[0], ['a', 'b/c', 'b/d/e', 'f/g'])
+        self.assertEqual(scanned, [])
+
+    def test_unreadable_snapshot(self):
+        self._details()
+        lc._memo.clear()
+        with open(lc.get_cache_file(self.cont_path), 'w') as fp:
+            fp.write('garbage')
+        details, scanned = self._details()
+        self.assertEqual(details[0], ['a', 'b/c', 'b/d/e', 'f/g'])
+        self.assertEqual(scanned, ['.', 'b', 'b/d', 'f'])
+
+    def test_bytes_used(self):
+        self._create_file('a', '12345')
+        with patch('gluster.swift.common.Glusterfs._do_getsize', True):
+            self.assertEqual(self._details()[0][2], 5)
+            self._create_file('b/x', '123')
+            self.assertEqual(self._details()[0][2], 8)
+        # A snapshot made with another setting is not reused
+        details, scanned = self._details()
+        self.assertEqual(details[2], 0)
+        self.assertEqual(scanned, ['.', 'b', 'b/d', 'f'])
+
+    def test_flat_container_written_between_listings(self):
+        for i in xrange(100):
+            self._create_file('o%03d' % i, 'x')
+        _m_getsize = Mock(side_effect=os.path.getsize)
+        _m_save = Mock(side_effect=lc._save_snapshot)
+        with nested(
+                patch('gluster.swift.common.Glusterfs._do_getsize', True),
+                patch.object(lc, 'do_getsize', _m_getsize),
+                patch.object(lc, '_save_snapshot', _m_save)):
+            details = self._details()[0]
+            self.assertEqual(details[1:], (104, 100))
+            self.assertEqual(_m_getsize.call_count, 104)
+
+            # Only the files PUT since are read, a PUT renaming a new file
+            # over the object it replaces.
+            _m_getsize.reset_mock()
+            self._create_file('.o050.tmp', 'xyz')
+            os.rename(os.path.join(self.cont_path, '.o050.tmp'),
+                      os.path.join(self.cont_path, 'o050'))
+            self._create_file('p', 'xy')
+            os.unlink(os.path.join(self.cont_path, 'o000'))
+            details = self._details()[0]
+            self.assertEqual(details[1:], (104, 103))
+            self.assertEqual(details[0], sorted(details[0]))
+            self.assertTrue('p' in details[0])
+            self.assertFalse('o000' in details[0])
+            self.assertEqual(sorted(call[0][0] for call in
+                                    _m_getsize.call_args_list),
+                             [os.path.join(self.cont_path, name)
+                              for name in ('o050', 'p')])
+            self.assertEqual(_m_save.call_count, 2)
+
+            # Still being written to: kept in memory, not saved
+            with patch.object(lc, 'RACY_WINDOW', 60):
+                self._create_file('q', 'x')
+                details = self._details()[0]
+                self.assertEqual(details[1:], (105, 104))
+                self._create_file('r', 'x')
+                details, scanned = self._details()
+                self.assertEqual(details[1:], (106, 105))
+                self.assertEqual(scanned, ['.'])
+            self.assertEqual(_m_save.call_count, 2)
+            # Until the directory settles
+            self.assertEqual(self._details()[0], details)
+            self.assertEqual(_m_save.call_count, 3)
+
+    def test_iter_container_objects(self):
+        def _list(*args):
+            return list(lc.iter_container_objects(self.cont_path, *args))
+
+        self.assertEqual(_list(), ['a', 'b/c', 'b/d/e', 'f/g'])
+        self.assertEqual(_list('a'), ['b/c', 'b/d/e', 'f/g'])
+        self.assertEqual(_list('a', 'f'), ['b/c', 'b/d/e'])
+        self.assertEqual(_list(None, None, 'b/'), ['b/c', 'b/d/e', 'f/g'])
+        self.assertEqual(_list('b/c', None, 'b/'), ['b/d/e', 'f/g'])
+        self.assertEqual(_list('zz'), [])
@@ -16,16 +16,22 @@
 """ Tests for common.utils """
 
 import os
+import stat
 import json
+import time
+import zlib
 import unittest
 import errno
+import struct
 import xattr
 import tempfile
 import hashlib
 import tarfile
 import shutil
+import eventlet
 import cPickle as pickle
 from collections import defaultdict
+from contextlib import nested
 from mock import patch, Mock
 from gluster.swift.common import utils, Glusterfs
 from gluster.swift.common.utils import deserialize_metadata, \
@@ -33,6 +39,7 @@ from gluster.swift.common.utils import deserialize_metadata, \
 from gluster.swift.common.exceptions import GlusterFileSystemOSError,\
     GlusterFileSystemIOError
 from swift.common.exceptions import DiskFileNoSpace
+from swift.common.utils import ThreadPool
 
 from nose import SkipTest
 
@@ -54,6 +61,7 @@ _xattr_rem_err = {}
 _xattr_set = None
 _xattr_get = None
 _xattr_remove = None
+_xattr_list = None
 
 
 def _xkey(path, key):
@@ -104,6 +112,13 @@ def _removexattr(path, key, *args, **kwargs):
         raise e
 
 
+def _listxattr(path, *args, **kwargs):
+    _xattr_op_cnt['list'] += 1
+    prefix = _xkey(path, '')
+    global _xattrs
+    return [xkey[len(prefix):] for xkey in _xattrs if xkey.startswith(prefix)]
+
+
 def _initxattr():
     global _xattrs
     _xattrs = {}
@@ -118,11 +133,14 @@ def _initxattr():
     global _xattr_set;    _xattr_set    = xattr.setxattr
     global _xattr_get;    _xattr_get    = xattr.getxattr
     global _xattr_remove; _xattr_remove = xattr.removexattr
+    global _xattr_list
+    _xattr_list = xattr.listxattr
 
     # Monkey patch the calls we use with our internal unit test versions
     xattr.setxattr    = _setxattr
     xattr.getxattr    = _getxattr
     xattr.removexattr = _removexattr
+    xattr.listxattr = _listxattr
 
 
 def _destroyxattr():
@@ -130,6 +148,8 @@ def _destroyxattr():
     global _xattr_set;    xattr.setxattr    = _xattr_set
     global _xattr_get;    xattr.getxattr    = _xattr_get
     global _xattr_remove; xattr.removexattr = _xattr_remove
+    global _xattr_list
+    xattr.listxattr = _xattr_list
     # Destroy the stored values and
     global _xattrs; _xattrs = None
 
@@ -254,8 +274,13 @@ class TestUtils(unittest.TestCase):
             _xattrs[xkey] = expected_p[:utils.MAX_XATTR_SIZE]
             expected_p = expected_p[utils.MAX_XATTR_SIZE:]
         assert not expected_p
+        # Left over from larger metadata
+        _xattrs[_xkey(path, "%s5" % utils.METADATA_KEY)] = 'x'
+        _xattrs[_xkey(path, "user.other")] = 'x'
         utils.clean_metadata(path)
         assert _xattr_op_cnt['remove'] == 4, "%r" % _xattr_op_cnt
+        assert _xattr_op_cnt['list'] == 1, "%r" % _xattr_op_cnt
+        assert _xattrs.keys() == [_xkey(path, "user.other")]
 
     def test_clean_metadata_err(self):
         path = "/tmp/foo/c"
@@ -308,9 +333,34 @@ class TestUtils(unittest.TestCase):
             _xattrs[xkey] = expected_p[:utils.MAX_XATTR_SIZE]
             expected_p = expected_p[utils.MAX_XATTR_SIZE:]
         assert not expected_p
+        # Read in the calling thread, usually a threadpool thread
+        with patch.object(utils.tpool, 'execute',
+                          side_effect=AssertionError('tpool')):
+            res_d = utils.read_metadata(path)
+        assert res_d == expected_d, "Expected %r, result %r" % (expected_d, res_d)
+        # One getxattr per xattr, up to the first short one
+        assert _xattr_op_cnt['get'] == 3, "%r" % _xattr_op_cnt
+        assert _xattr_op_cnt['list'] == 0, "%r" % _xattr_op_cnt
+
+    def test_read_metadata_multiple_exact(self):
+        path = "/tmp/foo/r"
+        expected_d = {'a': 'y'}
+        expected_p = serialize_metadata(expected_d)
+        expected_p = expected_p[:-1] + ' ' * (
+            utils.MAX_XATTR_SIZE * 2 - len(expected_p)) + expected_p[-1]
+        expected_d = json.loads(expected_p)
+        for i in range(0, 2):
+            xkey = _xkey(path, "%s%s" % (utils.METADATA_KEY, i or ''))
+            _xattrs[xkey] = expected_p[:utils.MAX_XATTR_SIZE]
+            expected_p = expected_p[utils.MAX_XATTR_SIZE:]
+        # Left over from larger metadata
+        xkey = _xkey(path, "%s3" % utils.METADATA_KEY)
+        _xattrs[xkey] = 'x'
         res_d = utils.read_metadata(path)
         assert res_d == expected_d, "Expected %r, result %r" % (expected_d, res_d)
-        assert _xattr_op_cnt['get'] == 4, "%r" % _xattr_op_cnt
+        # A full last xattr takes an ENODATA round trip to find out
+        assert _xattr_op_cnt['get'] == 3, "%r" % _xattr_op_cnt
+        assert _xattr_op_cnt['list'] == 0, "%r" % _xattr_op_cnt
 
     def test_read_metadata_multiple_one_missing(self):
         path = "/tmp/foo/r"
@@ -406,6 +456,242 @@ class TestUtils(unittest.TestCase):
             self.assertTrue(_m_json_loads.called)
             _m_json_loads.reset_mock()
 
+    def test_serialize_metadata_binary(self):
+        orig_md = {'X-Timestamp': '1400000000.00000', 'Content-Length': 10,
+                   u'X-Object-Meta-\xe9': u'\xe9t\xe9',
+                   'X-Type': ('Object', 0), 'X-Big': 2 ** 70, 'X-Float': 1.5,
+                   'X-None': None, 'X-Bool': True, 'X-Empty': ''}
+        json_md = serialize_metadata(orig_md)
+        with patch('gluster.swift.common.Glusterfs._metadata_format',
+                   'binary'):
+            bin_md = serialize_metadata(orig_md)
+        self.assertTrue(bin_md.startswith(utils.BINARY_METADATA_MAGIC))
+        md = deserialize_metadata(bin_md)
+        # Read back exactly as the same metadata stored as JSON
+        self.assertEqual(md, deserialize_metadata(json_md))
+        for key, value in md.iteritems():
+            self.assertTrue(type(key) is str)
+        self.assertTrue(type(md['X-Object-Meta-\xc3\xa9']) is str)
+        with patch('gluster.swift.common.Glusterfs._metadata_format',
+                   'binary'):
+            bin_md = serialize_metadata({'a': {'b': ['c', ('d', 1)]}})
+        self.assertEqual(deserialize_metadata(bin_md),
+                         {'a': {'b': ('c', ('d', 1))}})
+        self.assertEqual(deserialize_metadata(
+            utils.BINARY_METADATA_MAGIC + utils.BINARY_METADATA_VERSION +
+            utils._binary_pack_dict({})), {})
+
+    def test_deserialize_metadata_binary_invalid(self):
+        with patch('gluster.swift.common.Glusterfs._metadata_format',
+                   'binary'):
+            bin_md = serialize_metadata({'a': 'b', 'c': ('d', 0)})
+        self.assertEqual(deserialize_metadata(bin_md[:-1]), {})
+        self.assertEqual(deserialize_metadata(bin_md + 'x'), {})
+        self.assertEqual(deserialize_metadata(bin_md[:8]), {})
+        self.assertEqual(deserialize_metadata(
+            utils.BINARY_METADATA_MAGIC + '\xff' + bin_md[5:]), {})
+        self.assertRaises(TypeError, utils._binary_pack_dict,
+                          {'a': object()})
+
+    def test_serialize_metadata_compressed(self):
+        orig_md = {'X-Object-Meta-A': 'a' * 200000, 'X-Object-Meta-B': 'b'}
+        plain_md = serialize_metadata(orig_md)
+        for metadata_format in ('json', 'binary'):
+            with nested(
+                    patch('gluster.swift.common.Glusterfs._metadata_format',
+                          metadata_format),
+                    patch('gluster.swift.common.Glusterfs.'
+                          '_metadata_compression_threshold', 4096)):
+                md = serialize_metadata(orig_md)
+                # Below the threshold
+                self.assertFalse(serialize_metadata(
+                    {'X-Object-Meta-B': 'b' * 4000}).startswith(
+                        utils.COMPRESSED_METADATA_MAGIC))
+            self.assertTrue(md.startswith(utils.COMPRESSED_METADATA_MAGIC))
+            self.assertTrue(len(md) < utils.MAX_XATTR_SIZE)
+            self.assertEqual(deserialize_metadata(md), orig_md)
+        self.assertFalse(plain_md.startswith(utils.COMPRESSED_METADATA_MAGIC))
+        # Incompressible, stored as is
+        random_md = {'a': os.urandom(8192)}
+        with nested(
+                patch('gluster.swift.common.Glusterfs._metadata_format',
+                      'binary'),
+                patch('gluster.swift.common.Glusterfs.'
+                      '_metadata_compression_threshold', 4096)):
+            self.assertFalse(serialize_metadata(random_md).startswith(
+                utils.COMPRESSED_METADATA_MAGIC))
+
+    def test_deserialize_metadata_compressed_invalid(self):
+        magic = utils.COMPRESSED_METADATA_MAGIC
+        compressed = zlib.compress(serialize_metadata({'a': 'b'}))
+        self.assertEqual(deserialize_metadata(magic + compressed),
+                         {'a': 'b'})
+        self.assertEqual(deserialize_metadata(magic + compressed[:-6]), {})
+        self.assertEqual(deserialize_metadata(magic + 'garbage'), {})
+        # Compressed twice
+        self.assertEqual(deserialize_metadata(
+            magic + zlib.compress(magic + compressed)), {})
+        # Too large once decompressed
+        self.assertEqual(deserialize_metadata(
+            magic + zlib.compress('{"a":"%s"}' % (
+                'x' * utils.MAX_DECOMPRESSED_METADATA))), {})
+
+    def test_write_metadata_compressed(self):
+        path = "/tmp/foo/w"
+        orig_d = {'X-Object-Meta-A': 'a' * 200000}
+        with patch('gluster.swift.common.Glusterfs.'
+                   '_metadata_compression_threshold', 4096):
+            utils.write_metadata(path, orig_d)
+        # A single xattr instead of four
+        self.assertEqual(_xattrs.keys(), [_xkey(path, utils.METADATA_KEY)])
+        self.assertEqual(utils.read_metadata(path), orig_d)
+        assert _xattr_op_cnt['get'] == 1, "%r" % _xattr_op_cnt
+
+    def test_write_metadata_binary(self):
+        path = "/tmp/foo/w"
+        orig_d = {'bar': 'foo', 'X-Type': ('Object', 0)}
+        xkey = _xkey(path, utils.METADATA_KEY)
+        with patch('gluster.swift.common.Glusterfs._metadata_format',
+                   'binary'):
+            utils.write_metadata(path, orig_d)
+        self.assertTrue(_xattrs[xkey].startswith(
+            utils.BINARY_METADATA_MAGIC))
+        self.assertEqual(utils.read_metadata(path), orig_d)
+
+    def test_write_metadata_sys_metadata(self):
+        path = "/tmp/foo/w"
+        orig_d = {utils.X_TIMESTAMP: '1400000000.00000',
+                  utils.X_CONTENT_TYPE: 'text/plain',
+                  utils.X_ETAG: hashlib.md5('x').hexdigest(),
+                  utils.X_CONTENT_LENGTH: '1', utils.X_TYPE: utils.OBJECT,
+                  utils.X_OBJECT_TYPE: utils.FILE,
+                  utils.X_CONTENT_SIGNATURE: '1:1:1.0',
+                  utils.X_DELETE_AT: '1500000000',
+                  'X-Object-Meta-Color': 'blue', 'name': '/c/o'}
+        xkey = _xkey(path, utils.SYS_METADATA_KEY)
+        utils.write_metadata(path, orig_d)
+        self.assertFalse(xkey in _xattrs)
+        with patch('gluster.swift.common.Glusterfs._system_metadata_xattr',
+                   True):
+            utils.write_metadata(path, orig_d)
+            self.assertTrue(xkey in _xattrs)
+            sys_d = utils.read_sys_metadata(path)
+            self.assertEqual(sys_d, dict(
+                (key, value) for key, value in orig_d.iteritems()
+                if key in utils.SYS_METADATA_KEYS))
+            self.assertTrue(utils.validate_object(sys_d))
+            self.assertFalse(sys_d.complete)
+            # Integer content length, no expiry nor signature
+            del orig_d[utils.X_DELETE_AT], orig_d[utils.X_CONTENT_SIGNATURE]
+            orig_d[utils.X_CONTENT_LENGTH] = 1
+            orig_d[utils.X_OBJECT_TYPE] = utils.DIR_OBJECT
+            utils.write_metadata(path, orig_d)
+            sys_d = utils.read_sys_metadata(path)
+            self.assertEqual(sys_d[utils.X_CONTENT_LENGTH], 1)
+            self.assertEqual(sys_d[utils.X_OBJECT_TYPE], utils.DIR_OBJECT)
+            self.assertFalse(utils.X_DELETE_AT in sys_d)
+            self.assertFalse(utils.X_CONTENT_SIGNATURE in sys_d)
+            # Nothing but system fields
+            del orig_d['X-Object-Meta-Color'], orig_d['name']
+            utils.write_metadata(path, orig_d)
+            self.assertTrue(utils.read_sys_metadata(path).complete)
+            # Not stored exactly: the copy is dropped
+            orig_d[utils.X_ETAG] = ''
+            utils.write_metadata(path, orig_d)
+            self.assertFalse(xkey in _xattrs)
+            self.assertEqual(utils.read_sys_metadata(path), {})
+            # Containers have none
+            utils.write_metadata(path, {utils.X_TYPE: (utils.CONTAINER, 0)})
+            self.assertFalse(xkey in _xattrs)
+            _xattrs[xkey] = 'garbage'
+            self.assertEqual(utils.read_sys_metadata(path), {})
+            utils.clean_metadata(path)
+            self.assertFalse(xkey in _xattrs)
+
+    def test_write_metadata_differential(self):
+        path = "/tmp/foo/w"
+        orig_d = {'a': 'x' * 150000, 'z': '1'}
+        utils.write_metadata(path, orig_d)
+        assert _xattr_op_cnt['set'] == 3, "%r" % _xattr_op_cnt
+        md = utils.read_metadata(path)
+        # Only the last chunk holds a change
+        md['z'] = '2'
+        utils.write_metadata(path, md)
+        assert _xattr_op_cnt['set'] == 4, "%r" % _xattr_op_cnt
+        self.assertEqual(utils.read_metadata(path), md)
+        # Rewriting what was written writes nothing
+        utils.write_metadata(path, md)
+        assert _xattr_op_cnt['set'] == 4, "%r" % _xattr_op_cnt
+        # Copies, and metadata passed as the original, work the same
+        new_md = md.copy()
+        new_md['z'] = '3'
+        utils.write_metadata(path, new_md)
+        utils.write_metadata(path, {'a': 'x' * 150000, 'z': '4'},
+                             utils.read_metadata(path))
+        assert _xattr_op_cnt['set'] == 6, "%r" % _xattr_op_cnt
+        # Shrunk, the trailing chunks are removed
+        md = utils.read_metadata(path)
+        md['a'] = 'x'
+        utils.write_metadata(path, md)
+        assert _xattr_op_cnt['remove'] == 2, "%r" % _xattr_op_cnt
+        self.assertEqual(_xattrs.keys(), [_xkey(path, utils.METADATA_KEY)])
+        self.assertEqual(utils.read_metadata(path), {'a': 'x', 'z': '4'})
+
+    def test_write_metadata_rewritten_since_read(self):
+        path = "/tmp/foo/w"
+        utils.write_metadata(path, {'a': 'x' * 150000, 'z': '1'})
+        md = utils.read_metadata(path)
+        # Rewritten by another process, changing the middle chunk only
+        other_d = {'a': 'x' * 100000 + 'y' * 50000, 'z': '1'}
+        utils.write_metadata(path, other_d)
+        self.assertEqual(utils.read_metadata(path), other_d)
+        _xattr_op_cnt['set'] = 0
+        md['z'] = '2'
+        utils.write_metadata(path, md)
+        # Every chunk is written rather than mixing the two
+        assert _xattr_op_cnt['set'] == 3, "%r" % _xattr_op_cnt
+        self.assertEqual(utils.read_metadata(path), md)
+        # Grown by another process, with the chunks read left in place
+        md = utils.read_metadata(path)
+        other_d = dict(md)
+        other_d['z'] = '2' * 100000
+        utils.write_metadata(path, other_d)
+        md['z'] = '3'
+        utils.write_metadata(path, md)
+        self.assertEqual(utils.read_metadata(path), md)
+
+    def test_write_metadata_exact_multiple(self):
+        path = "/tmp/foo/w"
+        _xattrs[_xkey(path, "%s1" % utils.METADATA_KEY)] = 'left over'
+        orig_d = {'a': 'x'}
+        orig_d['a'] += 'x' * (utils.MAX_XATTR_SIZE -
+                              len(serialize_metadata(orig_d)))
+        utils.write_metadata(path, orig_d)
+        assert _xattr_op_cnt['remove'] == 1, "%r" % _xattr_op_cnt
+        self.assertEqual(utils.read_metadata(path), orig_d)
+
+    def test_lazy_metadata(self):
+        full = {utils.X_TIMESTAMP: '1', utils.X_TYPE: utils.OBJECT,
+                'X-Object-Meta-Color': 'blue'}
+        load = Mock(return_value=dict(full))
+        md = utils.LazyMetadata({utils.X_TIMESTAMP: '1',
+                                 utils.X_TYPE: utils.OBJECT}, load)
+        self.assertTrue(md)
+        self.assertEqual(md[utils.X_TIMESTAMP], '1')
+        self.assertFalse(utils.X_DELETE_AT in md)
+        self.assertEqual(md.pop(utils.X_TYPE), utils.OBJECT)
+        self.assertFalse(utils.validate_object(md))
+        self.assertFalse(load.called)
+        self.assertEqual(md.get('X-Object-Meta-Color'), 'blue')
+        self.assertEqual(load.call_count, 1)
+        # Removed before the metadata was read
+        self.assertEqual(md, {utils.X_TIMESTAMP: '1',
+                              'X-Object-Meta-Color': 'blue'})
+        self.assertTrue(isinstance(md.copy(), utils.StoredMetadata))
+        md = utils.LazyMetadata({utils.X_TIMESTAMP: '1'},
+                                Mock(return_value=dict(full)))
+        self.assertEqual(sorted(md.keys()), sorted(full.keys()))
+
     def test_add_timestamp_empty(self):
         orig = {}
         res = utils._add_timestamp(orig)
@@ -555,7 +841,7 @@ class TestUtils(unittest.TestCase):
             os.rmdir(td)
 
     def test_get_container_metadata(self):
-        def _mock_get_container_details(path):
+        def _mock_get_container_details(path, workers=None, pace=None):
             o_list = ['a', 'b', 'c']
             o_count = 3
             b_used = 47
@@ -577,6 +863,27 @@ class TestUtils(unittest.TestCase):
             utils.get_container_details = orig_gcd
             os.rmdir(td)
 
+    def test_get_container_metadata_no_count(self):
+        td = tempfile.mkdtemp()
+        try:
+            open(os.path.join(td, 'o'), 'w').close()
+            with patch('gluster.swift.common.utils.get_container_details',
+                       side_effect=AssertionError('walked')):
+                md = utils.get_container_metadata(td, count=False)
+                self.assertEqual(md[utils.X_OBJECTS_COUNT], (0, 0))
+                self.assertEqual(md[utils.X_STATS_PENDING], (1, 0))
+                assert utils.validate_container(md)
+
+                # Nothing is pending when quota keeps the usage
+                xattr.setxattr(td, utils.QUOTA_SIZE_KEY,
+                               struct.pack('>qqq', 47, 3, 1))
+                md = utils.get_container_metadata(td, count=False)
+                self.assertEqual(md[utils.X_OBJECTS_COUNT], (3, 0))
+                self.assertEqual(md[utils.X_BYTES_USED], (47, 0))
+                assert utils.X_STATS_PENDING not in md
+        finally:
+            shutil.rmtree(td)
+
     def test_get_account_metadata(self):
         def _mock_get_account_details(path):
             c_list = ['123', 'abc']
@@ -611,7 +918,8 @@ class TestUtils(unittest.TestCase):
             xkey = _xkey(td, utils.METADATA_KEY)
             assert len(_xattrs.keys()) == 1
             assert xkey in _xattrs
-            assert _xattr_op_cnt['get'] == 1
+            # Quota usage is looked up as well
+            assert _xattr_op_cnt['get'] == 2
             assert _xattr_op_cnt['set'] == 1
             md = deserialize_metadata(_xattrs[xkey])
             assert r_md == md
@@ -733,6 +1041,49 @@ class TestUtils(unittest.TestCase):
             os.chdir(orig_cwd)
             shutil.rmtree(td)
 
+    def test_get_quota_usage(self):
+        td = tempfile.mkdtemp()
+        try:
+            assert utils.get_quota_usage(td) is None
+            xattr.setxattr(td, utils.QUOTA_SIZE_KEY, struct.pack('>q', 47))
+            self.assertEqual(utils.get_quota_usage(td), (47, None))
+            xattr.setxattr(td, utils.QUOTA_SIZE_KEY,
+                           struct.pack('>qqq', 47, 3, 2))
+            self.assertEqual(utils.get_quota_usage(td), (47, 3))
+            xattr.setxattr(td, utils.QUOTA_SIZE_KEY,
+                           struct.pack('>qqq', -1, -1, 2))
+            self.assertEqual(utils.get_quota_usage(td), (0, 0))
+            xattr.setxattr(td, utils.QUOTA_SIZE_KEY, 'garbage')
+            assert utils.get_quota_usage(td) is None
+        finally:
+            os.rmdir(td)
+
+    def test_get_container_usage(self):
+        td = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(td, 'o'), 'w') as fp:
+                fp.write('12345')
+            self.assertEqual(utils.get_container_usage(td), (1, 0))
+
+            # Only the count is walked for when quota only keeps the size
+            xattr.setxattr(td, utils.QUOTA_SIZE_KEY, struct.pack('>q', 5))
+            self.assertEqual(utils.get_container_usage(td), (1, 5))
+
+            xattr.setxattr(td, utils.QUOTA_SIZE_KEY,
+                           struct.pack('>qqq', 47, 3, 1))
+            with patch('gluster.swift.common.utils.get_container_details',
+                       side_effect=AssertionError('walked')):
+                self.assertEqual(utils.get_container_usage(td), (3, 47))
+
+            # Walked all the same for names, the counts coming from quota
+            os.mkdir(os.path.join(td, 'd'))
+            names = []
+            self.assertEqual(utils.get_container_usage(td, names=names),
+                             (3, 47))
+            self.assertEqual(sorted(names), ['d', 'o'])
+        finally:
+            shutil.rmtree(td)
+
     def test_validate_container_empty(self):
         ret = utils.validate_container({})
         assert not ret
@@ -827,6 +1178,37 @@ class TestUtils(unittest.TestCase):
         fake_stat = Mock(st_size=12345, st_mode=33188)
         self.assertTrue(utils.validate_object(md, fake_stat))
 
+    def test_validate_object_with_signature(self):
+        md = {utils.X_TIMESTAMP: 'na',
+              utils.X_CONTENT_TYPE: 'na',
+              utils.X_ETAG: 'bad',
+              utils.X_CONTENT_LENGTH: '12345',
+              utils.X_TYPE: utils.OBJECT,
+              utils.X_OBJECT_TYPE: 'na'}
+        fake_stat = Mock(st_ino=7, st_size=12345, st_mode=33188,
+                         st_mtime=1500000000.25)
+        md[utils.X_CONTENT_SIGNATURE] = utils.get_content_signature(fake_stat)
+        self.assertTrue(utils.validate_object(md, fake_stat))
+        # Same length, modified
+        fake_stat = Mock(st_ino=7, st_size=12345, st_mode=33188,
+                         st_mtime=1500000001.5)
+        self.assertFalse(utils.validate_object(md, fake_stat))
+        # Same length, replaced
+        fake_stat = Mock(st_ino=8, st_size=12345, st_mode=33188,
+                         st_mtime=1500000000.25)
+        self.assertFalse(utils.validate_object(md, fake_stat))
+
+    def test_iter_listing_chunks(self):
+        self.assertEqual(list(utils.iter_listing_chunks([], 4)), [])
+        self.assertEqual(list(utils.iter_listing_chunks(
+            ['ab', 'c', 'defg', 'h', 'i'], 4)), ['abcdefg', 'hi'])
+
+    def test_iter_json_listing(self):
+        for records in ([], [{'name': 'a'}],
+                        [{'name': 'a', 'bytes': 1}, {'subdir': u'\u00e9/'}]):
+            self.assertEqual(''.join(utils.iter_json_listing(iter(records))),
+                             json.dumps(records))
+
     def test_validate_object_marker_dir(self):
         md = {utils.X_TIMESTAMP: 'na',
               utils.X_CONTENT_TYPE: 'application/directory',
@@ -894,6 +1276,13 @@ class TestUtilsDirObjects(unittest.TestCase):
         self._clear_dir_object(self.dirs[0])
         self.assertTrue(utils.rmobjdir(self.rootdir))
 
+    def test_rmobjdir_parallel(self):
+        self.assertFalse(utils.rmobjdir(self.rootdir, workers=4))
+        for f in self.files:
+            os.unlink(os.path.join(self.rootdir, f))
+        self.assertTrue(utils.rmobjdir(self.rootdir, workers=4))
+        self.assertFalse(os.path.exists(self.rootdir))
+
     def test_rmobjdir_metadata_errors(self):
 
         def _mock_rm(path):
@@ -1074,6 +1463,365 @@ class TestUtilsDirObjects(unittest.TestCase):
                 self.assertFalse(entry.is_dir())
 
 
+class TestIterContainerObjects(unittest.TestCase):
+
+    def setUp(self):
+        _initxattr()
+        self.cont_path = tempfile.mkdtemp()
+        # Names chosen so that a naive depth-first walk of sorted directory
+        # entries would not produce them in sorted order.
+        self.files = ['a.txt', 'a/b', 'a/b.txt', 'a/c/d', 'a-b', 'a0',
+                      'b/c/d/e', 'b/c/f', 'z']
+        for f in self.files:
+            path = os.path.join(self.cont_path, f)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            open(path, 'w').close()
+
+    def tearDown(self):
+        _destroyxattr()
+        shutil.rmtree(self.cont_path)
+
+    def _list(self, marker=None, end_marker=None):
+        return list(utils.iter_container_objects(self.cont_path, marker,
+                                                 end_marker))
+
+    def test_sorted(self):
+        self.assertEqual(self._list(), sorted(self.files))
+        obj_list = utils.get_container_details(self.cont_path)[0]
+        self.assertEqual(self._list(), sorted(obj_list))
+
+    def test_dir_objects(self):
+        utils.write_metadata(os.path.join(self.cont_path, 'a'),
+                             {utils.X_OBJECT_TYPE: utils.DIR_OBJECT})
+        self.assertEqual(self._list(), sorted(self.files + ['a']))
+        with patch('gluster.swift.common.Glusterfs._implicit_dir_objects',
+                   True):
+            self.assertEqual(self._list(),
+                             sorted(self.files + ['a', 'a/c', 'b', 'b/c',
+                                                  'b/c/d']))
+
+    def test_marker_end_marker(self):
+        expected = sorted(self.files)
+        for marker in [''] + expected + ['a/', 'a/c/', 'b', 'y', 'zz']:
+            self.assertEqual(self._list(marker=marker),
+                             [o for o in expected if o > marker])
+            self.assertEqual(self._list(end_marker=marker or None),
+                             [o for o in expected if not marker or
+                              o < marker])
+        self.assertEqual(self._list(marker='a/b', end_marker='b/c/f'),
+                         ['a/b.txt', 'a/c/d', 'a0', 'b/c/d/e'])
+
+    def test_reads_only_needed_directories(self):
+        listed = []
+        _orig_gf_listdir = utils.gf_listdir
+
+        def _mock_listdir(path):
+            listed.append(os.path.relpath(path, self.cont_path))
+            return _orig_gf_listdir(path)
+
+        with patch('gluster.swift.common.utils.gf_listdir', _mock_listdir):
+            objs = utils.iter_container_objects(self.cont_path)
+            self.assertEqual(objs.next(), 'a-b')
+            self.assertEqual(listed, ['.'])
+
+            del listed[:]
+            self.assertEqual(self._list(marker='a0'), ['b/c/d/e', 'b/c/f',
+                                                       'z'])
+            self.assertEqual(listed, ['.', 'b', 'b/c', 'b/c/d'])
+
+            del listed[:]
+            self.assertEqual(self._list(end_marker='a.txt'), ['a-b'])
+            self.assertEqual(listed, ['.'])
+
+    def test_prefix(self):
+        expected = sorted(self.files)
+        for prefix in ['', 'a', 'a/', 'a/b', 'a/c/', 'b/c/', 'b/c/d', 'x/',
+                       'a0/', 'a//', 'a/../', './a']:
+            self.assertEqual(
+                list(utils.iter_container_objects(self.cont_path,
+                                                  prefix=prefix)),
+                [o for o in expected if o.startswith(prefix)])
+        self.assertEqual(
+            list(utils.iter_container_objects(self.cont_path, marker='a/b',
+                                              prefix='a/')),
+            ['a/b.txt', 'a/c/d'])
+
+    def test_prefix_reads_only_prefix_directories(self):
+        listed = []
+        _orig_gf_listdir = utils.gf_listdir
+
+        def _mock_listdir(path):
+            listed.append(os.path.relpath(path, self.cont_path))
+            return _orig_gf_listdir(path)
+
+        with patch('gluster.swift.common.utils.gf_listdir', _mock_listdir):
+            self.assertEqual(
+                list(utils.iter_container_objects(self.cont_path,
+                                                  prefix='b/c/')),
+                ['b/c/d/e', 'b/c/f'])
+            self.assertEqual(listed, ['b/c', 'b/c/d'])
+
+            del listed[:]
+            self.assertEqual(
+                list(utils.iter_container_objects(self.cont_path,
+                                                  prefix='b/c/f')),
+                ['b/c/f'])
+            self.assertEqual(listed, ['b/c'])
+
+    def test_delimiter_and_path(self):
+        for f in ('b/c/d/g', 'b/c/d/h/i'):
+            os.makedirs(os.path.join(self.cont_path, f))
+            open(os.path.join(self.cont_path, f, 'obj'), 'w').close()
+        # Only the first object under each sub-directory is needed
+        self.assertEqual(
+            list(utils.iter_container_objects(self.cont_path, prefix='b/c/',
+                                              delimiter='/')),
+            ['b/c/d/e', 'b/c/f'])
+        self.assertEqual(
+            list(utils.iter_container_objects(self.cont_path, prefix='b/c/',
+                                              delimiter='/', path='b/c/')),
+            ['b/c/f'])
+        # Other delimiters do not map to directories
+        self.assertEqual(
+            list(utils.iter_container_objects(self.cont_path, prefix='b/c/',
+                                              delimiter='-')),
+            ['b/c/d/e', 'b/c/d/g/obj', 'b/c/d/h/i/obj', 'b/c/f'])
+
+    def _age_dirs(self, age=10):
+        mtime = time.time() - age
+        for root, dirs, files in os.walk(self.cont_path):
+            os.utime(root, (mtime, mtime))
+
+    def test_sorted_entries_cache(self):
+        listed = []
+        _orig_gf_listdir = utils.gf_listdir
+
+        def _mock_listdir(path):
+            listed.append(os.path.relpath(path, self.cont_path))
+            return _orig_gf_listdir(path)
+
+        utils._sorted_entries_cache.clear()
+        utils._sorted_entries_cached[0] = 0
+        with patch('gluster.swift.common.utils.gf_listdir', _mock_listdir):
+            # Directories just modified are read again
+            self.assertEqual(self._list(marker='b'), ['b/c/d/e', 'b/c/f',
+                                                      'z'])
+            self.assertEqual(self._list(marker='b'), ['b/c/d/e', 'b/c/f',
+                                                      'z'])
+            self.assertEqual(listed, ['.', 'b', 'b/c', 'b/c/d'] * 2)
+
+            self._age_dirs()
+            del listed[:]
+            self.assertEqual(self._list(marker='b'), ['b/c/d/e', 'b/c/f',
+                                                      'z'])
+            self.assertEqual(self._list(marker='b/c/d/e'), ['b/c/f', 'z'])
+            self.assertEqual(listed, ['.', 'b', 'b/c', 'b/c/d'])
+
+            # A modified directory is read again
+            open(os.path.join(self.cont_path, 'b/c/g'), 'w').close()
+            mtime = time.time() - 5
+            os.utime(os.path.join(self.cont_path, 'b/c'), (mtime, mtime))
+            del listed[:]
+            self.assertEqual(self._list(marker='b/c/d/e'),
+                             ['b/c/f', 'b/c/g', 'z'])
+            self.assertEqual(listed, ['b/c'])
+        self.assertEqual(utils._sorted_entries_cached[0],
+                         sum(len(entries) for ino, mtime, entries in
+                             utils._sorted_entries_cache.values()))
+
+    def test_sorted_entries_cache_size(self):
+        self._age_dirs()
+        utils._sorted_entries_cache.clear()
+        utils._sorted_entries_cached[0] = 0
+        # The root directory has 8 entries, 'b', 'b/c' and 'b/c/d' 2, 3
+        # and 1: the root directory is too large to be cached, and 'b' is
+        # evicted when 'b/c/d' is read.
+        with patch('gluster.swift.common.Glusterfs._listing_dir_cache_size',
+                   5):
+            self._list(marker='b/c/d/e')
+            self.assertEqual(utils._sorted_entries_cache.keys(),
+                             [os.path.join(self.cont_path, 'b', 'c'),
+                              os.path.join(self.cont_path, 'b', 'c', 'd')])
+            self.assertEqual(utils._sorted_entries_cached[0], 4)
+        with patch('gluster.swift.common.Glusterfs._listing_dir_cache_size',
+                   0):
+            utils._sorted_entries_cache.clear()
+            utils._sorted_entries_cached[0] = 0
+            self.assertEqual(self._list(), sorted(self.files))
+            self.assertEqual(utils._sorted_entries_cache, {})
+
+    def test_missing_container(self):
+        self.assertEqual(list(utils.iter_container_objects(
+            os.path.join(self.cont_path, 'nonexistent'))), [])
+
+
+class TestImapOrdered(unittest.TestCase):
+
+    def test_order_and_concurrency(self):
+        running = [0]
+        max_running = [0]
+
+        def _func(i):
+            running[0] += 1
+            max_running[0] = max(max_running[0], running[0])
+            # Finish in reverse order of submission
+            eventlet.sleep(0.001 * (10 - i % 10))
+            running[0] -= 1
+            return i * 2
+
+        self.assertEqual(list(utils.imap_ordered(_func, xrange(30), 4)),
+                         [i * 2 for i in xrange(30)])
+        self.assertEqual(max_running[0], 4)
+
+    def test_early_exit(self):
+        called = []
+
+        def _func(i):
+            called.append(i)
+            return i
+
+        for i in utils.imap_ordered(_func, xrange(100), 5):
+            if i == 9:
+                break
+        eventlet.sleep()
+        self.assertTrue(len(called) <= 15, called)
+
+    def test_exception(self):
+        def _func(i):
+            if i == 3:
+                raise ValueError(i)
+            return i
+
+        results = utils.imap_ordered(_func, xrange(10), 4)
+        self.assertEqual([results.next() for i in xrange(3)], [0, 1, 2])
+        self.assertRaises(ValueError, results.next)
+
+
+class TestGfParallelWalk(unittest.TestCase):
+
+    def setUp(self):
+        self.td = tempfile.mkdtemp()
+        for i in xrange(3):
+            for j in xrange(3):
+                os.makedirs(os.path.join(self.td, 'd%d' % i, 'd%d' % j))
+                open(os.path.join(self.td, 'd%d' % i, 'f%d' % j), 'w').close()
+        open(os.path.join(self.td, 'f'), 'w').close()
+        os.symlink(os.path.join(self.td, 'd0'), os.path.join(self.td, 'l'))
+
+    def tearDown(self):
+        shutil.rmtree(self.td)
+
+    def _walk(self, walk, **kwargs):
+        return sorted((path, sorted(dirs), sorted(files))
+                      for path, dirs, files in walk(self.td, **kwargs))
+
+    def test_same_as_gf_walk(self):
+        for topdown in (True, False):
+            self.assertEqual(
+                self._walk(utils.gf_parallel_walk, topdown=topdown,
+                           workers=4),
+                self._walk(utils.gf_walk, topdown=topdown))
+
+    def test_order(self):
+        paths = [path for path, dirs, files in
+                 utils.gf_parallel_walk(self.td, workers=4)]
+        for path in paths[1:]:
+            self.assertTrue(
+                paths.index(os.path.dirname(path)) < paths.index(path))
+        paths = [path for path, dirs, files in
+                 utils.gf_parallel_walk(self.td, topdown=False, workers=4)]
+        for path in paths[:-1]:
+            self.assertTrue(
+                paths.index(os.path.dirname(path)) > paths.index(path))
+
+    def test_concurrency(self):
+        running = [0]
+        max_running = [0]
+        _orig_read_walk_dir = utils._read_walk_dir
+
+        def _read_walk_dir(path, followlinks):
+            running[0] += 1
+            max_running[0] = max(max_running[0], running[0])
+            eventlet.sleep(0.01)
+            running[0] -= 1
+            return _orig_read_walk_dir(path, followlinks)
+
+        # Run in the calling thread so that the greenthreads overlap
+        with nested(patch.object(utils, '_read_walk_dir', _read_walk_dir),
+                    patch.object(utils.tpool, 'execute',
+                                 lambda f, *a: f(*a))):
+            self._walk(utils.gf_parallel_walk, workers=2)
+        self.assertEqual(max_running[0], 2)
+
+    def test_concurrency_in_thread(self):
+        # Full scans run in tpool or ThreadPool threads
+        lock = eventlet.patcher.original('threading').Lock()
+        _sleep = eventlet.patcher.original('time').sleep
+        running = [0]
+        max_running = [0]
+        _orig_read_walk_dir = utils._read_walk_dir
+
+        def _read_walk_dir(path, followlinks):
+            with lock:
+                running[0] += 1
+                max_running[0] = max(max_running[0], running[0])
+            _sleep(0.01)
+            with lock:
+                running[0] -= 1
+            return _orig_read_walk_dir(path, followlinks)
+
+        def _in_thread(func, *args, **kwargs):
+            # What ThreadPool(nthreads > 0) does
+            result = []
+            thread = eventlet.patcher.original('threading').Thread(
+                target=lambda: result.append(func(*args, **kwargs)))
+            thread.start()
+            thread.join()
+            return result[0]
+
+        # ThreadPool(0).force_run_in_thread() runs in a tpool thread
+        for run in (ThreadPool(0).force_run_in_thread, eventlet.tpool.execute,
+                    _in_thread):
+            max_running[0] = 0
+            with patch.object(utils, '_read_walk_dir', _read_walk_dir):
+                self.assertEqual(
+                    run(self._walk, utils.gf_parallel_walk, workers=2),
+                    self._walk(utils.gf_walk))
+            self.assertEqual(max_running[0], 2)
+
+    def test_serial(self):
+        with patch.object(utils, 'GreenPool',
+                          side_effect=AssertionError('parallel')):
+            self.assertEqual(self._walk(utils.gf_parallel_walk, workers=1),
+                             self._walk(utils.gf_walk))
+            with patch('gluster.swift.common.Glusterfs._walk_workers', 1):
+                self.assertEqual(self._walk(utils.gf_parallel_walk),
+                                 self._walk(utils.gf_walk))
+
+    def test_onerror(self):
+        errors = []
+        self.assertEqual(
+            list(utils.gf_parallel_walk(os.path.join(self.td, 'missing'),
+                                        onerror=errors.append, workers=4)),
+            [])
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(errors[0].errno, errno.ENOENT)
+
+    def test_get_container_details(self):
+        self.assertEqual(
+            sorted(utils.get_container_details(self.td, workers=4)[0]),
+            sorted(utils.get_container_details(self.td, workers=1)[0]))
+
+    def test_get_walk_workers(self):
+        with nested(
+                patch('gluster.swift.common.Glusterfs._walk_workers', 2),
+                patch('gluster.swift.common.Glusterfs.'
+                      '_walk_workers_per_volume', {'big': 16})):
+            self.assertEqual(Glusterfs.get_walk_workers('big'), 16)
+            self.assertEqual(Glusterfs.get_walk_workers('other'), 2)
+
+
 class TestSmallDirEntry(unittest.TestCase):
 
     def test_does_stat_when_no_d_type(self):
@@ -1091,6 +1839,17 @@ class TestSmallDirEntry(unittest.TestCase):
             self.assertTrue(e.is_dir())
         self.assertFalse(mock_os_lstat.called)
 
+    def test_is_symlink(self):
+        e = utils.SmallDirEntry('/root/path', 'name', utils.DT_UNKNOWN)
+        mock_os_lstat = Mock(return_value=Mock(st_mode=stat.S_IFLNK | 0777))
+        with patch('os.lstat', mock_os_lstat):
+            self.assertTrue(e.is_symlink())
+            self.assertFalse(e.is_dir())
+        mock_os_lstat.assert_called_once_with('/root/path/name')
+
+        e = utils.SmallDirEntry('/root/path', 'name', utils.DT_DIR)
+        self.assertFalse(e.is_symlink())
+
     def test_is_dir_file_not_present_should_return_false(self):
         e = utils.SmallDirEntry('/root/path', 'name', utils.DT_UNKNOWN)
         mock_os_lstat = Mock(side_effect=OSError(errno.ENOENT,
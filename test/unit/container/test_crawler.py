@@ -0,0 +1,232 @@
+# Copyright (c) 2016 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Tests for gluster.swift.container.crawler """
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from contextlib import nested
+from mock import patch
+
+from gluster.swift.common import utils, existence_filter
+from gluster.swift.common.container_index import ContainerIndex
+from gluster.swift.container import crawler
+from test.unit.common.test_utils import _initxattr, _destroyxattr
+from test.unit import FakeLogger
+
+
+class TestContainerCrawler(unittest.TestCase):
+    """ Tests for gluster.swift.container.crawler """
+
+    def setUp(self):
+        _initxattr()
+        self.td = tempfile.mkdtemp()
+        self.devices = os.path.join(self.td, 'devices')
+        self.checkpoint_file = os.path.join(self.td, 'checkpoint.json')
+        os.makedirs(os.path.join(self.devices, 'gsexpiring', 'queue'))
+        self.logger = FakeLogger()
+        self.crawler = crawler.ContainerCrawler(
+            {'devices': self.devices, 'mount_check': 'false',
+             'checkpoint_file': self.checkpoint_file,
+             'objects_per_second': '0'},
+            logger=self.logger)
+
+    def tearDown(self):
+        _destroyxattr()
+        shutil.rmtree(self.td)
+
+    def _create_container(self, volume, container, objects=()):
+        cont_path = os.path.join(self.devices, volume, container)
+        os.makedirs(cont_path)
+        utils.create_container_metadata(cont_path)
+        for name in objects:
+            path = os.path.join(cont_path, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as fp:
+                fp.write(name)
+        return cont_path
+
+    def _get_counts(self, cont_path):
+        metadata = utils.read_metadata(cont_path)
+        return (metadata[utils.X_OBJECTS_COUNT][0],
+                metadata[utils.X_BYTES_USED][0])
+
+    def test_run_once(self):
+        c1 = self._create_container('vol1', 'c1', ('a', 'b/c'))
+        c2 = self._create_container('vol2', 'c2', ('d',))
+        with patch('gluster.swift.common.Glusterfs._do_getsize', True):
+            self.crawler.run_once()
+        self.assertEqual(self._get_counts(c1), (2, len('a') + len('b/c')))
+        self.assertEqual(self._get_counts(c2), (1, len('d')))
+        self.assertEqual(sorted(self.logger.log_dict['update_stats']),
+                         [(('objects', 1), {}), (('objects', 2), {})])
+        self.assertEqual(len(self.logger.log_dict['timing_since']), 3)
+        # A completed crawl leaves no checkpoint behind
+        with open(self.checkpoint_file) as fp:
+            self.assertEqual(json.load(fp), {})
+
+    def test_expiring_account_is_skipped(self):
+        self.assertEqual(self.crawler.get_volumes(), [])
+
+    def test_resume_from_checkpoint(self):
+        self._create_container('vol', 'c1', ('a',))
+        c2 = self._create_container('vol', 'c2', ('a', 'b'))
+        with open(self.checkpoint_file, 'w') as fp:
+            json.dump({'vol': 'c1'}, fp)
+        with patch.object(self.crawler, 'crawl_container',
+                          return_value=0) as _crawl:
+            self.crawler.run_once()
+        self.assertEqual(_crawl.call_count, 1)
+        self.assertEqual(_crawl.call_args[0][:2], (os.path.dirname(c2), 'c2'))
+
+    def test_checkpoint_is_saved(self):
+        for container in ('c1', 'c2', 'c3'):
+            self._create_container('vol', container)
+        self.crawler.checkpoint_interval = 0
+        saved = []
+
+        def _crawl_container(vol_path, container, pace=None):
+            if os.path.exists(self.checkpoint_file):
+                with open(self.checkpoint_file) as fp:
+                    saved.append(json.load(fp))
+            return 0
+
+        with patch.object(self.crawler, 'crawl_container',
+                          side_effect=_crawl_container):
+            self.crawler.concurrency = 1
+            self.crawler.run_once()
+        self.assertEqual(saved, [{'vol': 'c1'}, {'vol': 'c2'}])
+
+    def test_failed_container_does_not_stop_crawl(self):
+        self._create_container('vol', 'c1')
+        c2 = self._create_container('vol', 'c2', ('a',))
+        _orig_crawl = self.crawler.crawl_container
+
+        def _crawl_container(vol_path, container, pace=None):
+            if container == 'c1':
+                raise OSError('failed')
+            return _orig_crawl(vol_path, container, pace)
+
+        with patch.object(self.crawler, 'crawl_container',
+                          side_effect=_crawl_container):
+            self.crawler.run_once()
+        self.assertEqual(self._get_counts(c2)[0], 1)
+        self.assertEqual(self.logger.log_dict['increment'],
+                         [(('errors',), {})])
+
+    def test_rate_limit(self):
+        for container in ('c1', 'c2'):
+            self._create_container('vol', container, ('a', 'b/c', 'b/d/e'))
+        self.crawler.objects_per_second = 10
+        calls = []
+
+        def _ratelimit_sleep(running_time, max_rate, incr_by=1):
+            calls.append((max_rate, incr_by))
+            return running_time
+
+        with patch.object(crawler, 'ratelimit_sleep', _ratelimit_sleep):
+            self.crawler.run_once()
+        # Charged directory by directory as containers are walked
+        self.assertEqual(sorted(calls), [(10, 1), (10, 1), (10, 2), (10, 2),
+                                         (10, 2), (10, 2)])
+
+        # And by batch of objects while rebuilding an index
+        index = ContainerIndex(os.path.join(self.devices, 'vol'), 'c1')
+        index.create(ready=True)
+        del calls[:]
+        with patch.object(crawler, 'ratelimit_sleep', _ratelimit_sleep):
+            with patch('gluster.swift.common.Glusterfs._container_index',
+                       True):
+                self.crawler.run_once()
+        self.assertEqual(sorted(calls), [(10, 1), (10, 2), (10, 2),
+                                         (10, 3)])
+
+    def test_rate_limit_existence_filter(self):
+        self._create_container('vol', 'c', ('a', 'b/c'))
+        calls = []
+
+        def _pace(count):
+            calls.append(count)
+
+        with patch('gluster.swift.common.Glusterfs._existence_filter', True):
+            self.crawler.crawl_container(os.path.join(self.devices, 'vol'),
+                                         'c', _pace)
+        # Walked once, the filter being fed the names found while counting
+        self.assertEqual(sorted(calls), [1, 2])
+
+    def test_metadata_changed_during_walk(self):
+        cont_path = self._create_container('vol', 'c', ('a', 'b/c'))
+
+        def _pace(count):
+            # Container POST while the container is walked
+            metadata = utils.read_metadata(cont_path)
+            metadata['X-Container-Meta-Color'] = ('blue', 0)
+            utils.write_metadata(cont_path, metadata)
+
+        self.crawler.crawl_container(os.path.join(self.devices, 'vol'), 'c',
+                                     _pace)
+        metadata = utils.read_metadata(cont_path)
+        self.assertEqual(metadata['X-Container-Meta-Color'], ('blue', 0))
+        self.assertEqual(self._get_counts(cont_path), (2, 0))
+
+    def test_container_index(self):
+        cont_path = self._create_container('vol', 'c', ('a', 'b'))
+        index = ContainerIndex(os.path.join(self.devices, 'vol'), 'c')
+        index.create(ready=True)
+        with patch('gluster.swift.common.Glusterfs._container_index', True):
+            self.crawler.run_once()
+        # The index is rebuilt and its counters are used
+        self.assertEqual(list(index.iter_names()), ['a', 'b'])
+        self.assertEqual(self._get_counts(cont_path), (2, 2))
+
+    def test_existence_filter(self):
+        self._create_container('vol', 'c', ('a', 'b/c'))
+        vol_path = os.path.join(self.devices, 'vol')
+        with patch('gluster.swift.common.Glusterfs._existence_filter', True):
+            self.crawler.run_once()
+            # Created for containers that had none
+            for name in ('a', 'b', 'b/c'):
+                self.assertFalse(existence_filter.is_absent(vol_path, 'c',
+                                                            name))
+            self.assertTrue(existence_filter.is_absent(vol_path, 'c', 'd'))
+        self.assertEqual(utils.get_account_details(vol_path)[0], ['c'])
+
+    def test_existence_filter_container_index(self):
+        self._create_container('vol', 'c', ('a', 'b/c/d'))
+        vol_path = os.path.join(self.devices, 'vol')
+        ContainerIndex(vol_path, 'c').create(ready=True)
+        with nested(
+                patch('gluster.swift.common.Glusterfs._existence_filter',
+                      True),
+                patch('gluster.swift.common.Glusterfs._container_index',
+                      True),
+                patch.object(utils, 'get_container_details',
+                             side_effect=AssertionError)):
+            self.crawler.run_once()
+            # Parent directories are added along with the indexed objects
+            for name in ('a', 'b', 'b/c', 'b/c/d'):
+                self.assertFalse(existence_filter.is_absent(vol_path, 'c',
+                                                            name))
+            self.assertTrue(existence_filter.is_absent(vol_path, 'c', 'd'))
+
+    def test_container_without_metadata(self):
+        cont_path = os.path.join(self.devices, 'vol', 'c')
+        os.makedirs(cont_path)
+        self.crawler.run_once()
+        self.assertEqual(utils.read_metadata(cont_path), {})
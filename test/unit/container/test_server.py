@@ -17,7 +17,9 @@
 
 import unittest
 from nose import SkipTest
+from mock import patch
 
+from swift.common.swob import Request
 import gluster.swift.container.server as server
 
 
@@ -28,3 +30,44 @@ class TestContainerServer(unittest.TestCase):
 
     def test_constructor(self):
         raise SkipTest
+
+    def test_create_streaming_listing(self):
+        controller = server.ContainerController({'devices': '/tmp',
+                                                 'mount_check': 'false'})
+        req = Request.blank('/d/p/a/c')
+        records = [('o', '1.00000', 3, 'text/plain', 'e'),
+                   ('o&<>"', '2.00000', 0, 'text/plain;swift_bytes=7', 'f'),
+                   ('d/', None, 0, None, '')]
+        metadata = {'X-Container-Meta-Color': ('blue', 0)}
+        for content_type in ('application/json', 'application/xml',
+                             'text/plain'):
+            expected = controller.create_listing(
+                req, content_type, {}, {'X-PUT-Timestamp': '1'}, metadata,
+                records, 'c')
+            with patch.object(server, 'iter_listing_chunks',
+                              lambda pieces: pieces):
+                resp = controller.create_streaming_listing(
+                    req, content_type, {}, {'X-PUT-Timestamp': '1'},
+                    metadata, iter(records), 'c')
+                chunks = list(resp.app_iter)
+            # One chunk per entry, plus the opening and closing ones
+            self.assertTrue(len(chunks) >= len(records))
+            self.assertEqual(''.join(chunks), expected.body)
+            self.assertEqual(resp.headers['Content-Type'],
+                             expected.headers['Content-Type'])
+            self.assertEqual(resp.headers['X-Container-Meta-Color'], 'blue')
+            self.assertEqual(resp.last_modified, expected.last_modified)
+
+    def test_create_streaming_listing_empty(self):
+        controller = server.ContainerController({'devices': '/tmp',
+                                                 'mount_check': 'false'})
+        req = Request.blank('/d/p/a/c')
+        resp = controller.create_streaming_listing(
+            req, 'text/plain', {}, {'X-PUT-Timestamp': '1'}, {}, iter([]),
+            'c')
+        self.assertEqual(resp.status_int, 204)
+        resp = controller.create_streaming_listing(
+            req, 'application/json', {}, {'X-PUT-Timestamp': '1'}, {},
+            iter([]), 'c')
+        self.assertEqual(resp.status_int, 200)
+        self.assertEqual(resp.body, '[]')
@@ -38,7 +38,8 @@ from gluster.swift.common.utils import normalize_timestamp
 import gluster.swift.obj.diskfile
 from gluster.swift.obj.diskfile import DiskFileWriter, DiskFileManager
 from gluster.swift.common.utils import DEFAULT_UID, DEFAULT_GID, \
-    X_OBJECT_TYPE, DIR_OBJECT
+    X_OBJECT_TYPE, DIR_OBJECT, X_CONTENT_SIGNATURE, get_content_signature, \
+    SysMetadata
 
 from test.unit.common.test_utils import _initxattr, _destroyxattr
 from test.unit import FakeLogger
@@ -65,7 +66,7 @@ def _mock_read_metadata(filename_or_fd):
     return md
 
 
-def _mock_write_metadata(filename_or_fd, metadata):
+def _mock_write_metadata(filename_or_fd, metadata, orig_metadata=None):
     global _metadata
     ino = _mapit(filename_or_fd)
     _metadata[ino] = metadata
@@ -186,7 +187,8 @@ class TestDiskFile(unittest.TestCase):
             'Content-Length': 4,
             'ETag': etag,
             'X-Timestamp': ts,
-            'Content-Type': 'application/octet-stream'}
+            'Content-Type': 'application/octet-stream',
+            'X-Content-Signature': get_content_signature(stats)}
         gdf = self._get_diskfile("vol0", "p57", "ufo47", "bar", "z")
         assert gdf._obj == "z"
         assert gdf._fd is None
@@ -310,6 +312,54 @@ class TestDiskFile(unittest.TestCase):
             assert gdf._disk_file_open is True
         assert gdf._disk_file_open is False
 
+    def test_open_signature_unchanged(self):
+        the_path = os.path.join(self.td, "vol0", "bar")
+        the_file = os.path.join(the_path, "z")
+        os.makedirs(the_path)
+        with open(the_file, "wb") as fd:
+            fd.write("1234")
+        ini_md = {
+            'X-Type': 'Object',
+            'X-Object-Type': 'file',
+            'Content-Length': 4,
+            'ETag': 'etag',
+            'X-Timestamp': 'ts',
+            'Content-Type': 'application/loctet-stream',
+            'X-Content-Signature': get_content_signature(os.stat(the_file))}
+        _metadata[_mapit(the_file)] = ini_md
+        gdf = self._get_diskfile("vol0", "p57", "ufo47", "bar", "z")
+        with patch("gluster.swift.common.utils._get_etag",
+                   Mock(side_effect=AssertionError("md5 computed"))):
+            with gdf.open():
+                self.assertEqual(gdf._metadata['ETag'], 'etag')
+
+    def test_open_same_length_content_changed(self):
+        the_path = os.path.join(self.td, "vol0", "bar")
+        the_file = os.path.join(the_path, "z")
+        os.makedirs(the_path)
+        with open(the_file, "wb") as fd:
+            fd.write("1234")
+        ini_md = {
+            'X-Type': 'Object',
+            'X-Object-Type': 'file',
+            'Content-Length': 4,
+            'ETag': 'etag',
+            'X-Timestamp': 'ts',
+            'Content-Type': 'application/loctet-stream',
+            'X-Content-Signature': get_content_signature(os.stat(the_file))}
+        _metadata[_mapit(the_file)] = ini_md
+        # Rewritten in place over FUSE, with the same length
+        with open(the_file, "r+b") as fd:
+            fd.write("5678")
+        stats = os.stat(the_file)
+        os.utime(the_file, (stats.st_atime, stats.st_mtime + 1))
+        stats = os.stat(the_file)
+        gdf = self._get_diskfile("vol0", "p57", "ufo47", "bar", "z")
+        with gdf.open():
+            self.assertEqual(gdf._metadata['ETag'], md5("5678").hexdigest())
+        self.assertEqual(_metadata[_mapit(the_file)][X_CONTENT_SIGNATURE],
+                         get_content_signature(stats))
+
     def test_open_isdir(self):
         the_path = os.path.join(self.td, "vol0", "bar")
         the_dir = os.path.join(the_path, "d")
@@ -739,6 +789,9 @@ class TestDiskFile(unittest.TestCase):
 
         assert os.path.exists(gdf._data_file)
         assert not os.path.exists(tmppath)
+        self.assertEqual(
+            _metadata[_mapit(gdf._data_file)][X_CONTENT_SIGNATURE],
+            get_content_signature(os.stat(gdf._data_file)))
 
     def test_put_ENOSPC(self):
         the_cont = os.path.join(self.td, "vol0", "bar")
@@ -846,6 +899,148 @@ class TestDiskFile(unittest.TestCase):
         assert os.path.exists(gdf._data_file)
         assert not os.path.exists(tmppath)
 
+    def test_put_updates_container_index(self):
+        gdf = self._get_diskfile("vol0", "p57", "ufo47", "bar", "/b/a/z")
+        metadata = {
+            'X-Timestamp': '1234',
+            'Content-Type': 'file',
+            'ETag': md5('1234').hexdigest(),
+            'Content-Length': '4',
+        }
+        with patch("gluster.swift.obj.diskfile.index_add") as _index_add:
+            with gdf.create() as dw:
+                dw.write('1234')
+                dw.put(metadata)
+        _index_add.assert_called_once_with(
+            os.path.join(self.td, "vol0"), "bar", "b/a/z", 4)
+
+    def test_put_dir_object_updates_container_index(self):
+        os.makedirs(os.path.join(self.td, "vol0", "bar"))
+        gdf = self._get_diskfile("vol0", "p57", "ufo47", "bar", "dir")
+        metadata = {
+            'X-Timestamp': '1234',
+            'Content-Type': 'application/directory',
+            'ETag': md5().hexdigest(),
+            'Content-Length': '0',
+            X_OBJECT_TYPE: DIR_OBJECT,
+        }
+        with patch("gluster.swift.obj.diskfile.index_add") as _index_add:
+            with gdf.create() as dw:
+                dw.put(metadata)
+        _index_add.assert_called_once_with(
+            os.path.join(self.td, "vol0"), "bar", "dir")
+
+    def test_put_updates_existence_filter(self):
+        gdf = self._get_diskfile("vol0", "p57", "ufo47", "bar", "/b/a/z")
+        metadata = {
+            'X-Timestamp': '1234',
+            'Content-Type': 'file',
+            'ETag': md5('1234').hexdigest(),
+            'Content-Length': '4',
+        }
+        with patch("gluster.swift.obj.diskfile.filter_add") as _filter_add:
+            with gdf.create() as dw:
+                dw.write('1234')
+                dw.put(metadata)
+        _filter_add.assert_called_once_with(
+            os.path.join(self.td, "vol0"), "bar", "b/a/z")
+
+    def test_open_reads_sys_metadata(self):
+        the_path = os.path.join(self.td, "vol0", "bar")
+        the_file = os.path.join(the_path, "z")
+        os.makedirs(the_path)
+        with open(the_file, "wb") as fd:
+            fd.write("1234")
+        sys_metadata = {
+            'X-Timestamp': normalize_timestamp(1),
+            'Content-Type': 'text/plain',
+            'ETag': md5('1234').hexdigest(),
+            'Content-Length': '4',
+            'X-Type': 'Object',
+            'X-Object-Type': 'file',
+            X_CONTENT_SIGNATURE: get_content_signature(os.stat(the_file)),
+        }
+        metadata = dict(sys_metadata)
+        metadata['X-Object-Meta-Color'] = 'blue'
+        _mock_write_metadata(the_file, metadata)
+        _m_rmd = Mock(side_effect=_mock_read_metadata)
+        with nested(
+                patch("gluster.swift.obj.diskfile.read_sys_metadata",
+                      Mock(side_effect=lambda p: SysMetadata(sys_metadata))),
+                patch("gluster.swift.obj.diskfile.read_metadata", _m_rmd)):
+            gdf = self._get_diskfile("vol0", "p57", "ufo47", "bar", "z")
+            with gdf.open():
+                md = gdf.get_metadata()
+                self.assertEqual(md['ETag'], md5('1234').hexdigest())
+                self.assertFalse('X-Delete-At' in md)
+                # Read once a response needs the user metadata
+                self.assertFalse(_m_rmd.called)
+                self.assertEqual(md['X-Object-Meta-Color'], 'blue')
+                _m_rmd.assert_called_once_with(gdf._fd)
+            self.assertFalse(X_OBJECT_TYPE in md)
+            self.assertFalse('X-Type' in md)
+
+            # From the file handed over to the reader of a GET
+            _m_rmd.reset_mock()
+            gdf = self._get_diskfile("vol0", "p57", "ufo47", "bar", "z")
+            with gdf.open():
+                md = gdf.get_metadata()
+                reader = gdf.reader()
+                self.assertEqual(md['X-Object-Meta-Color'], 'blue')
+                _m_rmd.assert_called_once_with(reader._fd)
+            reader.close()
+
+            _m_rmd.reset_mock()
+            gdf = self._get_diskfile("vol0", "p57", "ufo47", "bar", "z")
+            md = gdf.read_metadata()
+            gdf.delete(normalize_timestamp(2))
+            self.assertFalse(_m_rmd.called)
+            self.assertFalse(os.path.exists(the_file))
+
+    def test_open_sys_metadata_complete(self):
+        the_path = os.path.join(self.td, "vol0", "bar")
+        the_file = os.path.join(the_path, "z")
+        os.makedirs(the_path)
+        with open(the_file, "wb") as fd:
+            fd.write("1234")
+        sys_metadata = SysMetadata({
+            'X-Timestamp': normalize_timestamp(1),
+            'Content-Type': 'text/plain',
+            'ETag': md5('1234').hexdigest(),
+            'Content-Length': '4',
+            'X-Type': 'Object',
+            'X-Object-Type': 'file',
+            X_CONTENT_SIGNATURE: get_content_signature(os.stat(the_file)),
+        })
+        sys_metadata.complete = True
+        _mock_write_metadata(the_file, sys_metadata)
+        _m_rmd = Mock(side_effect=_mock_read_metadata)
+        with nested(
+                patch("gluster.swift.obj.diskfile.read_sys_metadata",
+                      Mock(return_value=sys_metadata)),
+                patch("gluster.swift.obj.diskfile.read_metadata", _m_rmd)):
+            gdf = self._get_diskfile("vol0", "p57", "ufo47", "bar", "z")
+            with gdf.open():
+                md = gdf.get_metadata()
+                # No user metadata to read
+                self.assertFalse('X-Object-Meta-Color' in md)
+                self.assertEqual(sorted(md.iteritems()), sorted(
+                    (key, value) for key, value in sys_metadata.iteritems()
+                    if key not in ('X-Type', X_OBJECT_TYPE)))
+        self.assertFalse(_m_rmd.called)
+
+    def test_delete_updates_container_index(self):
+        the_path = os.path.join(self.td, "vol0", "bar", "b")
+        os.makedirs(the_path)
+        with open(os.path.join(the_path, "z"), "wb") as fd:
+            fd.write("1234")
+        gdf = self._get_diskfile("vol0", "p57", "ufo47", "bar", "b/z")
+        later = float(gdf.read_metadata()['X-Timestamp']) + 1
+        with patch("gluster.swift.obj.diskfile.index_remove") as _index_rm:
+            gdf.delete(normalize_timestamp(later))
+        _index_rm.assert_called_once_with(
+            os.path.join(self.td, "vol0"), "bar", "b/z")
+
     def test_delete(self):
         the_path = os.path.join(self.td, "vol0", "bar")
         the_file = os.path.join(the_path, "z")
@@ -13,6 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import urllib
 from time import time
 from unittest import main, TestCase
@@ -25,6 +26,7 @@ import mock
 
 from swift.common import internal_client, utils
 from swift.obj import expirer
+from gluster.swift.obj.expirer import GlusterSwiftInternalClient
 
 
 def not_random():
@@ -768,5 +770,40 @@ class TestObjectExpirer(TestCase):
             self.assertEqual(obj, 'o')
 
 
+class TestGlusterSwiftInternalClient(TestCase):
+
+    def setUp(self):
+        self.devices = mkdtemp()
+        with mock.patch.object(internal_client, 'loadapp'):
+            self.client = GlusterSwiftInternalClient(
+                None, 'test', 1, devices=self.devices)
+
+    def tearDown(self):
+        rmtree(self.devices)
+
+    def test_iter_objects(self):
+        cont_path = os.path.join(self.devices, 'gsexpiring', 'c')
+        os.makedirs(os.path.join(cont_path, 'b'))
+        for name in ('b/o', 'a'):
+            open(os.path.join(cont_path, name), 'w').close()
+        self.assertEqual(
+            list(self.client.iter_objects('gsexpiring', 'c')),
+            [{'name': u'a'}, {'name': u'b/o'}])
+
+    def test_iter_objects_missing_container(self):
+        self.assertEqual(
+            list(self.client.iter_objects('gsexpiring', 'c')), [])
+        self.assertEqual(
+            list(self.client.iter_objects('gsexpiring', 'c',
+                                          acceptable_statuses=(2, 4))), [])
+        try:
+            list(self.client.iter_objects('gsexpiring', 'c',
+                                          acceptable_statuses=(2,)))
+        except internal_client.UnexpectedResponse as err:
+            self.assertEqual(err.resp.status_int, 404)
+        else:
+            self.fail('UnexpectedResponse not raised')
+
+
 if __name__ == '__main__':
     main()
@@ -15,10 +15,18 @@
 
 """ Tests for gluster.swift.obj.server subclass """
 
+import os
+import shutil
+import tempfile
 import unittest
+from contextlib import nested
 from nose import SkipTest
+from mock import patch
 
+from swift.common.swob import Request, Response
+from gluster.swift.common import existence_filter
 import gluster.swift.obj.server as server
+from test.unit import FakeLogger
 
 
 class TestObjServer(unittest.TestCase):
@@ -28,3 +36,109 @@ class TestObjServer(unittest.TestCase):
 
     def test_constructor(self):
         raise SkipTest
+
+    def test_existence_probe(self):
+        td = tempfile.mkdtemp()
+        try:
+            with patch.object(server.ObjectController, 'get_object_ring'):
+                controller = server.ObjectController(
+                    {'devices': td, 'mount_check': 'false'},
+                    logger=FakeLogger())
+            responses = []
+
+            def _handler(controller, request):
+                return responses.pop(0)
+
+            def _probe():
+                return controller._existence_probe(
+                    Request.blank('/vol/0/vol/c/o',
+                                  environ={'REQUEST_METHOD': 'HEAD'}),
+                    _handler)
+
+            with nested(
+                    patch('gluster.swift.common.Glusterfs._existence_filter',
+                          True),
+                    patch('gluster.swift.common.Glusterfs.'
+                          '_existence_filter_refresh', 0)):
+                # No filter
+                responses.append(Response(status=200))
+                self.assertEqual(_probe().status_int, 200)
+
+                existence_filter.create_filter(os.path.join(td, 'vol'), 'c')
+                with patch('gluster.swift.common.Glusterfs.'
+                           '_existence_filter_verify', 0):
+                    self.assertEqual(_probe().status_int, 404)
+                self.assertEqual(controller.logger.get_increment_counts(),
+                                 {'existence_filter.absent': 1})
+
+                # Created over FUSE and found while verifying
+                with patch('gluster.swift.common.Glusterfs.'
+                           '_existence_filter_verify', 1):
+                    responses.append(Response(status=200))
+                    self.assertEqual(_probe().status_int, 200)
+                self.assertFalse(os.path.exists(
+                    existence_filter.get_filter_path(os.path.join(td, 'vol'),
+                                                     'c')))
+                self.assertEqual(
+                    controller.logger.get_increment_counts()[
+                        'existence_filter.missed'], 1)
+        finally:
+            existence_filter._cache.clear()
+            shutil.rmtree(td)
+
+    def test_existence_probe_dir_marker(self):
+        td = tempfile.mkdtemp()
+        try:
+            with patch.object(server.ObjectController, 'get_object_ring'):
+                controller = server.ObjectController(
+                    {'devices': td, 'mount_check': 'false'},
+                    logger=FakeLogger())
+
+            def _handler(controller, request):
+                return Response(status=200)
+
+            with nested(
+                    patch('gluster.swift.common.Glusterfs._existence_filter',
+                          True),
+                    patch('gluster.swift.common.Glusterfs.'
+                          '_existence_filter_verify', 0)):
+                vol_path = os.path.join(td, 'vol')
+                existence_filter.create_filter(vol_path, 'c')
+                # Directory marker PUT as "photos/", added as "photos"
+                existence_filter.filter_add(vol_path, 'c', 'photos')
+                for path in ('/vol/0/vol/c/photos/', '/vol/0/vol/c/photos'):
+                    resp = controller._existence_probe(
+                        Request.blank(path,
+                                      environ={'REQUEST_METHOD': 'HEAD'}),
+                        _handler)
+                    self.assertEqual(resp.status_int, 200)
+                self.assertFalse(controller.logger.get_increment_counts())
+        finally:
+            existence_filter._cache.clear()
+            shutil.rmtree(td)
+
+    def test_get_head_timed_once(self):
+        td = tempfile.mkdtemp()
+        try:
+            with patch.object(server.ObjectController, 'get_object_ring'):
+                controller = server.ObjectController(
+                    {'devices': td, 'mount_check': 'false'},
+                    logger=FakeLogger())
+
+            def _handler(controller, request):
+                return Response(status=200)
+
+            # Swift's methods, which the wrappers call, are timed already
+            with nested(
+                    patch.object(server.server.ObjectController, 'GET',
+                                 _handler),
+                    patch.object(server.server.ObjectController, 'HEAD',
+                                 _handler)):
+                for method in ('GET', 'HEAD'):
+                    resp = Request.blank('/vol/0/vol/c/o',
+                                         environ={'REQUEST_METHOD': method}
+                                         ).get_response(controller)
+                    self.assertEqual(resp.status_int, 200)
+            self.assertFalse(controller.logger.log_dict['timing_since'])
+        finally:
+            shutil.rmtree(td)